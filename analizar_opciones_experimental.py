@@ -1,16 +1,140 @@
 import os
-import yfinance as yf
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-import requests
-from tabulate import tabulate
+import importlib
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import threading
+import json
+import hashlib
+import time
+import random
+import heapq
+import queue
+import subprocess
+import sys
+import zlib
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import shutil
+import signal
+import urllib.parse
+
+class LazyModule:
+    """
+    Módulo que se importa la primera vez que se usa uno de sus atributos. yfinance, pandas, numpy,
+    requests y tabulate tardan en importarse más que una ejecución sin nada que hacer (grupo no
+    válido, sin tickers o mercado cerrado), así que solo se cargan cuando una etapa los usa.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+yf = LazyModule("yfinance")
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+requests = LazyModule("requests")
+
+def tabulate(*args, **kwargs):
+    from tabulate import tabulate as _tabulate
+    return _tabulate(*args, **kwargs)
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Número máximo de tickers que se procesan en paralelo
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", 4))
+
+# Instante de referencia del análisis; None usa el reloj real (el modo replay fija el de la grabación)
+_analysis_time = None
+
+def analysis_now():
+    return _analysis_time or datetime.now()
+
+def set_analysis_time(value):
+    global _analysis_time
+    _analysis_time = value
+
+# Sesiones de la bolsa de Nueva York: los festivos se calculan por reglas (sin dependencias) y
+# MARKET_HOLIDAYS añade cierres extraordinarios ("YYYY-MM-DD,YYYY-MM-DD")
+def _nth_weekday(year, month, weekday, n):
+    """n-ésimo día de la semana (0 = lunes) del mes; n = -1 es el último."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+def _observed(day):
+    """Día en que se observa un festivo fijo: el viernes si cae en sábado, el lunes si cae en domingo."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+def _easter(year):
+    """Domingo de Pascua (algoritmo gregoriano anónimo)."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * l) // 433
+    month = (h + l - 7 * m + 90) // 25
+    return date(year, month, (h + l - 7 * m + 33 * month + 19) % 32)
+
+def market_holidays(year):
+    """Festivos de la bolsa de Nueva York en un año: {fecha en que se observa: nombre}."""
+    holidays = {
+        _nth_weekday(year, 1, 0, 3): "Martin Luther King Jr. Day",
+        _nth_weekday(year, 2, 0, 3): "Presidents' Day",
+        _easter(year) - timedelta(days=2): "Viernes Santo",
+        _nth_weekday(year, 5, 0, -1): "Memorial Day",
+        _observed(date(year, 7, 4)): "Día de la Independencia",
+        _nth_weekday(year, 9, 0, 1): "Labor Day",
+        _nth_weekday(year, 11, 3, 4): "Acción de Gracias",
+        _observed(date(year, 12, 25)): "Navidad",
+    }
+    # El Año Nuevo en sábado no se observa el viernes anterior (sería el 31 de diciembre)
+    if date(year, 1, 1).weekday() != 5:
+        holidays[_observed(date(year, 1, 1))] = "Año Nuevo"
+    if year >= 2022:
+        holidays[_observed(date(year, 6, 19))] = "Juneteenth"
+    return holidays
+
+def market_date():
+    """Fecha en Nueva York del instante del análisis (un instante sin zona se toma como hora local)."""
+    try:
+        from zoneinfo import ZoneInfo
+        new_york = ZoneInfo("America/New_York")
+    except Exception:
+        # Sin base de datos de zonas horarias: hora estándar del este
+        new_york = timezone(timedelta(hours=-5))
+    return analysis_now().astimezone(new_york).date()
+
+def market_closed_reason(day):
+    """Motivo por el que el mercado de EE. UU. no abre el día indicado, o None si hay sesión."""
+    if day.weekday() >= 5:
+        return "fin de semana"
+    extra = {value.strip() for value in os.getenv("MARKET_HOLIDAYS", "").split(",") if value.strip()}
+    if day.isoformat() in extra:
+        return "cierre extraordinario (MARKET_HOLIDAYS)"
+    return market_holidays(day.year).get(day)
+
+# Requerimos al menos 10 días para un cálculo significativo de la volatilidad histórica
+MIN_HIST_VOL_DAYS = 10
+
 # Lista estática de tickers del NASDAQ-100 (como solución temporal)
 NASDAQ_100_TICKERS = [
     "AAPL", "MSFT", "AMZN", "GOOGL", "META", "TSLA", "NVDA", "PEP", "COST", "CSCO",
@@ -25,6 +149,34 @@ NASDAQ_100_TICKERS = [
     "NDAQ", "TTWO", "ON", "ENPH", "CEG", "FANG", "GFS", "GEHC"
 ]
 
+# Directorio de los archivos de constituyentes de los índices de las fuentes dinámicas
+# (<dir>/<índice>.csv con una columna Symbol/Ticker, o <dir>/<índice>.txt con un símbolo por línea)
+CONSTITUENTS_DIR = os.getenv("CONSTITUENTS_DIR", "constituyentes")
+
+def load_constituents(path):
+    """
+    Lee los símbolos de un archivo de constituyentes, en el formato de Yahoo (BRK.B -> BRK-B),
+    sin duplicados y en el orden del archivo. En los .txt se ignoran las líneas vacías y los comentarios (#).
+    """
+    if path.lower().endswith(".csv"):
+        df = pd.read_csv(path, dtype=str)
+        columns = {column.strip().lower(): column for column in df.columns}
+        column = next((columns[name] for name in ("symbol", "ticker", "símbolo", "simbolo") if name in columns), df.columns[0])
+        symbols = df[column].dropna().tolist()
+    else:
+        with open(path) as f:
+            symbols = [line.split("#", 1)[0] for line in f]
+    symbols = [symbol.strip().upper().replace(".", "-") for symbol in symbols]
+    return list(dict.fromkeys(symbol for symbol in symbols if symbol))
+
+def constituents_path(index):
+    """Archivo de constituyentes de un índice en CONSTITUENTS_DIR (None si no existe)."""
+    for extension in (".csv", ".txt"):
+        path = os.path.join(CONSTITUENTS_DIR, f"{index}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
 # Configuración predeterminada para todos los grupos (valores por defecto)
 BASE_CONFIG = {
     "MIN_RENTABILIDAD_ANUAL": 45.0,
@@ -39,68 +191,109 @@ BASE_CONFIG = {
     "MIN_BID": 0.99,
     "ALERTA_RENTABILIDAD_ANUAL": 50.0,
     "ALERTA_VOLATILIDAD_MINIMA": 50.0,
+    # Métricas Black-Scholes; los filtros y alertas con valor None no se aplican
+    "TASA_LIBRE_RIESGO": 4.0,  # % anual
+    "MAX_DELTA": None,  # |delta| máximo del put
+    "MIN_PROB_OTM": None,  # % mínimo de probabilidad de expirar OTM
+    "ALERTA_MAX_DELTA": None,
+    "ALERTA_MIN_PROB_OTM": None,
+    # Origen de la volatilidad implícita: "yahoo" (campo impliedVolatility), o resuelta con
+    # Black-Scholes a partir del precio "mid" (bid/ask) o del "bid"
+    "FUENTE_VOLATILIDAD": "yahoo",
+    # Lados a analizar con la misma descarga: puts con garantía en efectivo y calls cubiertas
+    "ESCANEAR_PUTS": True,
+    "ESCANEAR_CALLS": False,
+    # Spreads de crédito (bull put, bear call) e iron condors sobre las mismas cadenas
+    "SPREADS_ACTIVOS": False,
+    "SPREAD_MAX_ANCHO": 10.0,  # $ entre strikes
+    "SPREAD_MIN_CREDITO": 0.10,  # $ por acción
+    "SPREAD_MIN_RETORNO_RIESGO": 20.0,  # % crédito / pérdida máxima
+    "SPREAD_MIN_DIFERENCIA_PORCENTUAL": 3.0,  # % entre el subyacente y el break-even
+    # Modo incremental: compara los contratos de alerta con los de la ejecución anterior del grupo,
+    # notifica solo los nuevos, modificados y retirados y reutiliza el reporte de los tickers sin cambios
+    "MODO_INCREMENTAL": False,
+    "INCREMENTAL_CAMBIO_BID": 10.0,  # % de variación del bid para considerar un contrato modificado
+    "INCREMENTAL_CAMBIO_RENTABILIDAD": 5.0,  # puntos de rentabilidad anual
+    # Alertas a Discord en cuanto cada ticker las produce (sin repetir contratos ya alertados), en lugar
+    # de un único mensaje con Mejores_Contratos.txt al terminar (que se sigue enviando si se fuerza).
+    # En modo incremental se alertan solo los contratos nuevos o modificados de cada ticker, y los retirados
+    # se notifican al terminar con Cambios_Contratos.txt
+    "DISCORD_ALERTAS_INMEDIATAS": True,
 }
 
+def config_value(config, key):
+    """Valor de `key` en la configuración del grupo, o el de BASE_CONFIG si el grupo no lo define."""
+    return config.get(key, BASE_CONFIG[key])
+
+def env_group_config():
+    """Configuración de los grupos ajustable con variables de entorno (se lee al resolver el grupo)."""
+    return {
+        "MIN_RENTABILIDAD_ANUAL": float(os.getenv("MIN_RENTABILIDAD_ANUAL", BASE_CONFIG["MIN_RENTABILIDAD_ANUAL"])),
+        "MAX_DIAS_VENCIMIENTO": int(os.getenv("MAX_DIAS_VENCIMIENTO", BASE_CONFIG["MAX_DIAS_VENCIMIENTO"])),
+        "MIN_DIFERENCIA_PORCENTUAL": float(os.getenv("MIN_DIFERENCIA_PORCENTUAL", BASE_CONFIG["MIN_DIFERENCIA_PORCENTUAL"])),
+        "MIN_VOLATILIDAD_IMPLICITA": float(os.getenv("MIN_VOLATILIDAD_IMPLICITA", BASE_CONFIG["MIN_VOLATILIDAD_IMPLICITA"])),
+        "MIN_VOLUMEN": int(os.getenv("MIN_VOLUMEN", BASE_CONFIG["MIN_VOLUMEN"])),
+        "MIN_OPEN_INTEREST": int(os.getenv("MIN_OPEN_INTEREST", BASE_CONFIG["MIN_OPEN_INTEREST"])),
+        "FILTRO_TIPO_OPCION": os.getenv("FILTRO_TIPO_OPCION", BASE_CONFIG["FILTRO_TIPO_OPCION"]),
+        "TOP_CONTRATOS": int(os.getenv("TOP_CONTRATOS", BASE_CONFIG["TOP_CONTRATOS"])),
+        "FORCE_DISCORD_NOTIFICATION": os.getenv("FORCE_DISCORD_NOTIFICATION", str(BASE_CONFIG["FORCE_DISCORD_NOTIFICATION"])).lower() == "true",
+        "MIN_BID": float(os.getenv("MIN_BID", BASE_CONFIG["MIN_BID"])),
+        "ALERTA_RENTABILIDAD_ANUAL": float(os.getenv("ALERTA_RENTABILIDAD_ANUAL", BASE_CONFIG["ALERTA_RENTABILIDAD_ANUAL"])),
+        "ALERTA_VOLATILIDAD_MINIMA": float(os.getenv("ALERTA_VOLATILIDAD_MINIMA", BASE_CONFIG["ALERTA_VOLATILIDAD_MINIMA"])),
+        "SPREADS_ACTIVOS": os.getenv("SPREADS_ACTIVOS", str(BASE_CONFIG["SPREADS_ACTIVOS"])).lower() == "true",
+        "ESCANEAR_PUTS": os.getenv("ESCANEAR_PUTS", str(BASE_CONFIG["ESCANEAR_PUTS"])).lower() == "true",
+        "ESCANEAR_CALLS": os.getenv("ESCANEAR_CALLS", str(BASE_CONFIG["ESCANEAR_CALLS"])).lower() == "true",
+        "MODO_INCREMENTAL": os.getenv("MODO_INCREMENTAL", str(BASE_CONFIG["MODO_INCREMENTAL"])).lower() == "true",
+    }
+
+class GroupsConfig(Mapping):
+    """
+    Configuración de los grupos. Cada grupo se define con una función que devuelve su configuración y
+    que se evalúa (una sola vez) al acceder al grupo: las variables de entorno de los grupos que no se
+    ejecutan no se leen ni se validan, y `in` o la lista de grupos no resuelven ninguno. Todo acceso a
+    los valores (get, items, values, dict(...)) pasa por __getitem__ y devuelve la configuración resuelta.
+    """
+
+    def __init__(self, factories):
+        self._factories = dict(factories)
+        self._resolved = {}
+
+    def __getitem__(self, group_type):
+        if group_type not in self._resolved:
+            # setdefault: si dos hilos resuelven el mismo grupo, ambos usan la misma configuración
+            self._resolved.setdefault(group_type, self._factories[group_type]())
+        return self._resolved[group_type]
+
+    def __contains__(self, group_type):
+        return group_type in self._factories
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def __len__(self):
+        return len(self._factories)
+
 # Configuración de grupos (cada grupo puede tener su propia configuración)
-GROUPS_CONFIG = {
-    "7magnificas": {
+GROUPS_CONFIG = GroupsConfig({
+    "7magnificas": lambda: {
         "tickers": ["AAPL", "MSFT", "AMZN", "GOOGL", "META", "TSLA", "NVDA"],
         "description": "Magnificas",
         "webhook": os.getenv("DISCORD_WEBHOOK_URL_7MAGNIFICAS", "URL_POR_DEFECTO"),
-        "config": {
-            "MIN_RENTABILIDAD_ANUAL": float(os.getenv("MIN_RENTABILIDAD_ANUAL", BASE_CONFIG["MIN_RENTABILIDAD_ANUAL"])),
-            "MAX_DIAS_VENCIMIENTO": int(os.getenv("MAX_DIAS_VENCIMIENTO", BASE_CONFIG["MAX_DIAS_VENCIMIENTO"])),
-            "MIN_DIFERENCIA_PORCENTUAL": float(os.getenv("MIN_DIFERENCIA_PORCENTUAL", BASE_CONFIG["MIN_DIFERENCIA_PORCENTUAL"])),
-            "MIN_VOLATILIDAD_IMPLICITA": float(os.getenv("MIN_VOLATILIDAD_IMPLICITA", BASE_CONFIG["MIN_VOLATILIDAD_IMPLICITA"])),
-            "MIN_VOLUMEN": int(os.getenv("MIN_VOLUMEN", BASE_CONFIG["MIN_VOLUMEN"])),
-            "MIN_OPEN_INTEREST": int(os.getenv("MIN_OPEN_INTEREST", BASE_CONFIG["MIN_OPEN_INTEREST"])),
-            "FILTRO_TIPO_OPCION": os.getenv("FILTRO_TIPO_OPCION", BASE_CONFIG["FILTRO_TIPO_OPCION"]),
-            "TOP_CONTRATOS": int(os.getenv("TOP_CONTRATOS", BASE_CONFIG["TOP_CONTRATOS"])),
-            "FORCE_DISCORD_NOTIFICATION": os.getenv("FORCE_DISCORD_NOTIFICATION", str(BASE_CONFIG["FORCE_DISCORD_NOTIFICATION"])).lower() == "true",
-            "MIN_BID": float(os.getenv("MIN_BID", BASE_CONFIG["MIN_BID"])),
-            "ALERTA_RENTABILIDAD_ANUAL": float(os.getenv("ALERTA_RENTABILIDAD_ANUAL", BASE_CONFIG["ALERTA_RENTABILIDAD_ANUAL"])),
-            "ALERTA_VOLATILIDAD_MINIMA": float(os.getenv("ALERTA_VOLATILIDAD_MINIMA", BASE_CONFIG["ALERTA_VOLATILIDAD_MINIMA"])),
-        }
+        "config": env_group_config()
     },
-    "indices": {
+    "indices": lambda: {
         "tickers": ["SPY", "QQQ", "IWM", "DIA"],
         "description": "Índices",
         "webhook": os.getenv("DISCORD_WEBHOOK_URL_INDICES", "URL_POR_DEFECTO"),
-        "config": {
-            "MIN_RENTABILIDAD_ANUAL": float(os.getenv("MIN_RENTABILIDAD_ANUAL", BASE_CONFIG["MIN_RENTABILIDAD_ANUAL"])),
-            "MAX_DIAS_VENCIMIENTO": int(os.getenv("MAX_DIAS_VENCIMIENTO", BASE_CONFIG["MAX_DIAS_VENCIMIENTO"])),
-            "MIN_DIFERENCIA_PORCENTUAL": float(os.getenv("MIN_DIFERENCIA_PORCENTUAL", BASE_CONFIG["MIN_DIFERENCIA_PORCENTUAL"])),
-            "MIN_VOLATILIDAD_IMPLICITA": float(os.getenv("MIN_VOLATILIDAD_IMPLICITA", BASE_CONFIG["MIN_VOLATILIDAD_IMPLICITA"])),
-            "MIN_VOLUMEN": int(os.getenv("MIN_VOLUMEN", BASE_CONFIG["MIN_VOLUMEN"])),
-            "MIN_OPEN_INTEREST": int(os.getenv("MIN_OPEN_INTEREST", BASE_CONFIG["MIN_OPEN_INTEREST"])),
-            "FILTRO_TIPO_OPCION": os.getenv("FILTRO_TIPO_OPCION", BASE_CONFIG["FILTRO_TIPO_OPCION"]),
-            "TOP_CONTRATOS": int(os.getenv("TOP_CONTRATOS", BASE_CONFIG["TOP_CONTRATOS"])),
-            "FORCE_DISCORD_NOTIFICATION": os.getenv("FORCE_DISCORD_NOTIFICATION", str(BASE_CONFIG["FORCE_DISCORD_NOTIFICATION"])).lower() == "true",
-            "MIN_BID": float(os.getenv("MIN_BID", BASE_CONFIG["MIN_BID"])),
-            "ALERTA_RENTABILIDAD_ANUAL": float(os.getenv("ALERTA_RENTABILIDAD_ANUAL", BASE_CONFIG["ALERTA_RENTABILIDAD_ANUAL"])),
-            "ALERTA_VOLATILIDAD_MINIMA": float(os.getenv("ALERTA_VOLATILIDAD_MINIMA", BASE_CONFIG["ALERTA_VOLATILIDAD_MINIMA"])),
-        }
+        "config": env_group_config()
     },
-    "shortlist": {
+    "shortlist": lambda: {
         "tickers": ["EPAM", "NFE", "GLNG", "GLOB", "ASTS"],
         "description": "Shortlist",
         "webhook": os.getenv("DISCORD_WEBHOOK_URL_SHORTLIST", "URL_POR_DEFECTO"),
-        "config": {
-            "MIN_RENTABILIDAD_ANUAL": float(os.getenv("MIN_RENTABILIDAD_ANUAL", BASE_CONFIG["MIN_RENTABILIDAD_ANUAL"])),
-            "MAX_DIAS_VENCIMIENTO": int(os.getenv("MAX_DIAS_VENCIMIENTO", BASE_CONFIG["MAX_DIAS_VENCIMIENTO"])),
-            "MIN_DIFERENCIA_PORCENTUAL": float(os.getenv("MIN_DIFERENCIA_PORCENTUAL", BASE_CONFIG["MIN_DIFERENCIA_PORCENTUAL"])),
-            "MIN_VOLATILIDAD_IMPLICITA": float(os.getenv("MIN_VOLATILIDAD_IMPLICITA", BASE_CONFIG["MIN_VOLATILIDAD_IMPLICITA"])),
-            "MIN_VOLUMEN": int(os.getenv("MIN_VOLUMEN", BASE_CONFIG["MIN_VOLUMEN"])),
-            "MIN_OPEN_INTEREST": int(os.getenv("MIN_OPEN_INTEREST", BASE_CONFIG["MIN_OPEN_INTEREST"])),
-            "FILTRO_TIPO_OPCION": os.getenv("FILTRO_TIPO_OPCION", BASE_CONFIG["FILTRO_TIPO_OPCION"]),
-            "TOP_CONTRATOS": int(os.getenv("TOP_CONTRATOS", BASE_CONFIG["TOP_CONTRATOS"])),
-            "FORCE_DISCORD_NOTIFICATION": os.getenv("FORCE_DISCORD_NOTIFICATION", str(BASE_CONFIG["FORCE_DISCORD_NOTIFICATION"])).lower() == "true",
-            "MIN_BID": float(os.getenv("MIN_BID", BASE_CONFIG["MIN_BID"])),
-            "ALERTA_RENTABILIDAD_ANUAL": float(os.getenv("ALERTA_RENTABILIDAD_ANUAL", BASE_CONFIG["ALERTA_RENTABILIDAD_ANUAL"])),
-            "ALERTA_VOLATILIDAD_MINIMA": float(os.getenv("ALERTA_VOLATILIDAD_MINIMA", BASE_CONFIG["ALERTA_VOLATILIDAD_MINIMA"])),
-        }
+        "config": env_group_config()
     },
-    "european_companies": {
+    "european_companies": lambda: {
         "tickers": ["ASML", "SAP", "UL", "TTE"],
         "description": "Empresas Europeas",
         "webhook": os.getenv("DISCORD_WEBHOOK_URL_EUROPEAN", "URL_POR_DEFECTO"),
@@ -116,10 +309,12 @@ GROUPS_CONFIG = {
             "FORCE_DISCORD_NOTIFICATION": False,
             "MIN_BID": 0.99,
             "ALERTA_RENTABILIDAD_ANUAL": 35.0,
-            "ALERTA_VOLATILIDAD_MINIMA": 30.0
+            "ALERTA_VOLATILIDAD_MINIMA": 30.0,
+            # Umbrales propios, pero el modo incremental sigue la variable de entorno como en los demás grupos
+            "MODO_INCREMENTAL": os.getenv("MODO_INCREMENTAL", str(BASE_CONFIG["MODO_INCREMENTAL"])).lower() == "true"
         }
     },
-    "nasdaq_top_volatility": {
+    "nasdaq_top_volatility": lambda: {
         "dynamic_source": {"index": "nasdaq100"},
         "dynamic_criteria": {
             "top": 15,
@@ -127,7 +322,12 @@ GROUPS_CONFIG = {
             "prefer_iv_over_hist_vol": True,
             "min_iv": 35.0,
             "min_volume": 1000000,
-            "hist_vol_period": 30  # Volvemos a 30, pero ahora el script manejará dinámicamente los datos disponibles
+            "hist_vol_period": 30,  # Volvemos a 30, pero ahora el script manejará dinámicamente los datos disponibles
+            "volume_tolerance": 0.8,  # Nivel 1: descartar si el volumen medio en bloque < min_volume * 0.8
+            "probe_iv_tolerance": 0.75,  # Nivel 2: descartar si la IV ATM cercana < min_iv * 0.75
+            # Terminación anticipada (heurística, desactivada con None): supone que la IV completa no supera la de la sonda * margen
+            "probe_iv_margin": None,
+            "iv_source": "yahoo"  # "yahoo", o "mid"/"bid" para resolver la IV ATM desde el precio
         },
         "description": "NASDAQ-100 Top 15 Volatilidad Implícita",
         "webhook": os.getenv("DISCORD_WEBHOOK_URL_NASDAQ_TOP_VOLATILITY", "URL_POR_DEFECTO"),
@@ -143,545 +343,3902 @@ GROUPS_CONFIG = {
             "FORCE_DISCORD_NOTIFICATION": False,
             "MIN_BID": 0.99,
             "ALERTA_RENTABILIDAD_ANUAL": 55.0,
-            "ALERTA_VOLATILIDAD_MINIMA": 40.0
+            "ALERTA_VOLATILIDAD_MINIMA": 40.0,
+            "MODO_INCREMENTAL": os.getenv("MODO_INCREMENTAL", str(BASE_CONFIG["MODO_INCREMENTAL"])).lower() == "true"
+        }
+    },
+    "sp500_top_volatility": lambda: {
+        # Universo leído de CONSTITUENTS_DIR/sp500.csv (o .txt); con SHARD_COUNT se reparte entre varios procesos o runners
+        # El archivo no se incluye en el repositorio: mientras no exista, el grupo queda fuera de GROUP_TYPE=all
+        "dynamic_source": {"index": "sp500"},
+        "dynamic_criteria": {
+            "top": 20,
+            "metric": "implied_volatility",
+            "prefer_iv_over_hist_vol": True,
+            "min_iv": 35.0,
+            "min_volume": 1000000,
+            "hist_vol_period": 30,
+            "volume_tolerance": 0.8,
+            "probe_iv_tolerance": 0.75,
+            "probe_iv_margin": None,
+            "iv_source": "yahoo"
+        },
+        "description": "S&P 500 Top 20 Volatilidad Implícita",
+        "webhook": os.getenv("DISCORD_WEBHOOK_URL_SP500_TOP_VOLATILITY", "URL_POR_DEFECTO"),
+        "config": {
+            "MIN_RENTABILIDAD_ANUAL": 45.0,
+            "MAX_DIAS_VENCIMIENTO": 45,
+            "MIN_DIFERENCIA_PORCENTUAL": 5.0,
+            "MIN_VOLATILIDAD_IMPLICITA": 35.0,
+            "MIN_VOLUMEN": 1,
+            "MIN_OPEN_INTEREST": 1,
+            "FILTRO_TIPO_OPCION": "OTM",
+            "TOP_CONTRATOS": 5,
+            "FORCE_DISCORD_NOTIFICATION": False,
+            "MIN_BID": 0.99,
+            "ALERTA_RENTABILIDAD_ANUAL": 55.0,
+            "ALERTA_VOLATILIDAD_MINIMA": 40.0,
+            "MODO_INCREMENTAL": os.getenv("MODO_INCREMENTAL", str(BASE_CONFIG["MODO_INCREMENTAL"])).lower() == "true"
+        }
+    },
+    "russell1000_top_volatility": lambda: {
+        # Universo leído de CONSTITUENTS_DIR/russell1000.csv (o .txt); con SHARD_COUNT se reparte entre varios procesos o runners
+        # El archivo no se incluye en el repositorio: mientras no exista, el grupo queda fuera de GROUP_TYPE=all
+        "dynamic_source": {"index": "russell1000"},
+        "dynamic_criteria": {
+            "top": 20,
+            "metric": "implied_volatility",
+            "prefer_iv_over_hist_vol": True,
+            "min_iv": 35.0,
+            "min_volume": 1000000,
+            "hist_vol_period": 30,
+            "volume_tolerance": 0.8,
+            "probe_iv_tolerance": 0.75,
+            "probe_iv_margin": None,
+            "iv_source": "yahoo"
+        },
+        "description": "Russell 1000 Top 20 Volatilidad Implícita",
+        "webhook": os.getenv("DISCORD_WEBHOOK_URL_RUSSELL1000_TOP_VOLATILITY", "URL_POR_DEFECTO"),
+        "config": {
+            "MIN_RENTABILIDAD_ANUAL": 45.0,
+            "MAX_DIAS_VENCIMIENTO": 45,
+            "MIN_DIFERENCIA_PORCENTUAL": 5.0,
+            "MIN_VOLATILIDAD_IMPLICITA": 35.0,
+            "MIN_VOLUMEN": 1,
+            "MIN_OPEN_INTEREST": 1,
+            "FILTRO_TIPO_OPCION": "OTM",
+            "TOP_CONTRATOS": 5,
+            "FORCE_DISCORD_NOTIFICATION": False,
+            "MIN_BID": 0.99,
+            "ALERTA_RENTABILIDAD_ANUAL": 55.0,
+            "ALERTA_VOLATILIDAD_MINIMA": 40.0,
+            "MODO_INCREMENTAL": os.getenv("MODO_INCREMENTAL", str(BASE_CONFIG["MODO_INCREMENTAL"])).lower() == "true"
         }
     }
-}
+})
 
-def calculate_volatility_metrics(ticker, max_days=45, hist_vol_period=30):
+# Cadena de opciones tal como la usan las distintas etapas (mismos atributos que la de yfinance)
+OptionChain = namedtuple("OptionChain", ["calls", "puts"])
+
+class OptionChainStore:
     """
-    Calcula la volatilidad implícita promedio (IV) y la volatilidad histórica (Hist Vol) de un ticker.
-    Retorna un diccionario con IV, Hist Vol y el volumen del subyacente.
+    Almacén en disco de snapshots de cadenas de opciones, compartido entre ejecuciones.
+    Cada snapshot se guarda en Parquet como <dir>/<símbolo>/<expiración>_<epoch>.parquet, con
+    puts y calls en el mismo archivo, y las fechas de vencimiento como _expirations_<epoch>.json.
+    Un snapshot se sirve desde disco mientras su antigüedad no supere el TTL.
     """
-    try:
-        stock = yf.Ticker(ticker)
-        # Obtener el precio actual y el volumen del subyacente
-        current_price = stock.info.get('regularMarketPrice', stock.info.get('previousClose', 0))
-        volume = stock.info.get('averageVolume', 0)
-        if current_price <= 0:
-            logger.info(f"{ticker}: Precio actual no válido: ${current_price}")
-            print(f"{ticker}: Precio actual no válido: ${current_price}")
-            return None
 
-        logger.info(f"{ticker}: Precio actual: ${current_price:.2f}, Volumen promedio: {volume}")
-        print(f"{ticker}: Precio actual: ${current_price:.2f}, Volumen promedio: {volume}")
+    def __init__(self, root, ttl_minutes=60):
+        self.root = root
+        self.ttl_seconds = ttl_minutes * 60
 
-        # Calcular volatilidad implícita promedio (IV) usando opciones ATM
-        expirations = stock.options
-        if not expirations:
-            logger.info(f"{ticker}: No hay fechas de vencimiento disponibles para opciones")
-            print(f"{ticker}: No hay fechas de vencimiento disponibles para opciones")
-            return None
+    def _symbol_dir(self, symbol):
+        return os.path.join(self.root, symbol)
 
-        iv_values = []
-        for expiration in expirations:
-            expiration_date = datetime.strptime(expiration, '%Y-%m-%d')
-            days_to_expiration = (expiration_date - datetime.now()).days
-            if days_to_expiration <= 0 or days_to_expiration > max_days:
-                logger.debug(f"{ticker}: Expiración {expiration} descartada: {days_to_expiration} días")
+    def _latest(self, symbol, prefix, suffix):
+        """Devuelve (ruta, epoch) del snapshot más reciente para la clave, o (None, None)."""
+        directory = self._symbol_dir(symbol)
+        if not os.path.isdir(directory):
+            return None, None
+        latest_path, latest_epoch = None, None
+        for name in os.listdir(directory):
+            if not (name.startswith(prefix + "_") and name.endswith(suffix)):
+                continue
+            try:
+                epoch = int(name[len(prefix) + 1:-len(suffix)])
+            except ValueError:
                 continue
+            if latest_epoch is None or epoch > latest_epoch:
+                latest_path, latest_epoch = os.path.join(directory, name), epoch
+        return latest_path, latest_epoch
 
-            opt = stock.option_chain(expiration)
-            # Considerar puts y calls para obtener una mejor estimación
-            for chain in [opt.puts, opt.calls]:
-                if chain.empty:
-                    logger.debug(f"{ticker}: Cadena de opciones vacía para {expiration}")
-                    continue
-                # Encontrar la opción ATM (strike más cercano al precio actual)
-                chain['strike_diff'] = abs(chain['strike'] - current_price)
-                atm_option = chain.loc[chain['strike_diff'].idxmin()]
-                iv = atm_option.get('impliedVolatility', 0) * 100
-                if iv > 0:
-                    iv_values.append(iv)
-                else:
-                    logger.debug(f"{ticker}: Volatilidad implícita no válida para {expiration}: {iv}%")
+    def _is_fresh(self, epoch):
+        return epoch is not None and time.time() - epoch <= self.ttl_seconds
 
-        if not iv_values:
-            logger.info(f"{ticker}: No se encontraron opciones válidas para calcular IV")
-            print(f"{ticker}: No se encontraron opciones válidas para calcular IV")
+    def _write(self, symbol, name, write):
+        # Escribir en un temporal y renombrar para que una lectura concurrente nunca vea un archivo a medias
+        directory = self._symbol_dir(symbol)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def load_expirations(self, symbol):
+        path, epoch = self._latest(symbol, "_expirations", ".json")
+        if not self._is_fresh(epoch):
             return None
-        implied_volatility = np.mean(iv_values)
-        logger.info(f"{ticker}: Volatilidad implícita promedio: {implied_volatility:.2f}%")
-        print(f"{ticker}: Volatilidad implícita promedio: {implied_volatility:.2f}%")
+        with open(path) as f:
+            return tuple(json.load(f))
 
-        # Calcular volatilidad histórica (Hist Vol)
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=hist_vol_period + 1)
-        hist_data = stock.history(start=start_date, end=end_date)
-        num_days = len(hist_data)
-        min_days_required = 10  # Requerimos al menos 10 días para un cálculo significativo
+    def save_expirations(self, symbol, expirations):
+        def write(path):
+            with open(path, "w") as f:
+                json.dump(list(expirations), f)
+        self._write(symbol, f"_expirations_{int(time.time())}.json", write)
 
-        if num_days < min_days_required:
-            logger.info(f"{ticker}: No hay suficientes datos históricos para calcular Hist Vol (se encontraron {num_days} días, se requieren al menos {min_days_required})")
-            print(f"{ticker}: No hay suficientes datos históricos para calcular Hist Vol (se encontraron {num_days} días, se requieren al menos {min_days_required})")
+    def load_chain(self, symbol, expiration):
+        path, epoch = self._latest(symbol, expiration, ".parquet")
+        if not self._is_fresh(epoch):
             return None
+        data = pd.read_parquet(path)
+        side = data.pop("_side")
+        return OptionChain(
+            calls=data[side == "calls"].reset_index(drop=True),
+            puts=data[side == "puts"].reset_index(drop=True)
+        )
 
-        # Si hay menos días de los solicitados, usar los días disponibles
-        if num_days < hist_vol_period:
-            logger.info(f"{ticker}: Datos históricos insuficientes para {hist_vol_period} días, usando {num_days} días disponibles")
-            print(f"{ticker}: Datos históricos insuficientes para {hist_vol_period} días, usando {num_days} días disponibles")
+    def save_chain(self, symbol, expiration, chain):
+        data = pd.concat(
+            [chain.calls.assign(_side="calls"), chain.puts.assign(_side="puts")],
+            ignore_index=True
+        )
+        self._write(symbol, f"{expiration}_{int(time.time())}.parquet", lambda path: data.to_parquet(path, index=False))
 
-        # Calcular retornos diarios logarítmicos
-        hist_data['returns'] = np.log(hist_data['Close'] / hist_data['Close'].shift(1))
-        hist_vol = hist_data['returns'].std() * np.sqrt(252) * 100  # Anualizar
-        logger.info(f"{ticker}: Volatilidad histórica: {hist_vol:.2f}%")
-        print(f"{ticker}: Volatilidad histórica: {hist_vol:.2f}%")
+    def prune(self, max_age_hours=None, max_size_mb=None):
+        """
+        Elimina snapshots con más de max_age_hours horas y, si el almacén sigue ocupando más de
+        max_size_mb MB, los más antiguos hasta quedar por debajo del límite.
+        Retorna el número de archivos eliminados.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        files = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
 
-        return {
-            "ticker": ticker,
-            "implied_volatility": implied_volatility,
-            "historical_volatility": hist_vol,
-            "volume": volume
-        }
-    except Exception as e:
-        logger.info(f"Error calculando métricas de volatilidad para {ticker}: {e}")
-        print(f"Error calculando métricas de volatilidad para {ticker}: {e}")
+        removed = 0
+        now = time.time()
+        total_size = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            too_old = max_age_hours is not None and now - mtime > max_age_hours * 3600
+            too_big = max_size_mb is not None and total_size > max_size_mb * 1024 * 1024
+            if not (too_old or too_big):
+                continue
+            os.remove(path)
+            total_size -= size
+            removed += 1
+        return removed
+
+def create_snapshot_store():
+    """Crea el almacén de snapshots si SNAPSHOT_DIR está definido y hay soporte para Parquet."""
+    snapshot_dir = os.getenv("SNAPSHOT_DIR", "")
+    if not snapshot_dir:
+        return None
+    try:
+        import pyarrow  # noqa: F401  (motor de Parquet para pandas)
+    except ImportError:
+        logger.warning("SNAPSHOT_DIR definido pero pyarrow no está instalado; se descargará todo de la red")
+        print("SNAPSHOT_DIR definido pero pyarrow no está instalado; se descargará todo de la red")
         return None
+    return OptionChainStore(snapshot_dir, ttl_minutes=float(os.getenv("SNAPSHOT_TTL_MINUTES", 60)))
 
-def generate_dynamic_tickers(dynamic_source, dynamic_criteria):
+# Columnas de las cadenas que se archivan (las que necesitan los filtros y la liquidación del backtest)
+ARCHIVE_CHAIN_COLUMNS = ["strike", "bid", "ask", "lastPrice", "volume", "openInterest", "impliedVolatility"]
+
+class OptionArchive:
     """
-    Genera una lista de tickers dinámicamente basada en los criterios especificados.
+    Archivo histórico de solo anexión de todas las cadenas descargadas y del precio del subyacente,
+    en Parquet particionado por fecha de escaneo (estilo Hive) para que el backtest lea solo los días
+    y columnas que necesita:
+        <dir>/chains/date=YYYY-MM-DD/part-<epoch>-<pid>-<n>.parquet
+        <dir>/underlying/date=YYYY-MM-DD/part-<epoch>-<pid>-<n>.parquet
+    Cada fila lleva scanned_at, el instante del análisis, que identifica la ejecución. Las filas se
+    acumulan en memoria y se escriben en archivos nuevos cada `flush_rows` contratos y al cerrar.
     """
-    try:
-        # Obtener la lista de tickers según la fuente
-        index = dynamic_source.get("index")
-        if index == "nasdaq100":
-            tickers = NASDAQ_100_TICKERS  # Usar la lista estática
-        else:
-            logger.error(f"Fuente dinámica no soportada: {index}")
-            print(f"Fuente dinámica no soportada: {index}")
-            return []
 
-        logger.info(f"Total de tickers iniciales para {index}: {len(tickers)}")
-        print(f"Total de tickers iniciales para {index}: {len(tickers)}")
-
-        # Obtener criterios de filtrado
-        top_n = dynamic_criteria.get("top", 15)
-        metric = dynamic_criteria.get("metric", "implied_volatility")
-        prefer_iv_over_hist_vol = dynamic_criteria.get("prefer_iv_over_hist_vol", True)
-        min_iv = dynamic_criteria.get("min_iv", 35.0)
-        min_volume = dynamic_criteria.get("min_volume", 1000000)
-        hist_vol_period = dynamic_criteria.get("hist_vol_period", 30)
-
-        # Calcular métricas de volatilidad para cada ticker
-        volatility_data = []
-        discarded_by_iv = 0
-        discarded_by_volume = 0
-        discarded_by_data = 0
-
-        for ticker in tickers:
-            metrics = calculate_volatility_metrics(ticker, max_days=45, hist_vol_period=hist_vol_period)
-            if metrics is None:
-                discarded_by_data += 1
-                continue
+    def __init__(self, root, flush_rows=500_000):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.scanned_at = pd.Timestamp(analysis_now()).floor("s")
+        self._lock = threading.Lock()
+        self._chains = []
+        self._chain_rows = 0
+        self._underlying = []
+        self._parts = 0
+        self.archived_contracts = 0
+        self.archived_prices = 0
 
-            # Aplicar filtros iniciales
-            if metrics["implied_volatility"] < min_iv:
-                logger.info(f"{ticker}: Descartado por volatilidad implícita baja: {metrics['implied_volatility']:.2f}% < {min_iv}%")
-                print(f"{ticker}: Descartado por volatilidad implícita baja: {metrics['implied_volatility']:.2f}% < {min_iv}%")
-                discarded_by_iv += 1
-                continue
-            if metrics["volume"] < min_volume:
-                logger.info(f"{ticker}: Descartado por volumen bajo: {metrics['volume']} < {min_volume}")
-                print(f"{ticker}: Descartado por volumen bajo: {metrics['volume']} < {min_volume}")
-                discarded_by_volume += 1
-                continue
-            volatility_data.append(metrics)
+    def add_chain(self, symbol, expiration, chain):
+        frames = [
+            side.reindex(columns=ARCHIVE_CHAIN_COLUMNS).assign(type=option_type)
+            for side, option_type in [(chain.puts, "put"), (chain.calls, "call")] if not side.empty
+        ]
+        if not frames:
+            return
+        frame = pd.concat(frames, ignore_index=True).assign(ticker=symbol, expiration=expiration)
+        with self._lock:
+            self._chains.append(frame)
+            self._chain_rows += len(frame)
+            if self._chain_rows >= self.flush_rows:
+                self._flush_chains()
 
-        # Resumen de descartes
-        logger.info(f"Resumen de filtrado: {discarded_by_data} tickers descartados por falta de datos, {discarded_by_iv} por IV baja, {discarded_by_volume} por volumen bajo")
-        print(f"Resumen de filtrado: {discarded_by_data} tickers descartados por falta de datos, {discarded_by_iv} por IV baja, {discarded_by_volume} por volumen bajo")
+    def add_underlying(self, symbol, info):
+        price = info.get('regularMarketPrice', info.get('previousClose', 0)) if info else 0
+        if not price or price <= 0:
+            return
+        with self._lock:
+            self._underlying.append((symbol, float(price)))
 
-        if not volatility_data:
-            logger.warning("No se encontraron tickers que cumplan con los criterios de filtrado")
-            print("No se encontraron tickers que cumplan con los criterios de filtrado")
-            return []
+    def _write(self, dataset, frame):
+        directory = os.path.join(self.root, dataset, f"date={self.scanned_at.strftime('%Y-%m-%d')}")
+        os.makedirs(directory, exist_ok=True)
+        self._parts += 1
+        path = os.path.join(directory, f"part-{int(self.scanned_at.timestamp())}-{os.getpid()}-{self._parts}.parquet")
+        frame.assign(scanned_at=self.scanned_at).to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
 
-        # Convertir a DataFrame para facilitar el ordenamiento
-        df = pd.DataFrame(volatility_data)
-        df['iv_hist_diff'] = df['implied_volatility'] - df['historical_volatility']
-        df['iv_hist_diff_abs'] = df['iv_hist_diff'].abs()
-
-        # Seleccionar tickers
-        selected_tickers = []
-        # Primero, tickers con IV > Hist Vol, ordenados por IV (descendente)
-        if prefer_iv_over_hist_vol:
-            iv_greater = df[df['iv_hist_diff'] > 0].sort_values(by="implied_volatility", ascending=False)
-            selected_tickers.extend(iv_greater['ticker'].head(top_n).tolist())
-            logger.info(f"Tickers con IV > Hist Vol: {len(iv_greater)}")
-            print(f"Tickers con IV > Hist Vol: {len(iv_greater)}")
-
-        # Si no se alcanzan los top_n tickers, seleccionar los restantes por diferencia absoluta (menor es mejor)
-        if len(selected_tickers) < top_n:
-            remaining_slots = top_n - len(selected_tickers)
-            remaining = df[~df['ticker'].isin(selected_tickers)].sort_values(by="iv_hist_diff_abs", ascending=True)
-            selected_tickers.extend(remaining['ticker'].head(remaining_slots).tolist())
-            logger.info(f"Tickers adicionales seleccionados por diferencia absoluta: {len(remaining)}")
-            print(f"Tickers adicionales seleccionados por diferencia absoluta: {len(remaining)}")
-
-        logger.info(f"Tickers seleccionados para el grupo dinámico: {selected_tickers}")
-        print(f"Tickers seleccionados para el grupo dinámico: {selected_tickers}")
-        return selected_tickers
-    except Exception as e:
-        logger.error(f"Error generando tickers dinámicos: {e}")
-        print(f"Error generando tickers dinámicos: {e}")
-        return []
+    def _flush_chains(self):
+        if not self._chains:
+            return
+        frame = pd.concat(self._chains, ignore_index=True)
+        frame = frame.astype({"ticker": "category", "type": "category", "expiration": "category"})
+        frame[ARCHIVE_CHAIN_COLUMNS] = frame[ARCHIVE_CHAIN_COLUMNS].astype(float)
+        self._write("chains", frame)
+        self.archived_contracts += len(frame)
+        self._chains, self._chain_rows = [], 0
 
-def get_option_data_yahoo(ticker, group_config):
+    def close(self):
+        with self._lock:
+            self._flush_chains()
+            if self._underlying:
+                self._write("underlying", pd.DataFrame(self._underlying, columns=["ticker", "price"]))
+                self.archived_prices += len(self._underlying)
+                self._underlying = []
+
+def create_option_archive():
+    """Crea el archivo histórico si ARCHIVE_DIR está definido y hay soporte para Parquet."""
+    archive_dir = os.getenv("ARCHIVE_DIR", "")
+    if not archive_dir:
+        return None
     try:
-        stock = yf.Ticker(ticker)
-        expirations = stock.options
-        options_data = []
-        current_price = stock.info.get('regularMarketPrice', stock.info.get('previousClose', 0))
-        if current_price <= 0:
-            raise ValueError(f"Precio actual de {ticker} no válido: ${current_price}")
-        logger.info(f"Precio actual de {ticker}: ${current_price:.2f}")
-        print(f"Precio actual de {ticker}: ${current_price:.2f}")
+        import pyarrow  # noqa: F401  (motor de Parquet para pandas)
+    except ImportError:
+        logger.warning("ARCHIVE_DIR definido pero pyarrow no está instalado; no se archivarán las cadenas")
+        print("ARCHIVE_DIR definido pero pyarrow no está instalado; no se archivarán las cadenas")
+        return None
+    return OptionArchive(archive_dir)
 
-        for expiration in expirations:
-            if not expiration:
-                continue
-            expiration_date = datetime.strptime(expiration, '%Y-%m-%d')
-            days_to_expiration = (expiration_date - datetime.now()).days
-            if days_to_expiration <= 0 or days_to_expiration > group_config["MAX_DIAS_VENCIMIENTO"]:
-                logger.debug(f"Expiración {expiration} descartada: {days_to_expiration} días")
-                continue
+class RunMetrics:
+    """
+    Instrumentación de una ejecución: tiempos por etapa y por ticker, peticiones por fuente de datos
+    (número, bytes aproximados, reintentos y errores) y contratos examinados frente a conservados.
+    Es segura entre hilos y se vuelca a un JSON legible por máquina al final de la ejecución.
+    """
 
-            opt = stock.option_chain(expiration)
-            chain = opt.puts
-            for _, row in chain.iterrows():
-                strike = row['strike']
-                bid = row.get('bid', 0)
-                if bid < group_config["MIN_BID"]:
-                    logger.debug(f"Opción descartada: bid ${bid:.2f} < {group_config['MIN_BID']}")
-                    continue
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
 
-                implied_volatility = row.get('impliedVolatility', 0) * 100
-                if implied_volatility < group_config["MIN_VOLATILIDAD_IMPLICITA"]:
-                    logger.debug(f"Opción descartada: volatilidad implícita {implied_volatility:.2f}% < {group_config['MIN_VOLATILIDAD_IMPLICITA']}%")
-                    continue
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now()
+            self._start = time.perf_counter()
+            self.stages = {}
+            self.tickers = {}
+            self.sources = {}
+            self.contracts = {}
 
-                last_price = row.get('lastPrice', 0)
-                if last_price <= 0:
-                    logger.debug(f"Opción descartada: último precio ${last_price:.2f} <= 0")
-                    continue
+    @contextmanager
+    def stage(self, name, ticker=None):
+        """Cronometra un bloque como etapa `name`, atribuyéndolo además a `ticker` si se indica."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start, ticker)
 
-                volume = row.get('volume', 0) or 0
-                if volume < group_config["MIN_VOLUMEN"]:
-                    logger.debug(f"Opción descartada: volumen {volume} < {group_config['MIN_VOLUMEN']}")
-                    continue
+    def add_timing(self, name, seconds, ticker=None):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stage["count"] += 1
+            stage["total_seconds"] += seconds
+            stage["max_seconds"] = max(stage["max_seconds"], seconds)
+            if ticker is not None:
+                ticker_stages = self.tickers.setdefault(ticker, {})
+                ticker_stages[name] = ticker_stages.get(name, 0.0) + seconds
 
-                open_interest = row.get('openInterest', 0) or 0
-                if open_interest < group_config["MIN_OPEN_INTEREST"]:
-                    logger.debug(f"Opción descartada: interés abierto {open_interest} < {group_config['MIN_OPEN_INTEREST']}")
-                    continue
+    def record_request(self, source, kind, nbytes=0, retries=0, error=False, seconds=0.0):
+        with self._lock:
+            totals = self.sources.setdefault(
+                source, {"requests": 0, "bytes": 0, "retries": 0, "errors": 0, "seconds": 0.0, "by_kind": {}}
+            )
+            totals["requests"] += 1
+            totals["bytes"] += nbytes
+            totals["retries"] += retries
+            totals["errors"] += int(error)
+            totals["seconds"] += seconds
+            totals["by_kind"][kind] = totals["by_kind"].get(kind, 0) + 1
 
-                if group_config["FILTRO_TIPO_OPCION"] == "OTM":
-                    if strike >= current_price:
-                        logger.debug(f"Opción descartada: put OTM, strike ${strike:.2f} >= precio actual ${current_price:.2f}")
-                        continue
-                elif group_config["FILTRO_TIPO_OPCION"] == "ITM":
-                    if strike < current_price:
-                        logger.debug(f"Opción descartada: put ITM, strike ${strike:.2f} < precio actual ${current_price:.2f}")
-                        continue
-
-                break_even = strike - last_price
-                percent_diff = ((current_price - break_even) / current_price) * 100
-                if percent_diff < group_config["MIN_DIFERENCIA_PORCENTUAL"]:
-                    logger.debug(f"Opción descartada: diferencia porcentual {percent_diff:.2f}% < {group_config['MIN_DIFERENCIA_PORCENTUAL']}%")
-                    continue
+    def source_throughput(self):
+        """Peticiones y bytes por segundo de cada fuente, sobre el tiempo acumulado de sus peticiones."""
+        with self._lock:
+            return self._throughput()
 
-                rentabilidad_diaria = (last_price * 100) / current_price
-                rentabilidad_anual = rentabilidad_diaria * (365 / days_to_expiration)
-                if rentabilidad_anual < group_config["MIN_RENTABILIDAD_ANUAL"]:
-                    logger.debug(f"Opción descartada: rentabilidad anualizada {rentabilidad_anual:.2f}% < {group_config['MIN_RENTABILIDAD_ANUAL']}%")
-                    continue
+    def _throughput(self):
+        return {
+            source: {
+                "requests_per_second": totals["requests"] / totals["seconds"] if totals["seconds"] else None,
+                "bytes_per_second": totals["bytes"] / totals["seconds"] if totals["seconds"] else None,
+            }
+            for source, totals in self.sources.items()
+        }
 
-                options_data.append({
-                    "ticker": ticker,
-                    "type": "put",
-                    "strike": strike,
-                    "expiration": expiration,
-                    "days_to_expiration": days_to_expiration,
-                    "bid": bid,
-                    "last_price": last_price,
-                    "implied_volatility": implied_volatility,
-                    "volume": volume,
-                    "open_interest": open_interest,
-                    "rentabilidad_diaria": rentabilidad_diaria,
-                    "rentabilidad_anual": rentabilidad_anual,
-                    "break_even": break_even,
-                    "percent_diff": percent_diff,
-                    "source": "Yahoo"
-                })
-        logger.info(f"Se encontraron {len(options_data)} opciones para {ticker} después de aplicar filtros")
-        print(f"Se encontraron {len(options_data)} opciones para {ticker} después de aplicar filtros")
-        return options_data
-    except Exception as e:
-        logger.error(f"Error obteniendo datos de Yahoo para {ticker}: {e}")
-        print(f"Error obteniendo datos de Yahoo para {ticker}: {e}")
-        return []
+    def record_contracts(self, ticker, examined, kept):
+        with self._lock:
+            counts = self.contracts.setdefault(ticker, {"examined": 0, "kept": 0})
+            counts["examined"] += examined
+            counts["kept"] += kept
 
-def get_option_data_finnhub(ticker, group_config):
-    return []
+    def to_dict(self, **extra):
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(),
+                "total_seconds": time.perf_counter() - self._start,
+                **extra,
+                "stages": self.stages,
+                "sources": self.sources,
+                "throughput": self._throughput(),
+                "contracts": {
+                    "examined": sum(c["examined"] for c in self.contracts.values()),
+                    "kept": sum(c["kept"] for c in self.contracts.values()),
+                    "by_ticker": self.contracts,
+                },
+                "tickers": self.tickers,
+            }
 
-def combine_options_data(yahoo_data, finnhub_data):
-    combined = yahoo_data + finnhub_data
-    return combined
+    def write(self, path, **extra):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(**extra), f, indent=2, default=str)
 
-def analyze_ticker(ticker, group_config):
-    logger.info(f"Analizando {ticker}...")
-    print(f"\n{'='*50}\nAnalizando ticker: {ticker}\n{'='*50}\n")
-    yahoo_data = get_option_data_yahoo(ticker, group_config)
-    finnhub_data = get_option_data_finnhub(ticker, group_config)
-    logger.info(f"{len(yahoo_data)} opciones de Yahoo para {ticker}")
-    logger.info(f"{len(finnhub_data)} opciones de Finnhub para {ticker}")
-    logger.info(f"Combinadas {len(yahoo_data + finnhub_data)} opciones para {ticker}")
-    print(f"{len(yahoo_data)} opciones de Yahoo para {ticker}")
-    print(f"{len(finnhub_data)} opciones de Finnhub para {ticker}")
-    print(f"Combinadas {len(yahoo_data + finnhub_data)} opciones para {ticker}")
-    return combine_options_data(yahoo_data, finnhub_data)
+def _payload_size(value):
+    """Tamaño aproximado en bytes de una respuesta de datos de mercado (yfinance no expone el de la red)."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, OptionChain):
+        return _payload_size(value.calls) + _payload_size(value.puts)
+    return len(json.dumps(value, default=str))
 
-def send_discord_notification(tickers_identificados, webhook_url, group_config, group_description):
-    if not webhook_url or webhook_url == "URL_POR_DEFECTO":
-        logger.error(f"Error: Webhook inválido: {webhook_url}")
-        print(f"Error: Webhook inválido: {webhook_url}")
-        return
-    try:
-        ticker_list = ", ".join(tickers_identificados) if tickers_identificados else "Ninguno"
-        # Encabezado con las reglas de alerta
-        header = (
-            f"**Análisis de Opciones - {group_description}**\n"
-            f"Reglas de Alerta:\n"
-            f"- Rentabilidad Anual Mínima: {group_config['ALERTA_RENTABILIDAD_ANUAL']}%\n"
-            f"- Volatilidad Implícita Mínima: {group_config['ALERTA_VOLATILIDAD_MINIMA']}%\n"
-            f"{'-'*50}\n"
-        )
-        message = (
-            f"{header}"
-            f"Se encontraron contratos que cumplen los filtros de alerta para los siguientes tickers: {ticker_list}"
-        )
-        with open("Mejores_Contratos.txt", "rb") as f:
-            files = {
-                "file": ("Mejores_Contratos.txt", f, "text/plain")
-            }
-            payload = {
-                "content": message
-            }
-            response = requests.post(webhook_url, data=payload, files=files)
-            response.raise_for_status()
-        logger.info("Notificación enviada a Discord")
-        print("Notificación enviada a Discord")
-    except Exception as e:
-        logger.error(f"Error enviando notificación a Discord: {e}")
-        print(f"Error enviando notificación a Discord: {e}")
+# Métricas de la ejecución actual
+run_metrics = RunMetrics()
 
-def main():
-    group_type = os.getenv("GROUP_TYPE", "7magnificas")
-    if group_type not in GROUPS_CONFIG:
-        logger.error(f"Grupo {group_type} no encontrado")
-        print(f"Grupo {group_type} no encontrado")
-        return
+class MarketDataProvider(ABC):
+    """
+    Interfaz de una fuente de datos de mercado. Cada implementación devuelve los datos con la misma
+    forma que yfinance: info como diccionario, vencimientos como tupla de 'YYYY-MM-DD', cadenas como
+    OptionChain de DataFrames e histórico/descargas en bloque como DataFrames de barras diarias.
+    Una implementación incompleta falla al crearse, no a mitad del análisis.
+    """
+    name = "base"
 
-    group_config = GROUPS_CONFIG[group_type]
-    # Determinar si el grupo es dinámico o estático
-    if "dynamic_source" in group_config:
-        tickers = generate_dynamic_tickers(group_config["dynamic_source"], group_config["dynamic_criteria"])
-    else:
-        tickers = group_config["tickers"]
+    @abstractmethod
+    def info(self, symbol):
+        ...
 
-    if not tickers:
-        logger.error(f"No se encontraron tickers para el grupo {group_type}")
-        print(f"No se encontraron tickers para el grupo {group_type}")
-        return
+    @abstractmethod
+    def options(self, symbol):
+        ...
 
-    description = group_config["description"]
-    webhook_url = group_config["webhook"]
-    config = group_config["config"]
-    logger.info(f"Webhook URL para {description}: {webhook_url}")
-    print(f"Webhook URL para {description}: {webhook_url}")
+    @abstractmethod
+    def option_chain(self, symbol, expiration):
+        ...
 
-    all_options = []
-    errors = []
-    best_contracts_by_ticker = {}  # Para guardar los contratos que cumplen las reglas de alerta
-    filtered_contracts_by_ticker = {}  # Para guardar todos los contratos que cumplen los filtros iniciales
-    summary_message = f"==================================================\n"
-    summary_message += f"Análisis de Opciones - {description}\n"
-    summary_message += f"==================================================\n\n"
+    @abstractmethod
+    def history(self, symbol, start, end):
+        ...
 
-    for ticker in tickers:
-        try:
-            options = analyze_ticker(ticker, config)
-            if not options:
-                logger.info(f"No se encontraron opciones para {ticker}")
-                print(f"No se encontraron opciones para {ticker}")
-                summary_message += f"==================================================\n"
-                summary_message += f"Analizando ticker: {ticker}\n"
-                summary_message += f"==================================================\n\n"
-                summary_message += f"No se encontraron opciones para {ticker}.\n\n"
-                continue
+    @abstractmethod
+    def download(self, symbols, period):
+        ...
 
-            all_options.extend(options)
+class YahooProvider(MarketDataProvider):
+    """Datos en vivo de Yahoo Finance a través de yfinance."""
+    name = "yahoo"
 
-            df_ticker = pd.DataFrame(options)
-            if df_ticker.empty:
-                logger.info(f"No hay opciones válidas para {ticker} después de aplicar filtros")
-                print(f"No hay opciones válidas para {ticker} después de aplicar filtros")
-                summary_message += f"==================================================\n"
-                summary_message += f"Analizando ticker: {ticker}\n"
-                summary_message += f"==================================================\n\n"
-                summary_message += f"No hay opciones válidas para {ticker} después de aplicar filtros.\n\n"
-                continue
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tickers = {}
 
-            # Ordenar todas las opciones filtradas por rentabilidad anual (descendente), días al vencimiento (ascendente), diferencia porcentual (descendente)
-            df_ticker = df_ticker.sort_values(
-                by=["rentabilidad_anual", "days_to_expiration", "percent_diff"],
-                ascending=[False, True, False]
-            )
+    def _ticker(self, symbol):
+        with self._lock:
+            if symbol not in self._tickers:
+                self._tickers[symbol] = yf.Ticker(symbol)
+            return self._tickers[symbol]
 
-            # Guardar todas las opciones que cumplen los filtros iniciales (para mostrarlas)
-            filtered_contracts = df_ticker.head(config["TOP_CONTRATOS"])
-            filtered_contracts_by_ticker[ticker] = filtered_contracts
-
-            # Filtrar por reglas de alerta (solo para notificación a Discord)
-            best_contracts = df_ticker[
-                (df_ticker["rentabilidad_anual"] >= config["ALERTA_RENTABILIDAD_ANUAL"]) &
-                (df_ticker["implied_volatility"] >= config["ALERTA_VOLATILIDAD_MINIMA"])
-            ].head(config["TOP_CONTRATOS"])
-            best_contracts_by_ticker[ticker] = best_contracts
-
-            stock = yf.Ticker(ticker)
-            current_price = stock.info.get('regularMarketPrice', stock.info.get('previousClose', 0))
-            min_52_week = stock.info.get('fiftyTwoWeekLow', 0)
-            max_52_week = stock.info.get('fiftyTwoWeekHigh', 0)
-
-            ticker_message = f"==================================================\n"
-            ticker_message += f"Analizando ticker: {ticker}\n"
-            ticker_message += f"==================================================\n\n"
-            ticker_message += f"Precio del subyacente ({ticker}): ${current_price:.2f}\n"
-            ticker_message += f"Mínimo de las últimas 52 semanas: ${min_52_week:.2f}\n"
-            ticker_message += f"Máximo de las últimas 52 semanas: ${max_52_week:.2f}\n"
-            ticker_message += f"{len(get_option_data_yahoo(ticker, config))} opciones de Yahoo para {ticker}\n"
-            ticker_message += f"{len(get_option_data_finnhub(ticker, config))} opciones de Finnhub para {ticker}\n"
-            ticker_message += f"Combinadas {len(options)} opciones para {ticker}\n"
-            ticker_message += f"Fuentes: Yahoo Finance\n"
-            ticker_message += f"Errores: Ninguno\n"
-
-            print(f"Precio del subyacente ({ticker}): ${current_price:.2f}")
-            print(f"Mínimo de las últimas 52 semanas: ${min_52_week:.2f}")
-            print(f"Máximo de las últimas 52 semanas: ${max_52_week:.2f}")
-            print(f"{len(get_option_data_yahoo(ticker, config))} opciones de Yahoo para {ticker}")
-            print(f"{len(get_option_data_finnhub(ticker, config))} opciones de Finnhub para {ticker}")
-            print(f"Combinadas {len(options)} opciones para {ticker}")
-            print(f"Fuentes: Yahoo Finance")
-            print(f"Errores: Ninguno")
-
-            if not filtered_contracts.empty:
-                tipo_opcion_texto = "Out of the Money" if config["FILTRO_TIPO_OPCION"] == "OTM" else "In the Money"
-                ticker_message += f"\nOpciones PUT {tipo_opcion_texto} con rentabilidad anual > {config['MIN_RENTABILIDAD_ANUAL']}% y diferencia % > {config['MIN_DIFERENCIA_PORCENTUAL']}% (máximo {config['MAX_DIAS_VENCIMIENTO']} días, volumen > {config['MIN_VOLUMEN']}, volatilidad >= {config['MIN_VOLATILIDAD_IMPLICITA']}%, interés abierto > {config['MIN_OPEN_INTEREST']}, bid >= ${config['MIN_BID']}):\n"
-                print(f"\nOpciones PUT {tipo_opcion_texto} con rentabilidad anual > {config['MIN_RENTABILIDAD_ANUAL']}% y diferencia % > {config['MIN_DIFERENCIA_PORCENTUAL']}% (máximo {config['MAX_DIAS_VENCIMIENTO']} días, volumen > {config['MIN_VOLUMEN']}, volatilidad >= {config['MIN_VOLATILIDAD_IMPLICITA']}%, interés abierto > {config['MIN_OPEN_INTEREST']}, bid >= ${config['MIN_BID']}):")
-
-                table_data = filtered_contracts[[
-                    "strike", "last_price", "bid", "expiration", "days_to_expiration",
-                    "rentabilidad_diaria", "rentabilidad_anual", "break_even", "percent_diff",
-                    "implied_volatility", "volume", "open_interest", "source"
-                ]].copy()
-                table_data.columns = [
-                    "Strike", "Last Closed", "Bid", "Vencimiento", "Días Venc.",
-                    "Rent. Diaria", "Rent. Anual", "Break-even", "Dif. % (Suby.-Break.)",
-                    "Volatilidad Implícita", "Volumen", "Interés Abierto", "Fuente"
-                ]
-                table = tabulate(table_data, headers="keys", tablefmt="grid", showindex=False)
-                ticker_message += f"\n{table}\n"
-                print(table)
-            else:
-                ticker_message += f"No se encontraron contratos que cumplan los criterios para {ticker}.\n"
-                print(f"No se encontraron contratos que cumplan los criterios para {ticker}.")
+    def info(self, symbol):
+        return self._ticker(symbol).info
 
-            summary_message += ticker_message + "\n"
+    def options(self, symbol):
+        return self._ticker(symbol).options
 
-        except Exception as e:
-            errors.append(f"{ticker}: {str(e)}")
-            logger.error(f"Error procesando {ticker}: {e}")
-            print(f"Error procesando {ticker}: {e}")
-            summary_message += f"==================================================\n"
-            summary_message += f"Analizando ticker: {ticker}\n"
-            summary_message += f"==================================================\n\n"
-            summary_message += f"Error procesando {ticker}: {str(e)}\n\n"
-
-    if all_options:
-        df_all = pd.DataFrame(all_options)
-        df_all.to_csv("todas_las_opciones.csv", index=False)
-    else:
-        logger.info("No se encontraron opciones que cumplan con los criterios para ningún ticker.")
-        print("No se encontraron opciones que cumplan con los criterios para ningún ticker.")
-        summary_message += "No se encontraron opciones que cumplan con los criterios para ningún ticker.\n"
-
-    # Guardar los mejores contratos (que cumplen las reglas de alerta) en un archivo
-    with open("Mejores_Contratos.txt", "w") as f:
-        f.write(f"Mejores Contratos por Ticker (Mayor Rentabilidad Anual, Menor Tiempo, Mayor Diferencia %):\n{'='*50}\n")
-        for ticker, best_contracts in best_contracts_by_ticker.items():
-            if not best_contracts.empty:
-                f.write(f"\nTicker: {ticker}\n{'-'*30}\n")
-                for i, row in best_contracts.iterrows():
-                    f.write(f"Contrato {i+1}:\n")
-                    f.write(f"  Ticker: {ticker}\n")
-                    f.write(f"  Strike: ${row['strike']:.2f}\n")
-                    f.write(f"  Last Closed: ${row['last_price']:.2f}\n")
-                    f.write(f"  Bid: ${row['bid']:.2f}\n")
-                    f.write(f"  Vencimiento: {row['expiration']}\n")
-                    f.write(f"  Días Venc.: {row['days_to_expiration']}\n")
-                    f.write(f"  Rent. Diaria: {row['rentabilidad_diaria']:.2f}%\n")
-                    f.write(f"  Rent. Anual: {row['rentabilidad_anual']:.2f}%\n")
-                    f.write(f"  Break-even: ${row['break_even']:.2f}\n")
-                    f.write(f"  Dif. % (Suby.-Break.): {row['percent_diff']:.2f}%\n")
-                    f.write(f"  Volatilidad Implícita: {row['implied_volatility']:.2f}%\n")
-                    f.write(f"  Volumen: {row['volume']}\n")
-                    f.write(f"  Interés Abierto: {row['open_interest']}\n")
-                    f.write(f"  Fuente: {row['source']}\n")
-                    f.write("\n")
-
-    # Generar mejores_contratos.csv (solo los que cumplen las reglas de alerta)
-    headers_csv = [
-        "Ticker", "Strike", "Last Closed", "Bid", "Vencimiento", "Días Venc.",
-        "Rent. Diaria", "Rent. Anual", "Break-even", "Dif. % (Suby.-Break.)",
-        "Volatilidad Implícita", "Volumen", "Interés Abierto", "Fuente"
-    ]
-    best_contracts_data = []
-    for ticker, best_contracts in best_contracts_by_ticker.items():
-        if not best_contracts.empty:
-            for _, row in best_contracts.iterrows():
-                best_contracts_data.append([
-                    ticker,
-                    f"${row['strike']:.2f}",
-                    f"${row['last_price']:.2f}",
-                    f"${row['bid']:.2f}",
-                    row['expiration'],
-                    row['days_to_expiration'],
-                    f"{row['rentabilidad_diaria']:.2f}%",
-                    f"{row['rentabilidad_anual']:.2f}%",
-                    f"${row['break_even']:.2f}",
-                    f"{row['percent_diff']:.2f}%",
-                    f"{row['implied_volatility']:.2f}%",
-                    row['volume'],
-                    row['open_interest'],
-                    row['source']
-                ])
-    df_best = pd.DataFrame(best_contracts_data, columns=headers_csv)
-    df_best.to_csv("mejores_contratos.csv", index=False)
-
-    summary_message += f"Errores: {', '.join(errors) if errors else 'Ninguno'}\n"
-    summary_message += "Resultados guardados.\n"
-
-    with open("resultados.txt", "w") as f:
-        f.write(summary_message)
-
-    # Enviar notificación a Discord solo si hay contratos que cumplen las reglas de alerta
-    tickers_identificados = [ticker for ticker, best_contracts in best_contracts_by_ticker.items() if not best_contracts.empty]
-    if config["FORCE_DISCORD_NOTIFICATION"] or tickers_identificados:
-        logger.debug(f"Enviando a {webhook_url} para {description}")
-        print(f"Enviando notificación a Discord para {description}")
-        send_discord_notification(tickers_identificados, webhook_url, config, description)
+    def option_chain(self, symbol, expiration):
+        opt = self._ticker(symbol).option_chain(expiration)
+        return OptionChain(calls=opt.calls, puts=opt.puts)
+
+    def history(self, symbol, start, end):
+        return self._ticker(symbol).history(start=start, end=end)
+
+    def download(self, symbols, period):
+        return yf.download(list(symbols), period=period, group_by="column", auto_adjust=True, progress=False, threads=True)
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Sirve respuestas grabadas previamente por RecordingProvider desde un directorio local, sin red.
+    Una petición que no se grabó lanza FileNotFoundError, igual que un fallo de la fuente real.
+    Estructura: <dir>/_meta.json, <dir>/<símbolo>/{info.json, options.json, chain_<venc>.pkl,
+    history_<inicio>_<fin>.pkl} y <dir>/_download/<símbolos>_<periodo>.pkl.
+    """
+    name = "replay"
+
+    def __init__(self, fixtures_dir):
+        self.fixtures_dir = fixtures_dir
+
+    def recorded_at(self):
+        """Instante de la grabación, para reproducir los días al vencimiento de entonces."""
+        meta_path = os.path.join(self.fixtures_dir, "_meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return datetime.fromisoformat(json.load(f)["recorded_at"])
+
+    def _path(self, symbol, name):
+        return os.path.join(self.fixtures_dir, symbol, name)
+
+    def _download_name(self, symbols, period):
+        # Nombre estable para la lista de símbolos, que puede ser muy larga
+        digest = hashlib.sha1(",".join(symbols).encode()).hexdigest()[:16]
+        return f"{digest}_{period}.pkl"
+
+    def _read_json(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def info(self, symbol):
+        return self._read_json(self._path(symbol, "info.json"))
+
+    def options(self, symbol):
+        return tuple(self._read_json(self._path(symbol, "options.json")))
+
+    def option_chain(self, symbol, expiration):
+        data = pd.read_pickle(self._path(symbol, f"chain_{expiration}.pkl"))
+        return OptionChain(calls=data["calls"], puts=data["puts"])
+
+    def history(self, symbol, start, end):
+        return pd.read_pickle(self._path(symbol, f"history_{start.date()}_{end.date()}.pkl"))
+
+    def download(self, symbols, period):
+        return pd.read_pickle(os.path.join(self.fixtures_dir, "_download", self._download_name(symbols, period)))
+
+class RecordingProvider(ReplayProvider):
+    """
+    Envuelve otra fuente y guarda cada respuesta en el directorio de grabaciones con el formato
+    que lee ReplayProvider, para poder repetir después la ejecución completa sin red.
+    """
+    name = "record"
+
+    def __init__(self, inner, fixtures_dir):
+        super().__init__(fixtures_dir)
+        self.inner = inner
+        os.makedirs(fixtures_dir, exist_ok=True)
+        with open(os.path.join(fixtures_dir, "_meta.json"), "w") as f:
+            json.dump({"recorded_at": analysis_now().isoformat(), "source": inner.name}, f)
+
+    def _write(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _write_json(self, path, value):
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(value, f, default=str)
+        self._write(path, write)
+
+    def info(self, symbol):
+        info = self.inner.info(symbol)
+        self._write_json(self._path(symbol, "info.json"), info)
+        return info
+
+    def options(self, symbol):
+        expirations = self.inner.options(symbol)
+        self._write_json(self._path(symbol, "options.json"), list(expirations))
+        return expirations
+
+    def option_chain(self, symbol, expiration):
+        chain = self.inner.option_chain(symbol, expiration)
+        data = {"calls": chain.calls, "puts": chain.puts}
+        self._write(self._path(symbol, f"chain_{expiration}.pkl"), lambda path: pd.to_pickle(data, path))
+        return chain
+
+    def history(self, symbol, start, end):
+        hist_data = self.inner.history(symbol, start, end)
+        self._write(self._path(symbol, f"history_{start.date()}_{end.date()}.pkl"), lambda path: hist_data.to_pickle(path))
+        return hist_data
+
+    def download(self, symbols, period):
+        data = self.inner.download(symbols, period)
+        path = os.path.join(self.fixtures_dir, "_download", self._download_name(symbols, period))
+        self._write(path, lambda tmp_path: data.to_pickle(tmp_path))
+        return data
+
+def create_market_data_provider():
+    """
+    Crea la fuente de datos según MARKET_DATA_PROVIDER: "yahoo" (por defecto), "record" (Yahoo
+    grabando en MARKET_DATA_FIXTURES_DIR) o "replay" (solo las grabaciones, sin red).
+    """
+    provider_name = os.getenv("MARKET_DATA_PROVIDER", "yahoo").lower()
+    fixtures_dir = os.getenv("MARKET_DATA_FIXTURES_DIR", "fixtures")
+    if provider_name == "record":
+        return RecordingProvider(YahooProvider(), fixtures_dir)
+    if provider_name == "replay":
+        return ReplayProvider(fixtures_dir)
+    if provider_name != "yahoo":
+        logger.warning(f"Fuente de datos no soportada: {provider_name}, se usa Yahoo")
+        print(f"Fuente de datos no soportada: {provider_name}, se usa Yahoo")
+    return YahooProvider()
+
+class TokenBucket:
+    """Limitador de tasa segura entre hilos: `rate` peticiones por segundo con ráfagas de hasta `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta que hay un token disponible y lo consume."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def parse_finnhub_option_chain(payload):
+    """
+    Convierte la respuesta de /stock/option-chain de Finnhub en {expiración: OptionChain} con las
+    columnas que usa yfinance. Finnhub da la IV en % (yfinance en decimales) y la fecha de la última
+    operación en hora de Nueva York sin zona horaria.
+    """
+    columns = {
+        "strike": "strike", "bid": "bid", "ask": "ask", "lastPrice": "lastPrice", "volume": "volume",
+        "openInterest": "openInterest", "impliedVolatility": "impliedVolatility", "lastTradeDateTime": "lastTradeDate"
+    }
+    chains = {}
+    for entry in payload.get("data") or []:
+        sides = {}
+        for side in ("CALL", "PUT"):
+            frame = pd.DataFrame((entry.get("options") or {}).get(side) or [])
+            frame = frame.reindex(columns=list(columns)).rename(columns=columns)
+            frame["impliedVolatility"] = pd.to_numeric(frame["impliedVolatility"], errors="coerce") / 100
+            frame["lastTradeDate"] = pd.to_datetime(frame["lastTradeDate"], errors="coerce").dt.tz_localize(
+                "America/New_York", ambiguous="NaT", nonexistent="NaT"
+            ).dt.tz_convert("UTC")
+            sides[side] = frame
+        chains[entry["expirationDate"]] = OptionChain(calls=sides["CALL"], puts=sides["PUT"])
+    return chains
+
+class FinnhubClient:
+    """
+    Cliente HTTP de Finnhub compartido por todos los workers: una sesión de requests con un pool de
+    conexiones reutilizables, un token bucket para respetar el límite de la API y reintentos con
+    backoff exponencial con jitter (o el Retry-After del servidor) ante 429, errores 5xx o de conexión.
+    Memoriza la cadena de opciones de cada símbolo durante la ejecución.
+    """
+    name = "finnhub"
+
+    def __init__(self, api_key, base_url="https://finnhub.io/api/v1", rate_per_second=1.0, burst=5,
+                 max_retries=3, backoff_seconds=1.0, pool_size=MAX_WORKERS, timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = TokenBucket(rate_per_second, burst)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self._api_key = api_key
+        self._pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._chains = {}
+
+    @property
+    def session(self):
+        """Sesión de requests, creada en la primera petición (requests se importa solo si se usa Finnhub)."""
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, self._pool_size))
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                # El token va en cabecera para que no aparezca en las URLs de los logs
+                session.headers["X-Finnhub-Token"] = self._api_key
+                self._session = session
+            return self._session
+
+    def clear(self):
+        with self._lock:
+            self._key_locks = {}
+            self._chains = {}
+
+    def _retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        try:
+            return max(0.0, float(retry_after))
+        except (TypeError, ValueError):
+            return self.backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    def get(self, path, params=None, kind=None):
+        """GET a la API con limitación de tasa y reintentos; retorna el JSON de la respuesta."""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        start = time.perf_counter()
+        retries = 0
+        while True:
+            self.rate_limiter.acquire()
+            error = None
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                retryable = response.status_code == 429 or response.status_code >= 500
+            except requests.RequestException as e:
+                response, retryable, error = None, True, e
+            except Exception:
+                run_metrics.record_request(self.name, kind or path, retries=retries, error=True, seconds=time.perf_counter() - start)
+                raise
+            if not retryable or retries >= self.max_retries:
+                break
+            retries += 1
+            delay = self._retry_delay(response, retries)
+            status = response.status_code if response is not None else error
+            logger.info(f"Finnhub: reintento {retries}/{self.max_retries} de {path} en {delay:.1f}s ({status})")
+            time.sleep(delay)
+
+        # El JSON se decodifica antes de registrar la petición, para contar como error una respuesta ilegible
+        payload = None
+        if response is not None and response.ok:
+            try:
+                payload = response.json()
+            except ValueError as e:
+                error = e
+        run_metrics.record_request(
+            self.name, kind or path,
+            nbytes=len(response.content) if response is not None else 0,
+            retries=retries,
+            error=response is None or not response.ok or error is not None,
+            seconds=time.perf_counter() - start
+        )
+        if response is None or error is not None:
+            raise error
+        response.raise_for_status()
+        return payload
+
+    def option_chains(self, symbol):
+        """Cadenas de opciones del símbolo por expiración ({expiración: OptionChain}), con una sola petición."""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(symbol, threading.Lock())
+        with key_lock:
+            if symbol not in self._chains:
+                payload = self.get("stock/option-chain", {"symbol": symbol}, kind="option_chain")
+                self._chains[symbol] = parse_finnhub_option_chain(payload)
+            return self._chains[symbol]
+
+def create_finnhub_client():
+    """
+    Crea el cliente de Finnhub si hay FINNHUB_API_KEY; sin clave, Finnhub queda desactivado.
+    FINNHUB_BASE_URL permite apuntarlo a un servidor local (por ejemplo, un mock en pruebas),
+    FINNHUB_RATE_PER_SECOND y FINNHUB_BURST ajustan el token bucket y FINNHUB_MAX_RETRIES los reintentos.
+    """
+    api_key = os.getenv("FINNHUB_API_KEY")
+    if not api_key:
+        return None
+    return FinnhubClient(
+        api_key,
+        base_url=os.getenv("FINNHUB_BASE_URL", "https://finnhub.io/api/v1"),
+        rate_per_second=float(os.getenv("FINNHUB_RATE_PER_SECOND", 1.0)),
+        burst=float(os.getenv("FINNHUB_BURST", 5)),
+        max_retries=int(os.getenv("FINNHUB_MAX_RETRIES", 3))
+    )
+
+class RequestThrottledError(Exception):
+    """La fuente siguió limitando las peticiones (429) después de agotar los reintentos."""
+
+def _yf_rate_limit_error():
+    """Excepción de yfinance para el límite de peticiones de Yahoo (no existe en versiones antiguas)."""
+    # Si yfinance no se ha importado, el error no puede venir de él
+    if "yfinance" not in sys.modules:
+        return ()
+    return getattr(getattr(yf, "exceptions", None), "YFRateLimitError", ())
+
+_TRANSIENT_ERROR_NAMES = {"ConnectionError", "Timeout", "ConnectTimeout", "ReadTimeout", "ChunkedEncodingError"}
+
+def request_error_kind(error):
+    """
+    Clasifica un error de la fuente de datos: "throttled" si es un límite de peticiones (429),
+    "transient" si es de conexión, timeout o 5xx, y None si reintentarlo no serviría.
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(error, (RequestThrottledError, _yf_rate_limit_error())) or status == 429 or "too many requests" in str(error).lower():
+        return "throttled"
+    # yfinance usa requests o curl_cffi según la versión; sus excepciones de red comparten nombre
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)) or type(error).__name__ in _TRANSIENT_ERROR_NAMES:
+        return "transient"
+    if status is not None and status >= 500:
+        return "transient"
+    return None
+
+class RequestScheduler:
+    """
+    Planificador de las peticiones a las fuentes de datos de mercado, compartido por todos los workers.
+    Limita la concurrencia global y la de cada host con un control adaptativo AIMD: cada petición
+    correcta sube el límite del host en 1/límite (un slot más por ventana completa) y un 429 o un error
+    transitorio lo divide por dos, una sola vez por episodio. Tras un 429 el host entero se pausa con
+    backoff exponencial con jitter antes de reintentar. Las peticiones en espera se atienden por
+    prioridad (tupla menor primero), así que los tickers prioritarios y las expiraciones cercanas
+    se descargan antes cuando el límite se ha reducido.
+    """
+
+    def __init__(self, max_concurrency=MAX_WORKERS, host_limits=None, max_retries=3, backoff_seconds=2.0,
+                 max_backoff_seconds=60.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.host_limits = host_limits or {}
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._condition = threading.Condition()
+        self._sequence = 0
+        self._in_flight = 0
+        self._hosts = {}
+        self._priority_symbols = set()
+        self.counters = {"requests": 0, "retries": 0, "throttled": 0, "transient_errors": 0, "waits": 0}
+
+    def prioritize(self, symbols):
+        """Marca símbolos cuyas peticiones se atienden antes que las del resto."""
+        with self._condition:
+            self._priority_symbols.update(symbols)
+
+    def priority(self, symbol, days_to_expiration=None):
+        """Prioridad de una petición: símbolos prioritarios primero y, dentro de cada uno, los datos
+        generales (info, vencimientos, histórico) antes que las cadenas, por cercanía de la expiración."""
+        with self._condition:
+            rank = 0 if symbol in self._priority_symbols else 1
+        return (rank, -1 if days_to_expiration is None else days_to_expiration)
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            max_limit = max(1, min(self.max_concurrency, self.host_limits.get(host, self.max_concurrency)))
+            state = self._hosts[host] = {
+                "limit": float(max_limit), "max_limit": max_limit, "min_seen": float(max_limit),
+                "in_flight": 0, "resume_at": 0.0, "waiting": []
+            }
+        return state
+
+    def _acquire(self, host, priority):
+        with self._condition:
+            state = self._host(host)
+            self._sequence += 1
+            ticket = (priority, self._sequence)
+            heapq.heappush(state["waiting"], ticket)
+            waited = False
+            while True:
+                pause = state["resume_at"] - time.monotonic()
+                if (pause <= 0 and state["waiting"][0] == ticket and state["in_flight"] < int(state["limit"])
+                        and self._in_flight < self.max_concurrency):
+                    break
+                waited = True
+                self._condition.wait(pause if pause > 0 else None)
+            heapq.heappop(state["waiting"])
+            state["in_flight"] += 1
+            self._in_flight += 1
+            self.counters["requests"] += 1
+            self.counters["waits"] += int(waited)
+            # El siguiente en la cola puede tener hueco también
+            self._condition.notify_all()
+
+    def _release(self, host, error_kind=None, attempt=0):
+        """Libera el slot y ajusta el límite del host; retorna la espera antes del reintento."""
+        with self._condition:
+            state = self._hosts[host]
+            state["in_flight"] -= 1
+            self._in_flight -= 1
+            delay = 0.0
+            now = time.monotonic()
+            if error_kind is None:
+                state["limit"] = min(state["max_limit"], state["limit"] + 1 / state["limit"])
+            else:
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt) * random.uniform(0.5, 1.5)
+                # Los fallos de peticiones que ya estaban en curso no vuelven a reducir el límite
+                if now >= state["resume_at"]:
+                    state["limit"] = max(1.0, state["limit"] / 2)
+                    state["min_seen"] = min(state["min_seen"], state["limit"])
+                if error_kind == "throttled":
+                    state["resume_at"] = max(state["resume_at"], now + delay)
+                self.counters["throttled" if error_kind == "throttled" else "transient_errors"] += 1
+            self._condition.notify_all()
+            return delay
+
+    def run(self, host, fetch, priority=(1, -1), description=""):
+        """
+        Ejecuta fetch() cuando hay hueco para el host, reintentando los límites de peticiones y los
+        errores transitorios. Retorna (valor, reintentos). Si los 429 persisten lanza RequestThrottledError;
+        el resto de errores llegan al llamador sin cambios. La excepción lleva en `retries` los reintentos hechos.
+        """
+        attempt = 0
+        while True:
+            self._acquire(host, priority)
+            try:
+                value = fetch()
+            except Exception as e:
+                error_kind = request_error_kind(e)
+                e.retries = attempt
+                if error_kind is None:
+                    self._release(host)
+                    raise
+                delay = self._release(host, error_kind, attempt)
+                if attempt >= self.max_retries:
+                    if error_kind == "throttled":
+                        throttled = RequestThrottledError(f"{host}: límite de peticiones en {description} tras {attempt} reintentos: {e}")
+                        throttled.retries = attempt
+                        raise throttled from e
+                    raise
+                attempt += 1
+                with self._condition:
+                    self.counters["retries"] += 1
+                logger.info(f"{host}: reintento {attempt}/{self.max_retries} de {description} en {delay:.1f}s ({error_kind}: {e})")
+                # Tras un 429 la pausa se aplica al host entero al volver a pedir el slot
+                if error_kind == "transient":
+                    time.sleep(delay)
+                continue
+            self._release(host)
+            return value, attempt
+
+    def stats(self):
+        with self._condition:
+            return {
+                **self.counters,
+                "max_concurrency": self.max_concurrency,
+                "hosts": {
+                    host: {"limit": round(state["limit"], 2), "min_limit": round(state["min_seen"], 2), "max_limit": state["max_limit"]}
+                    for host, state in self._hosts.items()
+                },
+            }
+
+def create_request_scheduler():
+    """
+    Crea el planificador de peticiones según el entorno: REQUEST_MAX_CONCURRENCY (por defecto MAX_WORKERS),
+    REQUEST_HOST_LIMITS con límites por host ("yahoo=3,replay=8"), REQUEST_MAX_RETRIES y REQUEST_BACKOFF_SECONDS.
+    """
+    host_limits = {}
+    for item in os.getenv("REQUEST_HOST_LIMITS", "").split(","):
+        host, _, limit = item.partition("=")
+        if host.strip() and limit.strip():
+            host_limits[host.strip()] = int(limit)
+    return RequestScheduler(
+        max_concurrency=int(os.getenv("REQUEST_MAX_CONCURRENCY", MAX_WORKERS)),
+        host_limits=host_limits,
+        max_retries=int(os.getenv("REQUEST_MAX_RETRIES", 3)),
+        backoff_seconds=float(os.getenv("REQUEST_BACKOFF_SECONDS", 2.0))
+    )
+
+# Veces que un ticker limitado por la fuente vuelve al final de la cola antes de darse por perdido
+THROTTLED_TICKER_REQUEUES = int(os.getenv("REQUEST_TICKER_REQUEUES", 2))
+
+def map_requeuing_throttled(executor, fn, items, on_exhausted, max_requeues=None):
+    """
+    Como executor.map (resultados en el orden de items), pero un elemento cuyo fn lanza
+    RequestThrottledError vuelve a encolarse al final del executor en lugar de perderse, hasta
+    max_requeues veces; si sigue limitado se usa on_exhausted(item, error) como su resultado.
+    """
+    max_requeues = THROTTLED_TICKER_REQUEUES if max_requeues is None else max_requeues
+    futures = [executor.submit(fn, item) for item in items]
+    for item, future in zip(items, futures):
+        requeues = 0
+        while True:
+            try:
+                result = future.result()
+                break
+            except RequestThrottledError as e:
+                if requeues >= max_requeues:
+                    logger.error(f"{item}: la fuente sigue limitando las peticiones tras {requeues} reintentos del ticker")
+                    print(f"{item}: la fuente sigue limitando las peticiones tras {requeues} reintentos del ticker")
+                    result = on_exhausted(item, e)
+                    break
+                requeues += 1
+                logger.info(f"{item}: limitado por la fuente, se vuelve a encolar ({requeues}/{max_requeues})")
+                print(f"{item}: limitado por la fuente, se vuelve a encolar ({requeues}/{max_requeues})")
+                future = executor.submit(fn, item)
+        yield result
+
+class MarketDataCache:
+    """
+    Caché de datos de mercado con alcance de una ejecución.
+    Memoriza por símbolo info, fechas de vencimiento, cadenas de opciones e histórico,
+    de modo que el screener, el escáner y el reporte descargan cada dato una sola vez.
+    Es segura entre hilos: dos workers que piden la misma clave esperan a una única descarga.
+    Las descargas pasan por el planificador de peticiones (límites de concurrencia y reintentos).
+    En modo daemon la caché se conserva entre ciclos y cada tipo de dato ("info", "options",
+    "option_chain", "history", "download") caduca a los segundos indicados en ttls.
+    """
+
+    def __init__(self, provider=None, snapshot_store=None, scheduler=None, archive=None, ttls=None):
+        self.provider = provider or YahooProvider()
+        self.snapshot_store = snapshot_store
+        self.archive = archive
+        self.scheduler = scheduler or RequestScheduler()
+        self.ttls = ttls or {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._data = {}
+        self._stored_at = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self._lock:
+            self._key_locks.clear()
+            self._data.clear()
+            self._stored_at.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def _fresh(self, key):
+        # Sin ttl para su tipo, un dato vale durante toda la vida de la caché
+        ttl = self.ttls.get(key[1])
+        return ttl is None or time.monotonic() - self._stored_at[key] < ttl
+
+    def expire(self):
+        """Descarta los datos caducados según ttls; retorna cuántos se descartaron."""
+        with self._lock:
+            expired = [key for key in self._data if not self._fresh(key)]
+            for key in expired:
+                del self._data[key]
+                del self._stored_at[key]
+                self._key_locks.pop(key, None)
+            return len(expired)
+
+    def _get(self, key, fetch):
+        with self._lock:
+            if key in self._data and self._fresh(key):
+                self.hits += 1
+                return self._data[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._data and self._fresh(key):
+                    self.hits += 1
+                    return self._data[key]
+            # Si la descarga falla no se guarda nada y la excepción llega al llamador
+            value = fetch()
+            with self._lock:
+                self._data[key] = value
+                self._stored_at[key] = time.monotonic()
+                self.misses += 1
+            return value
+
+    def _call_provider(self, kind, symbol, fetch, days_to_expiration=None):
+        """
+        Llama a la fuente de datos a través del planificador, registrando la duración (incluidas
+        las esperas), el tamaño, los reintentos y los errores de la petición.
+        """
+        start = time.perf_counter()
+        priority = self.scheduler.priority(symbol, days_to_expiration)
+        description = f"{kind} {symbol}" if symbol else kind
+        with run_metrics.stage(kind, symbol):
+            try:
+                value, retries = self.scheduler.run(self.provider.name, fetch, priority, description)
+            except Exception as e:
+                run_metrics.record_request(
+                    self.provider.name, kind, retries=getattr(e, "retries", 0), error=True, seconds=time.perf_counter() - start
+                )
+                raise
+        run_metrics.record_request(
+            self.provider.name, kind, nbytes=_payload_size(value), retries=retries, seconds=time.perf_counter() - start
+        )
+        return value
+
+    def info(self, symbol):
+        return self._get((symbol, "info"), lambda: self._fetch_info(symbol))
+
+    def _fetch_info(self, symbol):
+        info = self._call_provider("info", symbol, lambda: self.provider.info(symbol))
+        if self.archive is not None:
+            self.archive.add_underlying(symbol, info)
+        return info
+
+    def options(self, symbol):
+        return self._get((symbol, "options"), lambda: self._fetch_options(symbol))
+
+    def option_chain(self, symbol, expiration):
+        return self._get((symbol, "option_chain", expiration), lambda: self._fetch_option_chain(symbol, expiration))
+
+    def _fetch_options(self, symbol):
+        if self.snapshot_store is not None:
+            expirations = self.snapshot_store.load_expirations(symbol)
+            if expirations is not None:
+                run_metrics.record_request("snapshot", "options", nbytes=_payload_size(list(expirations)))
+                return expirations
+        expirations = self._call_provider("options", symbol, lambda: self.provider.options(symbol))
+        if self.snapshot_store is not None:
+            self.snapshot_store.save_expirations(symbol, expirations)
+        return expirations
+
+    def _fetch_option_chain(self, symbol, expiration):
+        if self.snapshot_store is not None:
+            chain = self.snapshot_store.load_chain(symbol, expiration)
+            if chain is not None:
+                run_metrics.record_request("snapshot", "option_chain", nbytes=_payload_size(chain))
+                return chain
+        days_to_expiration = (datetime.strptime(expiration, '%Y-%m-%d') - analysis_now()).days
+        chain = self._call_provider(
+            "option_chain", symbol, lambda: self.provider.option_chain(symbol, expiration), days_to_expiration
+        )
+        if self.snapshot_store is not None:
+            self.snapshot_store.save_chain(symbol, expiration, chain)
+        # Solo se archivan las descargas: un snapshot reutilizado ya se archivó en la ejecución que lo guardó
+        if self.archive is not None:
+            self.archive.add_chain(symbol, expiration, chain)
+        return chain
+
+    def history(self, symbol, start, end):
+        # Dentro de una ejecución basta con la fecha para identificar el rango pedido
+        key = (symbol, "history", start.date(), end.date())
+        return self._get(key, lambda: self._call_provider("history", symbol, lambda: self.provider.history(symbol, start, end)))
+
+    def download(self, symbols, period):
+        # Precios y volúmenes diarios de varios símbolos en una sola petición
+        key = (tuple(symbols), "download", period)
+        return self._get(key, lambda: self._call_provider("download", None, lambda: self.provider.download(symbols, period)))
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+# Caché compartida por todas las etapas de la ejecución actual
+market_data_cache = MarketDataCache()
+
+# Segunda fuente de opciones (None si no hay FINNHUB_API_KEY)
+finnhub_client = create_finnhub_client()
+
+def atm_implied_volatilities(ticker, expiration, opt, current_price, iv_source="yahoo", days_to_expiration=None):
+    """
+    Devuelve las volatilidades implícitas (%) válidas de la opción ATM de los puts y de los calls
+    de una cadena, usando el strike más cercano al precio actual.
+    Con iv_source "mid" o "bid" la IV se resuelve a partir del precio en lugar de tomar la de Yahoo.
+    """
+    iv_values = []
+    # Considerar puts y calls para obtener una mejor estimación
+    for chain, is_call in [(opt.puts, False), (opt.calls, True)]:
+        if chain.empty:
+            logger.debug(f"{ticker}: Cadena de opciones vacía para {expiration}")
+            continue
+        # Encontrar la opción ATM (strike más cercano al precio actual)
+        # (sin añadir columnas: la cadena está en caché y la comparten otras etapas)
+        strike_diff = abs(chain['strike'] - current_price)
+        atm_index = strike_diff.idxmin()
+        if iv_source == "yahoo":
+            iv = chain.loc[atm_index].get('impliedVolatility', 0) * 100
+        else:
+            iv = solve_chain_implied_volatility(
+                chain.loc[[atm_index]], current_price, days_to_expiration, iv_source, is_call, ticker
+            ).iloc[0] * 100
+        if iv > 0:
+            iv_values.append(iv)
+        else:
+            logger.debug(f"{ticker}: Volatilidad implícita no válida para {expiration}: {iv}%")
+    return iv_values
+
+def calculate_volatility_metrics(ticker, max_days=45, hist_vol_period=30, hist_vols=None, iv_source="yahoo"):
+    """
+    Calcula la volatilidad implícita promedio (IV) y la volatilidad histórica (Hist Vol) de un ticker.
+    Si hist_vols (resultado de calculate_historical_volatilities) incluye el ticker, se usa esa Hist Vol
+    en lugar de descargar su histórico. iv_source selecciona el origen de la IV (ver FUENTE_VOLATILIDAD).
+    Retorna un diccionario con IV, Hist Vol y el volumen del subyacente.
+    """
+    try:
+        info = market_data_cache.info(ticker)
+        # Obtener el precio actual y el volumen del subyacente
+        current_price = info.get('regularMarketPrice', info.get('previousClose', 0))
+        volume = info.get('averageVolume', 0)
+        if current_price <= 0:
+            logger.info(f"{ticker}: Precio actual no válido: ${current_price}")
+            print(f"{ticker}: Precio actual no válido: ${current_price}")
+            return None
+
+        logger.info(f"{ticker}: Precio actual: ${current_price:.2f}, Volumen promedio: {volume}")
+        print(f"{ticker}: Precio actual: ${current_price:.2f}, Volumen promedio: {volume}")
+
+        # Calcular volatilidad implícita promedio (IV) usando opciones ATM
+        expirations = market_data_cache.options(ticker)
+        if not expirations:
+            logger.info(f"{ticker}: No hay fechas de vencimiento disponibles para opciones")
+            print(f"{ticker}: No hay fechas de vencimiento disponibles para opciones")
+            return None
+
+        iv_values = []
+        for expiration in expirations:
+            expiration_date = datetime.strptime(expiration, '%Y-%m-%d')
+            days_to_expiration = (expiration_date - analysis_now()).days
+            if days_to_expiration <= 0 or days_to_expiration > max_days:
+                logger.debug(f"{ticker}: Expiración {expiration} descartada: {days_to_expiration} días")
+                continue
+
+            opt = market_data_cache.option_chain(ticker, expiration)
+            iv_values.extend(atm_implied_volatilities(ticker, expiration, opt, current_price, iv_source, days_to_expiration))
+
+        if not iv_values:
+            logger.info(f"{ticker}: No se encontraron opciones válidas para calcular IV")
+            print(f"{ticker}: No se encontraron opciones válidas para calcular IV")
+            return None
+        implied_volatility = np.mean(iv_values)
+        logger.info(f"{ticker}: Volatilidad implícita promedio: {implied_volatility:.2f}%")
+        print(f"{ticker}: Volatilidad implícita promedio: {implied_volatility:.2f}%")
+
+        # Calcular volatilidad histórica (Hist Vol), o tomarla del cálculo en bloque si ya se hizo
+        if hist_vols is not None and ticker in hist_vols:
+            hist_vol = hist_vols[ticker]
+            if hist_vol is None:
+                return None
+        else:
+            end_date = analysis_now()
+            start_date = end_date - timedelta(days=hist_vol_period + 1)
+            hist_data = market_data_cache.history(ticker, start_date, end_date)
+            num_days = len(hist_data)
+
+            if num_days < MIN_HIST_VOL_DAYS:
+                logger.info(f"{ticker}: No hay suficientes datos históricos para calcular Hist Vol (se encontraron {num_days} días, se requieren al menos {MIN_HIST_VOL_DAYS})")
+                print(f"{ticker}: No hay suficientes datos históricos para calcular Hist Vol (se encontraron {num_days} días, se requieren al menos {MIN_HIST_VOL_DAYS})")
+                return None
+
+            # Si hay menos días de los solicitados, usar los días disponibles
+            if num_days < hist_vol_period:
+                logger.info(f"{ticker}: Datos históricos insuficientes para {hist_vol_period} días, usando {num_days} días disponibles")
+                print(f"{ticker}: Datos históricos insuficientes para {hist_vol_period} días, usando {num_days} días disponibles")
+
+            # Calcular retornos diarios logarítmicos
+            returns = np.log(hist_data['Close'] / hist_data['Close'].shift(1))
+            hist_vol = returns.std() * np.sqrt(252) * 100  # Anualizar
+        logger.info(f"{ticker}: Volatilidad histórica: {hist_vol:.2f}%")
+        print(f"{ticker}: Volatilidad histórica: {hist_vol:.2f}%")
+
+        return {
+            "ticker": ticker,
+            "implied_volatility": implied_volatility,
+            "historical_volatility": hist_vol,
+            "volume": volume
+        }
+    except RequestThrottledError:
+        # No es falta de datos: el llamador vuelve a encolar el ticker
+        raise
+    except Exception as e:
+        logger.info(f"Error calculando métricas de volatilidad para {ticker}: {e}")
+        print(f"Error calculando métricas de volatilidad para {ticker}: {e}")
+        return None
+
+def _download_field(data, field, symbols):
+    """Extrae un campo (Close, Volume...) de yf.download como DataFrame con una columna por símbolo."""
+    frame = data[field]
+    if isinstance(frame, pd.Series):
+        frame = frame.to_frame(symbols[0])
+    return frame
+
+def download_daily_bars(tickers, min_days=90):
+    """
+    Descarga en una sola petición (memorizada en la caché) las barras diarias de todos los tickers,
+    cubriendo al menos min_days días naturales. El primer nivel del screener y la Hist Vol en bloque
+    piden el mismo rango, así que comparten la descarga.
+    """
+    for period, days in (("3mo", 90), ("6mo", 180), ("1y", 365), ("2y", 730)):
+        if min_days <= days:
+            break
+    return market_data_cache.download(tickers, period)
+
+def calculate_historical_volatilities(tickers, hist_vol_period=30, min_days_required=MIN_HIST_VOL_DAYS):
+    """
+    Calcula la volatilidad histórica anualizada de todos los tickers a la vez a partir de una única
+    descarga de cierres, con una operación matricial sobre una columna por símbolo.
+    Igual que el cálculo por ticker, usa los días disponibles si hay menos de hist_vol_period y
+    descarta los tickers con menos de min_days_required días.
+    Retorna un diccionario {ticker: Hist Vol en %} con None para los tickers sin datos suficientes.
+    """
+    data = download_daily_bars(tickers, max(90, hist_vol_period + 1))
+    closes = _download_field(data, "Close", tickers).reindex(columns=list(tickers))
+    if closes.index.tz is not None:
+        closes.index = closes.index.tz_localize(None)
+    start_date = analysis_now() - timedelta(days=hist_vol_period + 1)
+    closes = closes[closes.index >= pd.Timestamp(start_date.date())]
+
+    # El cierre anterior de cada símbolo es su último cierre válido, como si se descargara por separado
+    previous_closes = closes.ffill().shift(1)
+    returns = np.log(closes / previous_closes)
+    num_days = closes.notna().sum()
+    hist_vol = returns.std() * np.sqrt(252) * 100  # Anualizar
+
+    hist_vols = {}
+    for ticker in tickers:
+        days = int(num_days[ticker])
+        if days < min_days_required:
+            logger.info(f"{ticker}: No hay suficientes datos históricos para calcular Hist Vol (se encontraron {days} días, se requieren al menos {min_days_required})")
+            print(f"{ticker}: No hay suficientes datos históricos para calcular Hist Vol (se encontraron {days} días, se requieren al menos {min_days_required})")
+            hist_vols[ticker] = None
+            continue
+        if days < hist_vol_period:
+            logger.info(f"{ticker}: Datos históricos insuficientes para {hist_vol_period} días, usando {days} días disponibles")
+            print(f"{ticker}: Datos históricos insuficientes para {hist_vol_period} días, usando {days} días disponibles")
+        hist_vols[ticker] = hist_vol[ticker]
+    return hist_vols
+
+def screen_by_quotes(tickers, min_volume, volume_tolerance=0.8, min_days=90):
+    """
+    Primer nivel del screener: con una sola descarga en bloque de precios y volúmenes diarios
+    descarta, antes de pedir ninguna cadena, los tickers sin cotización o con un volumen medio
+    claramente inferior a min_volume (por debajo de min_volume * volume_tolerance).
+    Es una aproximación: el volumen medio de las barras diarias no es el averageVolume del filtro
+    definitivo, y un ticker descartado aquí ya no se evalúa con las métricas completas.
+    Retorna (tickers que pasan, descartados por falta de datos, descartados por volumen).
+    """
+    try:
+        data = download_daily_bars(tickers, min_days)
+        closes = _download_field(data, "Close", tickers)
+        volumes = _download_field(data, "Volume", tickers)
+    except Exception as e:
+        logger.info(f"Error en la descarga en bloque de cotizaciones, se omite el primer nivel: {e}")
+        print(f"Error en la descarga en bloque de cotizaciones, se omite el primer nivel: {e}")
+        return list(tickers), [], []
+
+    passed = []
+    discarded_by_data = []
+    discarded_by_volume = []
+    for ticker in tickers:
+        if ticker not in closes or closes[ticker].dropna().empty:
+            logger.info(f"{ticker}: Descartado en el primer nivel por falta de cotizaciones")
+            print(f"{ticker}: Descartado en el primer nivel por falta de cotizaciones")
+            discarded_by_data.append(ticker)
+            continue
+        average_volume = volumes[ticker].mean() if ticker in volumes else 0
+        if average_volume < min_volume * volume_tolerance:
+            logger.info(f"{ticker}: Descartado en el primer nivel por volumen bajo: {average_volume:.0f} < {min_volume}")
+            print(f"{ticker}: Descartado en el primer nivel por volumen bajo: {average_volume:.0f} < {min_volume}")
+            discarded_by_volume.append(ticker)
+            continue
+        passed.append(ticker)
+    return passed, discarded_by_data, discarded_by_volume
+
+def probe_atm_iv(ticker, max_days=45, iv_source="yahoo"):
+    """
+    Segundo nivel del screener: volatilidad implícita ATM de la expiración válida más cercana,
+    descargando una sola cadena. Es una estimación de la IV multi-expiración de las métricas completas.
+    Retorna None si no hay datos suficientes.
+    """
+    try:
+        info = market_data_cache.info(ticker)
+        current_price = info.get('regularMarketPrice', info.get('previousClose', 0))
+        if current_price <= 0:
+            return None
+        for expiration in market_data_cache.options(ticker):
+            days_to_expiration = (datetime.strptime(expiration, '%Y-%m-%d') - analysis_now()).days
+            if days_to_expiration <= 0 or days_to_expiration > max_days:
+                continue
+            opt = market_data_cache.option_chain(ticker, expiration)
+            iv_values = atm_implied_volatilities(ticker, expiration, opt, current_price, iv_source, days_to_expiration)
+            if iv_values:
+                return np.mean(iv_values)
+        return None
+    except RequestThrottledError:
+        raise
+    except Exception as e:
+        logger.info(f"Error en la sonda de IV para {ticker}: {e}")
+        return None
+
+def dynamic_universe(dynamic_source):
+    """
+    Retorna (nombre, tickers) del universo de una fuente dinámica: el NASDAQ-100 estático, una lista
+    explícita, un archivo de constituyentes ("file") o un índice con su archivo en CONSTITUENTS_DIR.
+    tickers es None si la fuente no está soportada o no se encuentra su archivo.
+    """
+    index = dynamic_source.get("index")
+    if index == "nasdaq100":
+        return index, NASDAQ_100_TICKERS  # Usar la lista estática
+    if "tickers" in dynamic_source:
+        # Universo explícito (por ejemplo, el sintético del benchmark)
+        return "lista explícita", dynamic_source["tickers"]
+    path = dynamic_source.get("file") or (constituents_path(index) if index else None)
+    if path is None:
+        if index:
+            logger.error(f"No se encontró el archivo de constituyentes de {index} en {CONSTITUENTS_DIR} ({index}.csv o {index}.txt)")
+            print(f"No se encontró el archivo de constituyentes de {index} en {CONSTITUENTS_DIR} ({index}.csv o {index}.txt)")
+        else:
+            logger.error(f"Fuente dinámica no soportada: {index}")
+            print(f"Fuente dinámica no soportada: {index}")
+        return index, None
+    return index or path, load_constituents(path)
+
+def universe_available(group_type):
+    """
+    Indica si el universo del grupo está disponible. Los grupos de un índice leído de CONSTITUENTS_DIR
+    (sp500, russell1000) dependen de un archivo que el repositorio no incluye: hasta que exista no
+    forman parte de GROUP_TYPE=all, aunque se pueden ejecutar indicándolos por nombre.
+    """
+    source = GROUPS_CONFIG[group_type].get("dynamic_source")
+    if not source or source.get("index") == "nasdaq100" or "tickers" in source:
+        return True
+    if "file" in source:
+        return os.path.exists(source["file"])
+    return constituents_path(source.get("index")) is not None
+
+def shard_tickers(tickers, shard_index, shard_count):
+    """
+    Parte de los tickers que corresponde al shard shard_index de shard_count, en el orden original.
+    El reparto (crc32 del símbolo) no depende del orden ni del tamaño de la lista, así que es el
+    mismo en cualquier proceso o runner.
+    """
+    return [ticker for ticker in tickers if zlib.crc32(ticker.encode()) % shard_count == shard_index]
+
+def generate_dynamic_tickers(dynamic_source, dynamic_criteria):
+    """
+    Genera una lista de tickers dinámicamente basada en los criterios especificados.
+    """
+    try:
+        screened = screen_dynamic_universe(dynamic_source, dynamic_criteria)
+        if screened.empty:
+            return []
+        return select_dynamic_tickers(screened, dynamic_criteria)
+    except Exception as e:
+        logger.error(f"Error generando tickers dinámicos: {e}")
+        print(f"Error generando tickers dinámicos: {e}")
+        return []
+
+def screen_dynamic_universe(dynamic_source, dynamic_criteria, shard=None):
+    """
+    Criba el universo de una fuente dinámica (o solo su parte si shard es (índice, número de shards))
+    y retorna un DataFrame con las métricas de volatilidad de los tickers que pasan los filtros.
+    Los niveles 1 y 2 descartan con aproximaciones baratas (volumen de las barras diarias, IV ATM de una
+    sola expiración) y la terminación anticipada, si el grupo define probe_iv_margin, supone una cota de la
+    IV completa a partir de la sonda: la selección puede diferir de la que daría evaluar todo el universo.
+    Los tickers que omite cada nivel se registran en el log.
+    """
+    # Obtener la lista de tickers según la fuente
+    index, tickers = dynamic_universe(dynamic_source)
+    if tickers is None:
+        return pd.DataFrame()
+    if shard is not None:
+        universe_size = len(tickers)
+        tickers = shard_tickers(tickers, *shard)
+        logger.info(f"Shard {shard[0]} de {shard[1]}: {len(tickers)} de {universe_size} tickers de {index}")
+        print(f"Shard {shard[0]} de {shard[1]}: {len(tickers)} de {universe_size} tickers de {index}")
+
+    logger.info(f"Total de tickers iniciales para {index}: {len(tickers)}")
+    print(f"Total de tickers iniciales para {index}: {len(tickers)}")
+
+    # Obtener criterios de filtrado
+    top_n = dynamic_criteria.get("top", 15)
+    prefer_iv_over_hist_vol = dynamic_criteria.get("prefer_iv_over_hist_vol", True)
+    min_iv = dynamic_criteria.get("min_iv", 35.0)
+    min_volume = dynamic_criteria.get("min_volume", 1000000)
+    hist_vol_period = dynamic_criteria.get("hist_vol_period", 30)
+
+    volume_tolerance = dynamic_criteria.get("volume_tolerance", 0.8)
+    probe_iv_tolerance = dynamic_criteria.get("probe_iv_tolerance", 0.75)
+    probe_iv_margin = dynamic_criteria.get("probe_iv_margin")
+    iv_source = dynamic_criteria.get("iv_source", "yahoo")
+
+    volatility_data = []
+    discarded_by_iv = 0
+    discarded_by_volume = 0
+    discarded_by_data = 0
+
+    # Nivel 1: cotizaciones y volumen medio en bloque, sin descargar cadenas
+    candidates, tier1_by_data, tier1_by_volume = screen_by_quotes(
+        tickers, min_volume, volume_tolerance, min_days=max(90, hist_vol_period + 1)
+    )
+    discarded_by_data += len(tier1_by_data)
+    discarded_by_volume += len(tier1_by_volume)
+    logger.info(f"Nivel 1 (cotizaciones): {len(candidates)} de {len(tickers)} tickers pasan")
+    print(f"Nivel 1 (cotizaciones): {len(candidates)} de {len(tickers)} tickers pasan")
+    if tier1_by_data or tier1_by_volume:
+        logger.info(f"Nivel 1: omitidos sin cotizaciones: {', '.join(tier1_by_data) or '-'}; por volumen medio bajo: {', '.join(tier1_by_volume) or '-'}")
+        print(f"Nivel 1: omitidos sin cotizaciones: {', '.join(tier1_by_data) or '-'}; por volumen medio bajo: {', '.join(tier1_by_volume) or '-'}")
+
+    # Nivel 2: una sola cadena cercana por ticker para estimar la IV ATM
+    with ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS)) as executor:
+        probes = list(map_requeuing_throttled(
+            executor, lambda ticker: probe_atm_iv(ticker, max_days=45, iv_source=iv_source), candidates,
+            lambda ticker, error: None
+        ))
+    survivors = []
+    tier2_by_data = []
+    tier2_by_iv = []
+    for ticker, probe_iv in zip(candidates, probes):
+        if probe_iv is None:
+            tier2_by_data.append(ticker)
+            continue
+        if probe_iv < min_iv * probe_iv_tolerance:
+            logger.info(f"{ticker}: Descartado en el segundo nivel por IV ATM cercana baja: {probe_iv:.2f}% < {min_iv * probe_iv_tolerance:.2f}%")
+            print(f"{ticker}: Descartado en el segundo nivel por IV ATM cercana baja: {probe_iv:.2f}% < {min_iv * probe_iv_tolerance:.2f}%")
+            tier2_by_iv.append(ticker)
+            continue
+        survivors.append((ticker, probe_iv))
+    discarded_by_data += len(tier2_by_data)
+    discarded_by_iv += len(tier2_by_iv)
+    logger.info(f"Nivel 2 (sonda de IV): {len(survivors)} de {len(candidates)} tickers pasan")
+    print(f"Nivel 2 (sonda de IV): {len(survivors)} de {len(candidates)} tickers pasan")
+    if tier2_by_data or tier2_by_iv:
+        logger.info(f"Nivel 2: omitidos sin sonda de IV: {', '.join(tier2_by_data) or '-'}; por IV ATM cercana baja: {', '.join(tier2_by_iv) or '-'}")
+        print(f"Nivel 2: omitidos sin sonda de IV: {', '.join(tier2_by_data) or '-'}; por IV ATM cercana baja: {', '.join(tier2_by_iv) or '-'}")
+
+    # Hist Vol de todo el universo en bloque, reutilizando la descarga del primer nivel
+    try:
+        hist_vols = calculate_historical_volatilities(tickers, hist_vol_period)
+    except Exception as e:
+        logger.info(f"Error calculando Hist Vol en bloque, se calculará por ticker: {e}")
+        print(f"Error calculando Hist Vol en bloque, se calculará por ticker: {e}")
+        hist_vols = None
+
+    # Nivel 3: métricas completas (IV multi-expiración e Hist Vol), de mayor a menor IV de la sonda
+    survivors.sort(key=lambda item: item[1], reverse=True)
+    batch_size = max(1, MAX_WORKERS)
+    not_evaluated = 0
+    for start in range(0, len(survivors), batch_size):
+        batch = survivors[start:start + batch_size]
+        with ThreadPoolExecutor(max_workers=batch_size) as executor:
+            batch_metrics = list(map_requeuing_throttled(
+                executor,
+                lambda ticker: calculate_volatility_metrics(
+                    ticker, max_days=45, hist_vol_period=hist_vol_period, hist_vols=hist_vols, iv_source=iv_source
+                ),
+                [ticker for ticker, _ in batch],
+                lambda ticker, error: None
+            ))
+
+        for (ticker, _), metrics in zip(batch, batch_metrics):
+            if metrics is None:
+                discarded_by_data += 1
+                continue
+
+            # Aplicar filtros iniciales
+            if metrics["implied_volatility"] < min_iv:
+                logger.info(f"{ticker}: Descartado por volatilidad implícita baja: {metrics['implied_volatility']:.2f}% < {min_iv}%")
+                print(f"{ticker}: Descartado por volatilidad implícita baja: {metrics['implied_volatility']:.2f}% < {min_iv}%")
+                discarded_by_iv += 1
+                continue
+            if metrics["volume"] < min_volume:
+                logger.info(f"{ticker}: Descartado por volumen bajo: {metrics['volume']} < {min_volume}")
+                print(f"{ticker}: Descartado por volumen bajo: {metrics['volume']} < {min_volume}")
+                discarded_by_volume += 1
+                continue
+            volatility_data.append(metrics)
+
+        # Terminación anticipada (heurística, solo si el grupo define probe_iv_margin): se da el top N
+        # (IV > Hist Vol, por IV) por estable suponiendo que la IV completa de los restantes no supera su
+        # IV de la sonda multiplicada por probe_iv_margin; si la supone mal, se pierde algún ticker del top
+        remaining = survivors[start + batch_size:]
+        if prefer_iv_over_hist_vol and probe_iv_margin is not None and remaining:
+            iv_greater = sorted(
+                (m["implied_volatility"] for m in volatility_data if m["implied_volatility"] > m["historical_volatility"]),
+                reverse=True
+            )
+            if len(iv_greater) >= top_n and iv_greater[top_n - 1] >= remaining[0][1] * probe_iv_margin:
+                not_evaluated = len(remaining)
+                skipped = ", ".join(ticker for ticker, _ in remaining)
+                logger.info(f"Top {top_n} estimado estable (probe_iv_margin={probe_iv_margin}): se omiten {not_evaluated} tickers restantes: {skipped}")
+                print(f"Top {top_n} estimado estable (probe_iv_margin={probe_iv_margin}): se omiten {not_evaluated} tickers restantes: {skipped}")
+                break
+
+    # Resumen de descartes
+    logger.info(f"Resumen de filtrado: {discarded_by_data} tickers descartados por falta de datos, {discarded_by_iv} por IV baja, {discarded_by_volume} por volumen bajo, {not_evaluated} sin evaluar por terminación anticipada")
+    print(f"Resumen de filtrado: {discarded_by_data} tickers descartados por falta de datos, {discarded_by_iv} por IV baja, {discarded_by_volume} por volumen bajo, {not_evaluated} sin evaluar por terminación anticipada")
+
+    if not volatility_data:
+        logger.warning("No se encontraron tickers que cumplan con los criterios de filtrado")
+        print("No se encontraron tickers que cumplan con los criterios de filtrado")
+    return pd.DataFrame(volatility_data)
+
+def select_dynamic_tickers(screened, dynamic_criteria):
+    """
+    Selecciona el top N de tickers a partir de las métricas de screen_dynamic_universe: primero los que
+    tienen IV > Hist Vol por IV, y después los de menor diferencia absoluta. Sin terminación anticipada, la
+    unión de los top N de cada shard contiene el top N de todo el universo, así que aplicarla a esa unión
+    da la misma selección.
+    """
+    top_n = dynamic_criteria.get("top", 15)
+    prefer_iv_over_hist_vol = dynamic_criteria.get("prefer_iv_over_hist_vol", True)
+
+    # Copia con las columnas de ordenamiento
+    df = screened.copy()
+    df['iv_hist_diff'] = df['implied_volatility'] - df['historical_volatility']
+    df['iv_hist_diff_abs'] = df['iv_hist_diff'].abs()
+
+    # Seleccionar tickers
+    selected_tickers = []
+    # Primero, tickers con IV > Hist Vol, ordenados por IV (descendente)
+    if prefer_iv_over_hist_vol:
+        iv_greater = df[df['iv_hist_diff'] > 0].sort_values(by="implied_volatility", ascending=False)
+        selected_tickers.extend(iv_greater['ticker'].head(top_n).tolist())
+        logger.info(f"Tickers con IV > Hist Vol: {len(iv_greater)}")
+        print(f"Tickers con IV > Hist Vol: {len(iv_greater)}")
+
+    # Si no se alcanzan los top_n tickers, seleccionar los restantes por diferencia absoluta (menor es mejor)
+    if len(selected_tickers) < top_n:
+        remaining_slots = top_n - len(selected_tickers)
+        remaining = df[~df['ticker'].isin(selected_tickers)].sort_values(by="iv_hist_diff_abs", ascending=True)
+        selected_tickers.extend(remaining['ticker'].head(remaining_slots).tolist())
+        logger.info(f"Tickers adicionales seleccionados por diferencia absoluta: {len(remaining)}")
+        print(f"Tickers adicionales seleccionados por diferencia absoluta: {len(remaining)}")
+
+    logger.info(f"Tickers seleccionados para el grupo dinámico: {selected_tickers}")
+    print(f"Tickers seleccionados para el grupo dinámico: {selected_tickers}")
+    return selected_tickers
+
+# Columnas de cada contrato en el orden en que se exportan a todas_las_opciones.csv
+OPTION_COLUMNS = [
+    "ticker", "type", "strike", "expiration", "days_to_expiration", "bid", "last_price",
+    "implied_volatility", "volume", "open_interest", "rentabilidad_diaria", "rentabilidad_anual",
+    "break_even", "percent_diff", "delta", "gamma", "theta", "vega", "prob_otm", "prob_touch",
+    "upside_cap", "quote_time", "source"
+]
+
+# Columnas de conteos: en el lote son float (admiten huecos y todos los bloques tienen el mismo tipo)
+# y en los archivos de resultados se escriben como enteros
+COUNT_COLUMNS = ["volume", "open_interest"]
+
+def with_integer_counts(contracts):
+    """Copia de los contratos con las columnas de COUNT_COLUMNS como enteros con huecos (Int64), para exportarlos."""
+    return contracts.astype({column: "Int64" for column in COUNT_COLUMNS if column in contracts})
+
+def format_count(value):
+    """Conteo de un contrato (volumen, interés abierto) como entero, o nan si falta."""
+    return str(int(value)) if pd.notna(value) else "nan"
+
+def _norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+def _norm_cdf(x):
+    """CDF normal estándar vectorizada (Abramowitz-Stegun 7.1.26, error < 1.5e-7) para no depender de scipy."""
+    z = np.abs(x) / np.sqrt(2)
+    t = 1 / (1 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - poly * np.exp(-z * z)
+    return 0.5 * (1 + np.sign(x) * erf)
+
+def black_scholes_price(spot, strike, years, sigma, rate, is_call=False):
+    """Precio Black-Scholes sin dividendos, con volatilidad y tasa en decimales y plazo en años."""
+    sqrt_t = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * sigma ** 2) * years) / (sigma * sqrt_t)
+    d2 = d1 - sigma * sqrt_t
+    discounted_strike = strike * np.exp(-rate * years)
+    if is_call:
+        return spot * _norm_cdf(d1) - discounted_strike * _norm_cdf(d2)
+    return discounted_strike * _norm_cdf(-d2) - spot * _norm_cdf(-d1)
+
+def solve_implied_volatility(price, spot, strike, days_to_expiration, rate, is_call=False, tol=1e-6, max_iter=60):
+    """
+    Resuelve la volatilidad implícita (%) de una cadena completa a partir de sus precios.
+    Newton-Raphson con salvaguarda de bisección: cada contrato mantiene su intervalo [lo, hi] y,
+    si el paso de Newton sale de él o la vega se anula, se toma el punto medio. Solo se siguen
+    iterando los contratos que aún no han convergido (|precio modelo - precio| <= tol).
+    Los precios fuera de los límites de no arbitraje, o sin plazo válido, quedan en NaN.
+    """
+    price, strike, days = np.broadcast_arrays(
+        np.asarray(price, dtype=float), np.asarray(strike, dtype=float), np.asarray(days_to_expiration, dtype=float)
+    )
+    years = days / 365
+    r = rate / 100
+    iv = np.full(price.shape, np.nan)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        discounted_strike = strike * np.exp(-r * years)
+        if is_call:
+            lower, upper = np.maximum(spot - discounted_strike, 0), np.full(price.shape, float(spot))
+        else:
+            lower, upper = np.maximum(discounted_strike - spot, 0), discounted_strike
+        solvable = np.isfinite(price) & (years > 0) & (strike > 0) & (price > lower) & (price < upper)
+
+        idx = np.flatnonzero(solvable)
+        lo = np.full(price.shape, 1e-4)
+        hi = np.full(price.shape, 5.0)
+        # Aproximación de Brenner-Subrahmanyam como punto de partida
+        sigma = np.clip(np.sqrt(2 * np.pi / years) * price / spot, 1e-3, 4.0)
+
+        for _ in range(max_iter):
+            if idx.size == 0:
+                break
+            s, t, k = sigma[idx], years[idx], strike[idx]
+            diff = black_scholes_price(spot, k, t, s, r, is_call) - price[idx]
+            vega = spot * _norm_pdf((np.log(spot / k) + (r + 0.5 * s ** 2) * t) / (s * np.sqrt(t))) * np.sqrt(t)
+
+            hi[idx] = np.where(diff > 0, s, hi[idx])
+            lo[idx] = np.where(diff <= 0, s, lo[idx])
+            done = (np.abs(diff) <= tol) | (hi[idx] - lo[idx] < 1e-7)
+            iv[idx[done]] = s[done]
+
+            newton = s - diff / vega
+            bisect = ~np.isfinite(newton) | (newton <= lo[idx]) | (newton >= hi[idx])
+            sigma[idx] = np.where(bisect, 0.5 * (lo[idx] + hi[idx]), newton)
+            idx = idx[~done]
+        # Los que agotan las iteraciones se quedan con la mejor estimación del intervalo
+        iv[idx] = sigma[idx]
+    return iv * 100
+
+def chain_quote_prices(chain, iv_source):
+    """Precio de cada contrato para resolver su IV: bid, o mid si hay bid y ask válidos (si no, bid)."""
+    bid = _chain_column(chain, 'bid')
+    if iv_source == "bid":
+        return bid
+    if iv_source != "mid":
+        raise ValueError(f"Fuente de volatilidad no soportada: {iv_source}")
+    ask = _chain_column(chain, 'ask')
+    return ((bid + ask) / 2).where((bid > 0) & (ask > 0), bid)
+
+def solve_chain_implied_volatility(chain, current_price, days_to_expiration, iv_source, is_call=False, ticker=None, rate=None):
+    """
+    Sustituto del campo impliedVolatility de Yahoo (en decimales, 0 si no tiene solución) resuelto
+    para toda la cadena con solve_implied_volatility. El tiempo de cada resolución queda en las
+    métricas de la ejecución (etapa iv_solve).
+    """
+    if rate is None:
+        rate = BASE_CONFIG["TASA_LIBRE_RIESGO"]
+    start = time.perf_counter()
+    with run_metrics.stage("iv_solve", ticker):
+        iv = solve_implied_volatility(
+            chain_quote_prices(chain, iv_source), current_price, chain['strike'], days_to_expiration, rate, is_call
+        )
+    logger.debug(f"{ticker}: IV resuelta ({iv_source}) para {len(chain)} contratos en {(time.perf_counter() - start) * 1000:.1f} ms")
+    return pd.Series(np.nan_to_num(iv / 100, nan=0.0), index=chain.index)
+
+def black_scholes_metrics(spot, strike, days_to_expiration, implied_volatility, rate, is_call=False):
+    """
+    Greeks y probabilidades de opciones europeas con Black-Scholes (sin dividendos), como operaciones
+    NumPy sobre la cadena completa. `implied_volatility` y `rate` en %, `days_to_expiration` en días.
+    Retorna un diccionario de arrays: delta, gamma, theta (por día), vega (por punto de volatilidad),
+    prob_otm (% de expirar OTM) y prob_touch (% de tocar el strike antes del vencimiento,
+    aproximada como el doble de la probabilidad de expirar ITM).
+    Los contratos sin volatilidad o plazo válidos quedan en NaN.
+    """
+    strike = np.asarray(strike, dtype=float)
+    t = np.asarray(days_to_expiration, dtype=float) / 365
+    sigma = np.asarray(implied_volatility, dtype=float) / 100
+    r = rate / 100
+    valid = (sigma > 0) & (t > 0) & (strike > 0)
+    sigma = np.where(valid, sigma, np.nan)
+    t = np.where(valid, t, np.nan)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sqrt_t = np.sqrt(t)
+        sigma_sqrt_t = sigma * sqrt_t
+        d1 = (np.log(spot / strike) + (r + 0.5 * sigma ** 2) * t) / sigma_sqrt_t
+        d2 = d1 - sigma_sqrt_t
+        pdf_d1 = _norm_pdf(d1)
+        if is_call:
+            prob_itm = _norm_cdf(d2)
+            delta = _norm_cdf(d1)
+            carry = -r * strike * np.exp(-r * t) * prob_itm
+            already_itm = strike <= spot
+        else:
+            prob_itm = _norm_cdf(-d2)
+            delta = _norm_cdf(d1) - 1
+            carry = r * strike * np.exp(-r * t) * prob_itm
+            already_itm = strike >= spot
+
+    return {
+        "delta": delta,
+        "gamma": pdf_d1 / (spot * sigma_sqrt_t),
+        "theta": (-spot * pdf_d1 * sigma / (2 * sqrt_t) + carry) / 365,
+        "vega": spot * pdf_d1 * sqrt_t / 100,
+        "prob_otm": (1 - prob_itm) * 100,
+        "prob_touch": np.where(already_itm, 1.0, np.minimum(2 * prob_itm, 1.0)) * 100,
+    }
+
+# Columnas de texto repetidas en cada contrato; en el lote se guardan como categóricas
+CATEGORICAL_OPTION_COLUMNS = ["ticker", "type", "source"]
+
+def make_contract_batch(contracts, ticker, option_type, source):
+    """
+    Convierte los contratos filtrados de un ticker (DataFrame con las columnas numéricas de
+    OPTION_COLUMNS) en un lote columnar: un único DataFrame con columnas numéricas tipadas y
+    ticker/type/source categóricos, que circula por ranking y exportación sin objetos por fila.
+    """
+    codes = np.zeros(len(contracts), dtype=np.int8)
+    batch = contracts.assign(
+        ticker=pd.Categorical.from_codes(codes, categories=[ticker]),
+        type=pd.Categorical.from_codes(codes, categories=[option_type]),
+        source=pd.Categorical.from_codes(codes, categories=[source])
+    )
+    return batch[OPTION_COLUMNS]
+
+def concat_contract_batches(batches):
+    """Une lotes de contratos conservando ticker/type/source como categóricas."""
+    batches = [batch for batch in batches if not batch.empty]
+    if not batches:
+        return empty_contract_batch()
+    if len(batches) == 1:
+        return batches[0]
+    combined = pd.concat(batches, ignore_index=True)
+    # concat de categóricas con categorías distintas devuelve object; se recodifican
+    return combined.astype({column: "category" for column in CATEGORICAL_OPTION_COLUMNS})
+
+def empty_contract_batch():
+    """Lote de contratos vacío con las columnas de OPTION_COLUMNS."""
+    dtypes = {column: "category" for column in CATEGORICAL_OPTION_COLUMNS}
+    dtypes["quote_time"] = "datetime64[ns, UTC]"
+    return pd.DataFrame({column: pd.Series(dtype=dtypes.get(column, "float64")) for column in OPTION_COLUMNS})
+
+def _chain_column(chain, column, default=0):
+    """Devuelve la columna de la cadena o una serie constante si Yahoo no la incluye."""
+    if column in chain:
+        return chain[column]
+    return pd.Series(default, index=chain.index)
+
+def filter_option_contracts(chain, current_price, group_config, is_call=False, keep_columns=()):
+    """
+    Aplica los filtros de contratos en una sola pasada columnar sobre todas las expiraciones, para
+    puts vendidos con garantía en efectivo (is_call=False) o calls cubiertas (is_call=True).
+    `chain` debe incluir las columnas 'expiration' y 'days_to_expiration'.
+    Los filtros se evalúan en el mismo orden que el filtro fila a fila original, seguidos de los
+    filtros opcionales de delta y probabilidad OTM, y cada contrato descartado se cuenta solo en
+    el primer filtro que no supera.
+    En las calls el break-even es strike + prima y la diferencia % se mide hacia arriba, por lo que
+    coincide con la rentabilidad máxima de la call cubierta si se ejerce; upside_cap es el % de
+    subida del subyacente hasta el strike (NaN en los puts).
+    current_price puede ser un escalar o una serie alineada con la cadena (un precio por contrato, como
+    en el backtest sobre varias ejecuciones); keep_columns son columnas de `chain` que se copian al resultado.
+    Las columnas numéricas de la cadena se convierten a float: Yahoo entrega volumen e interés abierto
+    como enteros o decimales según haya huecos, y así todos los lotes tienen los mismos tipos (los
+    conteos se vuelven a escribir como enteros al exportar, ver with_integer_counts).
+    Retorna (DataFrame con las columnas de OPTION_COLUMNS salvo ticker/type/source, descartes por filtro).
+    """
+    strike = chain['strike'].astype(float)
+    bid = _chain_column(chain, 'bid').astype(float)
+    implied_volatility = _chain_column(chain, 'impliedVolatility').astype(float) * 100
+    last_price = _chain_column(chain, 'lastPrice').astype(float)
+    volume = _chain_column(chain, 'volume').astype(float)
+    open_interest = _chain_column(chain, 'openInterest').astype(float)
+    days_to_expiration = chain['days_to_expiration']
+
+    if is_call:
+        break_even = strike + last_price
+        percent_diff = ((break_even - current_price) / current_price) * 100
+        upside_cap = ((strike - current_price) / current_price) * 100
+    else:
+        break_even = strike - last_price
+        percent_diff = ((current_price - break_even) / current_price) * 100
+        upside_cap = pd.Series(np.nan, index=chain.index)
+    rentabilidad_diaria = (last_price * 100) / current_price
+    rentabilidad_anual = rentabilidad_diaria * (365 / days_to_expiration)
+    greeks = black_scholes_metrics(
+        current_price, strike, days_to_expiration, implied_volatility,
+        config_value(group_config, "TASA_LIBRE_RIESGO"), is_call
+    )
+
+    # Igual que en la versión escalar, una comparación con NaN no descarta el contrato
+    checks = [
+        ("bid", bid < group_config["MIN_BID"]),
+        ("volatilidad_implicita", implied_volatility < group_config["MIN_VOLATILIDAD_IMPLICITA"]),
+        ("ultimo_precio", last_price <= 0),
+        ("volumen", volume < group_config["MIN_VOLUMEN"]),
+        ("interes_abierto", open_interest < group_config["MIN_OPEN_INTEREST"]),
+    ]
+    if group_config["FILTRO_TIPO_OPCION"] == "OTM":
+        checks.append(("tipo_opcion", strike <= current_price if is_call else strike >= current_price))
+    elif group_config["FILTRO_TIPO_OPCION"] == "ITM":
+        checks.append(("tipo_opcion", strike > current_price if is_call else strike < current_price))
+    checks.append(("diferencia_porcentual", percent_diff < group_config["MIN_DIFERENCIA_PORCENTUAL"]))
+    checks.append(("rentabilidad_anual", rentabilidad_anual < group_config["MIN_RENTABILIDAD_ANUAL"]))
+    max_delta = config_value(group_config, "MAX_DELTA")
+    if max_delta is not None:
+        checks.append(("delta", pd.Series(np.abs(greeks["delta"]) > max_delta)))
+    min_prob_otm = config_value(group_config, "MIN_PROB_OTM")
+    if min_prob_otm is not None:
+        checks.append(("prob_otm", pd.Series(greeks["prob_otm"] < min_prob_otm)))
+
+    keep = np.ones(len(chain), dtype=bool)
+    rejections = {}
+    for name, rejected in checks:
+        rejected = rejected.to_numpy(dtype=bool)
+        rejections[name] = int(np.count_nonzero(keep & rejected))
+        keep &= ~rejected
+
+    filtered = pd.DataFrame({
+        "strike": strike.to_numpy()[keep],
+        "expiration": chain['expiration'].to_numpy()[keep],
+        "days_to_expiration": days_to_expiration.to_numpy()[keep],
+        "bid": bid.to_numpy()[keep],
+        "last_price": last_price.to_numpy()[keep],
+        "implied_volatility": implied_volatility.to_numpy()[keep],
+        "volume": volume.to_numpy()[keep],
+        "open_interest": open_interest.to_numpy()[keep],
+        "rentabilidad_diaria": rentabilidad_diaria.to_numpy()[keep],
+        "rentabilidad_anual": rentabilidad_anual.to_numpy()[keep],
+        "break_even": break_even.to_numpy()[keep],
+        "percent_diff": percent_diff.to_numpy()[keep],
+        **{name: values[keep] for name, values in greeks.items()},
+        "upside_cap": upside_cap.to_numpy()[keep],
+        "quote_time": pd.to_datetime(_chain_column(chain, 'lastTradeDate', pd.NaT), utc=True, errors="coerce").array[keep],
+        **{column: chain[column].array[keep] for column in keep_columns},
+    })
+    return filtered, rejections
+
+def expirations_in_range(expirations, max_days):
+    """Retorna [(expiración, días al vencimiento)] de las expiraciones entre 1 y max_days días."""
+    selected = []
+    for expiration in expirations:
+        if not expiration:
+            continue
+        expiration_date = datetime.strptime(expiration, '%Y-%m-%d')
+        days_to_expiration = (expiration_date - analysis_now()).days
+        if days_to_expiration <= 0 or days_to_expiration > max_days:
+            logger.debug(f"Expiración {expiration} descartada: {days_to_expiration} días")
+            continue
+        selected.append((expiration, days_to_expiration))
+    return selected
+
+SPREAD_COLUMNS = [
+    "ticker", "strategy", "expiration", "days_to_expiration", "put_short", "put_long", "call_short",
+    "call_long", "credit", "width", "max_loss", "return_on_risk", "break_even", "break_even_high",
+    "percent_diff"
+]
+
+def _strike_pairs(strikes, max_width):
+    """
+    Pares (i, j), i < j, de strikes ordenados con strikes[j] - strikes[i] <= max_width.
+    En lugar de probar todos los pares (cuadrático), searchsorted da para cada strike el final de
+    su ventana y los pares se generan de una vez con repeat: el coste es proporcional al número
+    de pares válidos.
+    """
+    n = len(strikes)
+    window_end = np.searchsorted(strikes, strikes + max_width, side="right")
+    counts = np.maximum(window_end - np.arange(n) - 1, 0)
+    lower = np.repeat(np.arange(n), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return lower, lower + offsets + 1
+
+def _rank_spreads(spreads):
+    """Orden de mejor a peor: mayor retorno sobre riesgo, mayor distancia al break-even y menor ancho."""
+    return np.lexsort((spreads["width"], -spreads["percent_diff"], -spreads["return_on_risk"]))
+
+def _take(spreads, index):
+    return {column: values[index] for column, values in spreads.items()}
+
+def _vertical_spreads(chain, current_price, config, is_call):
+    """
+    Bull put spreads (is_call=False) o bear call spreads (is_call=True) de una expiración, como
+    diccionario de arrays con las columnas de SPREAD_COLUMNS que aplican, ordenados de mejor a peor.
+    El crédito se calcula a precio natural: bid de la pata vendida menos ask de la comprada.
+    """
+    strikes = chain['strike'].to_numpy(dtype=float) if 'strike' in chain else np.array([])
+    order = np.argsort(strikes, kind="stable")
+    order = order[np.isfinite(strikes[order])]
+    strikes = strikes[order]
+    bid = _chain_column(chain, 'bid').fillna(0).to_numpy(dtype=float)[order]
+    ask = _chain_column(chain, 'ask').fillna(0).to_numpy(dtype=float)[order]
+    lower, upper = _strike_pairs(strikes, config_value(config, "SPREAD_MAX_ANCHO"))
+    # Put: se vende el strike alto y se compra el bajo; call: al revés
+    short, long = (lower, upper) if is_call else (upper, lower)
+
+    credit = bid[short] - ask[long]
+    width = strikes[upper] - strikes[lower]
+    max_loss = width - credit
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return_on_risk = credit / max_loss * 100
+    if is_call:
+        break_even = strikes[short] + credit
+        percent_diff = (break_even - current_price) / current_price * 100
+        otm = strikes[short] > current_price
+    else:
+        break_even = strikes[short] - credit
+        percent_diff = (current_price - break_even) / current_price * 100
+        otm = strikes[short] < current_price
+
+    keep = (
+        otm & (ask[long] > 0) & (max_loss > 0) &
+        (credit >= config_value(config, "SPREAD_MIN_CREDITO")) &
+        (return_on_risk >= config_value(config, "SPREAD_MIN_RETORNO_RIESGO")) &
+        (percent_diff >= config_value(config, "SPREAD_MIN_DIFERENCIA_PORCENTUAL"))
+    )
+    side = "call" if is_call else "put"
+    spreads = {
+        f"{side}_short": strikes[short][keep],
+        f"{side}_long": strikes[long][keep],
+        "credit": credit[keep],
+        "width": width[keep],
+        "max_loss": max_loss[keep],
+        "return_on_risk": return_on_risk[keep],
+        "break_even": break_even[keep],
+        "percent_diff": percent_diff[keep],
+    }
+    return _take(spreads, _rank_spreads(spreads))
+
+def _iron_condors(put_spreads, call_spreads, current_price, config, candidates=5):
+    """
+    Combina los mejores bull put y bear call spreads de una expiración en iron condors.
+    Solo se cruzan los `candidates` mejores de cada lado, así que el coste no depende del tamaño
+    de la cadena. La pérdida máxima es la del lado más ancho menos el crédito total.
+    """
+    n_puts = min(candidates, len(put_spreads["credit"]))
+    n_calls = min(candidates, len(call_spreads["credit"]))
+    p, c = (index.ravel() for index in np.meshgrid(np.arange(n_puts), np.arange(n_calls), indexing="ij"))
+    credit = put_spreads["credit"][p] + call_spreads["credit"][c]
+    width = np.maximum(put_spreads["width"][p], call_spreads["width"][c])
+    max_loss = width - credit
+    break_even = put_spreads["put_short"][p] - credit
+    break_even_high = call_spreads["call_short"][c] + credit
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return_on_risk = credit / max_loss * 100
+    percent_diff = np.minimum(
+        (current_price - break_even) / current_price * 100,
+        (break_even_high - current_price) / current_price * 100
+    )
+    keep = (
+        (max_loss > 0) &
+        (return_on_risk >= config_value(config, "SPREAD_MIN_RETORNO_RIESGO")) &
+        (percent_diff >= config_value(config, "SPREAD_MIN_DIFERENCIA_PORCENTUAL"))
+    )
+    condors = {
+        "put_short": put_spreads["put_short"][p][keep],
+        "put_long": put_spreads["put_long"][p][keep],
+        "call_short": call_spreads["call_short"][c][keep],
+        "call_long": call_spreads["call_long"][c][keep],
+        "credit": credit[keep],
+        "width": width[keep],
+        "max_loss": max_loss[keep],
+        "return_on_risk": return_on_risk[keep],
+        "break_even": break_even[keep],
+        "break_even_high": break_even_high[keep],
+        "percent_diff": percent_diff[keep],
+    }
+    return _take(condors, _rank_spreads(condors))
+
+def scan_credit_spreads(ticker, config):
+    """
+    Busca en cada expiración válida los mejores bull put spreads, bear call spreads e iron condors,
+    con las cadenas ya descargadas (caché). Retorna un DataFrame con las columnas de SPREAD_COLUMNS
+    y, por estrategia, los TOP_CONTRATOS mejores del ticker, ordenados de mejor a peor.
+    """
+    info = market_data_cache.info(ticker)
+    current_price = info.get('regularMarketPrice', info.get('previousClose', 0))
+    if current_price <= 0:
+        raise ValueError(f"Precio actual de {ticker} no válido: ${current_price}")
+
+    found = {"bull_put": [], "bear_call": [], "iron_condor": []}
+    for expiration, days_to_expiration in expirations_in_range(market_data_cache.options(ticker), config["MAX_DIAS_VENCIMIENTO"]):
+        opt = market_data_cache.option_chain(ticker, expiration)
+        put_spreads = _vertical_spreads(opt.puts, current_price, config, is_call=False)
+        call_spreads = _vertical_spreads(opt.calls, current_price, config, is_call=True)
+        for strategy, spreads in [
+            ("bull_put", put_spreads),
+            ("bear_call", call_spreads),
+            ("iron_condor", _iron_condors(put_spreads, call_spreads, current_price, config)),
+        ]:
+            n = len(spreads["credit"])
+            if n:
+                found[strategy].append({
+                    **spreads,
+                    "strategy": np.full(n, strategy, dtype=object),
+                    "expiration": np.full(n, expiration, dtype=object),
+                    "days_to_expiration": np.full(n, days_to_expiration),
+                })
+
+    # Los TOP_CONTRATOS mejores de cada estrategia entre todas las expiraciones
+    selected = []
+    for strategy, batches in found.items():
+        if not batches:
+            continue
+        n_rows = [len(batch["credit"]) for batch in batches]
+        spreads = {
+            column: np.concatenate([batch.get(column, np.full(n, np.nan)) for batch, n in zip(batches, n_rows)])
+            for column in SPREAD_COLUMNS if column != "ticker"
+        }
+        selected.append(_take(spreads, _rank_spreads(spreads)[:config["TOP_CONTRATOS"]]))
+    if not selected:
+        return pd.DataFrame(columns=SPREAD_COLUMNS)
+
+    spreads = {column: np.concatenate([batch[column] for batch in selected]) for column in selected[0]}
+    spreads = pd.DataFrame(_take(spreads, _rank_spreads(spreads)))
+    spreads.insert(0, "ticker", ticker)
+    logger.info(f"{ticker}: {len(spreads)} spreads de crédito seleccionados")
+    return spreads[SPREAD_COLUMNS]
+
+def _scan_sides(group_config):
+    """Lados activos del grupo como [(tipo, is_call)]."""
+    return [
+        (option_type, is_call) for option_type, is_call, key in [("put", False, "ESCANEAR_PUTS"), ("call", True, "ESCANEAR_CALLS")]
+        if config_value(group_config, key)
+    ]
+
+def filter_chains(ticker, chains_by_expiration, current_price, group_config, source):
+    """
+    Filtra las cadenas de una fuente ({expiración: OptionChain}) para los lados activos del grupo.
+    Puts y calls llegan en la misma respuesta, así que se reúnen los de todas las expiraciones
+    válidas para filtrarlos de una vez. Retorna el lote de contratos que superan los filtros.
+    """
+    sides = _scan_sides(group_config)
+    chains = {option_type: [] for option_type, _ in sides}
+    for expiration, days_to_expiration in expirations_in_range(list(chains_by_expiration), group_config["MAX_DIAS_VENCIMIENTO"]):
+        opt = chains_by_expiration[expiration]
+        for option_type, _ in sides:
+            chain = opt.calls if option_type == "call" else opt.puts
+            if chain.empty:
+                continue
+            chains[option_type].append(chain.assign(expiration=expiration, days_to_expiration=days_to_expiration))
+
+    batches = []
+    iv_source = config_value(group_config, "FUENTE_VOLATILIDAD")
+    for option_type, is_call in sides:
+        if not chains[option_type]:
+            continue
+        contracts = pd.concat(chains[option_type], ignore_index=True)
+        if iv_source != "yahoo":
+            # La IV resuelta reemplaza a la de la fuente en los filtros, las métricas y los reportes
+            contracts["impliedVolatility"] = solve_chain_implied_volatility(
+                contracts, current_price, contracts["days_to_expiration"], iv_source, is_call,
+                ticker=ticker, rate=config_value(group_config, "TASA_LIBRE_RIESGO")
+            )
+        with run_metrics.stage("filtering", ticker):
+            filtered, rejections = filter_option_contracts(contracts, current_price, group_config, is_call)
+        run_metrics.record_contracts(ticker, len(contracts), len(filtered))
+        batches.append(make_contract_batch(filtered, ticker, option_type, source))
+
+        rejection_summary = ", ".join(f"{name}: {count}" for name, count in rejections.items() if count)
+        side_label = "" if option_type == "put" else " (calls)"
+        source_label = "" if source == "Yahoo" else f" en {source}"
+        logger.info(f"{ticker}: {len(contracts)} contratos evaluados{side_label}{source_label}, descartes por filtro: {rejection_summary or 'ninguno'}")
+    return concat_contract_batches(batches)
+
+class _ExpirationChains:
+    """Vista {expiración: OptionChain} de las cadenas de Yahoo que descarga solo las expiraciones consultadas."""
+
+    def __init__(self, ticker, expirations):
+        self.ticker = ticker
+        self.expirations = expirations
+
+    def __iter__(self):
+        return iter(self.expirations)
+
+    def __getitem__(self, expiration):
+        return market_data_cache.option_chain(self.ticker, expiration)
+
+def get_option_data_yahoo(ticker, group_config):
+    try:
+        expirations = market_data_cache.options(ticker)
+        info = market_data_cache.info(ticker)
+        current_price = info.get('regularMarketPrice', info.get('previousClose', 0))
+        if current_price <= 0:
+            raise ValueError(f"Precio actual de {ticker} no válido: ${current_price}")
+        logger.info(f"Precio actual de {ticker}: ${current_price:.2f}")
+        print(f"Precio actual de {ticker}: ${current_price:.2f}")
+
+        options_data = filter_chains(ticker, _ExpirationChains(ticker, expirations), current_price, group_config, "Yahoo")
+        logger.info(f"Se encontraron {len(options_data)} opciones para {ticker} después de aplicar filtros")
+        print(f"Se encontraron {len(options_data)} opciones para {ticker} después de aplicar filtros")
+        return options_data
+    except RequestThrottledError:
+        # Un ticker limitado por Yahoo no es un ticker sin opciones: se reintenta más tarde
+        raise
+    except Exception as e:
+        logger.error(f"Error obteniendo datos de Yahoo para {ticker}: {e}")
+        print(f"Error obteniendo datos de Yahoo para {ticker}: {e}")
+        return empty_contract_batch()
+
+def get_option_data_finnhub(ticker, group_config):
+    """
+    Contratos de Finnhub con los mismos filtros que los de Yahoo. Se desactiva sin FINNHUB_API_KEY
+    y en modo replay (las grabaciones solo contienen Yahoo).
+    """
+    if finnhub_client is None or market_data_cache.provider.name == "replay":
+        return empty_contract_batch()
+    try:
+        chains = finnhub_client.option_chains(ticker)
+        info = market_data_cache.info(ticker)
+        current_price = info.get('regularMarketPrice', info.get('previousClose', 0))
+        if current_price <= 0:
+            raise ValueError(f"Precio actual de {ticker} no válido: ${current_price}")
+        return filter_chains(ticker, chains, current_price, group_config, "Finnhub")
+    except RequestThrottledError:
+        raise
+    except Exception as e:
+        logger.error(f"Error obteniendo datos de Finnhub para {ticker}: {e}")
+        print(f"Error obteniendo datos de Finnhub para {ticker}: {e}")
+        return empty_contract_batch()
+
+# Prioridad de las fuentes al reconciliar un mismo contrato cotizado a la vez (la primera gana)
+SOURCE_PRIORITY = ["Yahoo", "Finnhub"]
+CONTRACT_KEY_COLUMNS = ["ticker", "expiration", "strike", "type"]
+
+def combine_options_data(yahoo_data, finnhub_data):
+    """
+    Une los lotes de las fuentes sin duplicar contratos. La clave (ticker, expiration, strike, type)
+    se indexa por su hash de 64 bits y, para cada clave, se conserva la de la fuente con más prioridad
+    en SOURCE_PRIORITY; dentro de la misma fuente, la cotización más reciente (quote_time).
+    """
+    combined = concat_contract_batches([yahoo_data, finnhub_data])
+    if combined.empty or combined["source"].nunique() < 2:
+        return combined
+    keys = pd.util.hash_pandas_object(combined[CONTRACT_KEY_COLUMNS].astype(str), index=False).to_numpy()
+    priority = combined["source"].astype(str).map({source: i for i, source in enumerate(SOURCE_PRIORITY)})
+    priority = priority.fillna(len(SOURCE_PRIORITY)).to_numpy()
+    quote_time = combined["quote_time"]
+    freshness = np.where(quote_time.isna(), -np.inf, quote_time.astype("int64").astype(float))
+
+    # Orden por clave, luego prioridad y luego más reciente: la primera fila de cada clave es la elegida
+    order = np.lexsort((-freshness, priority, keys))
+    sorted_keys = keys[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    selected = np.sort(order[first])
+    duplicates = len(combined) - len(selected)
+    if duplicates:
+        logger.info(f"{combined['ticker'].iloc[0]}: {duplicates} contratos duplicados entre fuentes reconciliados")
+    return combined.iloc[selected].reset_index(drop=True)
+
+def analyze_ticker(ticker, group_config):
+    logger.info(f"Analizando {ticker}...")
+    print(f"\n{'='*50}\nAnalizando ticker: {ticker}\n{'='*50}\n")
+    yahoo_data = get_option_data_yahoo(ticker, group_config)
+    finnhub_data = get_option_data_finnhub(ticker, group_config)
+    combined = combine_options_data(yahoo_data, finnhub_data)
+    logger.info(f"{len(yahoo_data)} opciones de Yahoo para {ticker}")
+    logger.info(f"{len(finnhub_data)} opciones de Finnhub para {ticker}")
+    logger.info(f"Combinadas {len(combined)} opciones para {ticker}")
+    print(f"{len(yahoo_data)} opciones de Yahoo para {ticker}")
+    print(f"{len(finnhub_data)} opciones de Finnhub para {ticker}")
+    print(f"Combinadas {len(combined)} opciones para {ticker}")
+    return combined
+
+# Límites de los mensajes de webhook de Discord
+DISCORD_MAX_EMBEDS = 10
+DISCORD_MAX_EMBED_DESCRIPTION = 4096
+DISCORD_MAX_MESSAGE_EMBED_CHARS = 6000
+DISCORD_MAX_CONTENT = 2000
+
+class DiscordWebhook:
+    """
+    Cliente de un webhook de Discord. Todos los webhooks comparten una sesión de requests con pool de
+    conexiones. Ante un 429 espera el Retry-After (cabecera o campo retry_after del JSON) y reintenta;
+    los 5xx y errores de conexión se reintentan con backoff exponencial con jitter. Si la cabecera
+    X-RateLimit-Remaining llega a 0, el siguiente envío espera X-RateLimit-Reset-After.
+    """
+    _session = None
+    _session_lock = threading.Lock()
+
+    def __init__(self, url, max_retries=3, backoff_seconds=1.0, timeout=15):
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self._resume_at = 0.0
+
+    @classmethod
+    def session(cls):
+        with cls._session_lock:
+            if cls._session is None:
+                cls._session = requests.Session()
+            return cls._session
+
+    def _retry_delay(self, response, attempt):
+        if response is not None and response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            try:
+                retry_after = retry_after or response.json().get("retry_after")
+                return max(0.0, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+        return self.backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    def post(self, json_payload=None, data=None, files=None, nbytes=0):
+        """POST al webhook con reintentos; retorna la respuesta final (lanza si no fue correcta)."""
+        start = time.perf_counter()
+        retries = 0
+        while True:
+            pause = self._resume_at - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            error = None
+            try:
+                response = self.session().post(self.url, json=json_payload, data=data, files=files, timeout=self.timeout)
+                retryable = response.status_code == 429 or response.status_code >= 500
+                if response.headers.get("X-RateLimit-Remaining") == "0":
+                    reset_after = float(response.headers.get("X-RateLimit-Reset-After", 0) or 0)
+                    self._resume_at = time.monotonic() + reset_after
+            except requests.RequestException as e:
+                response, retryable, error = None, True, e
+            except Exception:
+                run_metrics.record_request(
+                    "discord", "webhook", nbytes=nbytes, retries=retries, error=True, seconds=time.perf_counter() - start
+                )
+                raise
+            if not retryable or retries >= self.max_retries:
+                break
+            retries += 1
+            delay = self._retry_delay(response, retries)
+            status = response.status_code if response is not None else error
+            logger.info(f"Discord: reintento {retries}/{self.max_retries} en {delay:.1f}s ({status})")
+            time.sleep(delay)
+
+        run_metrics.record_request(
+            "discord", "webhook", nbytes=nbytes, retries=retries,
+            error=response is None or not response.ok, seconds=time.perf_counter() - start
+        )
+        if response is None:
+            raise error
+        response.raise_for_status()
+        return response
+
+def is_valid_webhook(webhook_url):
+    return bool(webhook_url) and webhook_url != "URL_POR_DEFECTO"
+
+def discord_alert_header(group_config, group_description):
+    """Encabezado de los mensajes de Discord con las reglas de alerta del grupo."""
+    header = (
+        f"**Análisis de Opciones - {group_description}**\n"
+        f"Reglas de Alerta:\n"
+        f"- Rentabilidad Anual Mínima: {group_config['ALERTA_RENTABILIDAD_ANUAL']}%\n"
+        f"- Volatilidad Implícita Mínima: {group_config['ALERTA_VOLATILIDAD_MINIMA']}%\n"
+    )
+    if config_value(group_config, "ALERTA_MAX_DELTA") is not None:
+        header += f"- Delta Máxima: {config_value(group_config, 'ALERTA_MAX_DELTA')}\n"
+    if config_value(group_config, "ALERTA_MIN_PROB_OTM") is not None:
+        header += f"- Probabilidad OTM Mínima: {config_value(group_config, 'ALERTA_MIN_PROB_OTM')}%\n"
+    header += f"{'-'*50}\n"
+    return header
+
+class SeenContractsIndex:
+    """
+    Índice persistente (JSON) de los contratos ya alertados por Discord, por grupo y contrato, para no
+    repetir la misma alerta en ejecuciones sucesivas. Una entrada se olvida al vencer el contrato o al
+    superar `ttl_hours` desde su envío, de modo que un contrato que sigue cumpliendo vuelve a alertarse.
+    """
+
+    def __init__(self, path, ttl_hours=24):
+        self.path = path
+        self.ttl_hours = ttl_hours
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._seen = json.load(f)
+        except FileNotFoundError:
+            self._seen = {}
+        except ValueError as e:
+            logger.warning(f"Índice de alertas enviadas no válido, se parte de cero: {e}")
+            print(f"Índice de alertas enviadas no válido, se parte de cero: {e}")
+            self._seen = {}
+        self._prune()
+
+    def _prune(self):
+        now = analysis_now()
+        cutoff = (now - timedelta(hours=self.ttl_hours)).isoformat(timespec="seconds")
+        today = now.strftime('%Y-%m-%d')
+        self._seen = {
+            key: entry for key, entry in self._seen.items()
+            if entry["sent_at"] >= cutoff and entry["expiration"] >= today
+        }
+
+    def unseen(self, keys):
+        with self._lock:
+            return [key for key in keys if key not in self._seen]
+
+    def mark(self, entries):
+        """Registra como enviados {clave: expiración}."""
+        sent_at = analysis_now().isoformat(timespec="seconds")
+        with self._lock:
+            for key, expiration in entries.items():
+                self._seen[key] = {"sent_at": sent_at, "expiration": expiration}
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._seen, f)
+            os.replace(tmp_path, self.path)
+
+def create_seen_contracts_index():
+    """Índice de alertas enviadas en DISCORD_SEEN_INDEX (por defecto .estado/discord_vistos.json)."""
+    return SeenContractsIndex(
+        os.getenv("DISCORD_SEEN_INDEX", os.path.join(".estado", "discord_vistos.json")),
+        ttl_hours=float(os.getenv("DISCORD_DEDUP_HOURS", 24))
+    )
+
+def contract_alert_embed(ticker, contracts):
+    """Embed de Discord con los contratos de alerta de un ticker (una línea por contrato)."""
+    lines = []
+    for _, row in contracts.iterrows():
+        side = "Put" if row["type"] == "put" else "Call cubierta"
+        lines.append(
+            f"**{side} ${row['strike']:.2f}** vence {row['expiration']} ({row['days_to_expiration']} días) · "
+            f"Bid ${row['bid']:.2f} · Rent. Anual {row['rentabilidad_anual']:.2f}% · "
+            f"IV {row['implied_volatility']:.2f}% · Delta {row['delta']:.3f} · Prob. OTM {row['prob_otm']:.2f}%"
+        )
+    description = "\n".join(lines)
+    if len(description) > DISCORD_MAX_EMBED_DESCRIPTION:
+        description = description[:DISCORD_MAX_EMBED_DESCRIPTION - 1] + "…"
+    return {"title": f"{ticker}: {len(contracts)} contratos de alerta", "description": description}
+
+def _embed_size(embed):
+    return len(embed.get("title", "")) + len(embed.get("description", ""))
+
+class DiscordNotifier:
+    """
+    Envía las alertas a Discord a medida que cada ticker las produce, en un hilo propio para no frenar
+    el análisis. Agrupa los embeds en mensajes que respetan los límites de Discord (10 embeds y 6000
+    caracteres por mensaje) y espera hasta `linger_seconds` a completar un mensaje antes de enviarlo.
+    Con un SeenContractsIndex solo se alertan los contratos no enviados antes; los contratos se marcan
+    como enviados cuando Discord confirma el mensaje.
+    """
+
+    def __init__(self, webhook, header="", seen_index=None, group_key="", linger_seconds=2.0):
+        self.webhook = webhook
+        self.header = header[:DISCORD_MAX_CONTENT]
+        self.seen_index = seen_index
+        self.group_key = group_key
+        self.linger_seconds = linger_seconds
+        self.sent_tickers = []
+        self.sent_contracts = 0
+        self.suppressed_contracts = 0
+        self.failed_messages = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="discord-notifier", daemon=True)
+        self._thread.start()
+
+    def notify(self, ticker, best_contracts):
+        """Encola las alertas de un ticker, descartando las ya enviadas en ejecuciones anteriores."""
+        if best_contracts is None or best_contracts.empty:
+            return
+        keys = [
+            f"{self.group_key}|{contract_key(ticker, expiration, strike, option_type)}"
+            for expiration, strike, option_type in zip(best_contracts["expiration"], best_contracts["strike"], best_contracts["type"])
+        ]
+        new_keys = set(self.seen_index.unseen(keys)) if self.seen_index is not None else set(keys)
+        self.suppressed_contracts += len(keys) - len(new_keys)
+        if not new_keys:
+            return
+        contracts = best_contracts[[key in new_keys for key in keys]]
+        entries = {key: expiration for key, expiration in zip(keys, best_contracts["expiration"]) if key in new_keys}
+        self._queue.put((ticker, contract_alert_embed(ticker, contracts), entries))
+
+    def _run(self):
+        batch, batch_chars, deadline = [], 0, None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            if item is False or item is None:
+                # Venció la espera o se cerró el notificador: enviar lo acumulado
+                if batch:
+                    self._send(batch)
+                batch, batch_chars, deadline = [], 0, None
+                if item is None:
+                    return
+                continue
+            size = _embed_size(item[1])
+            if batch and (len(batch) >= DISCORD_MAX_EMBEDS or batch_chars + size > DISCORD_MAX_MESSAGE_EMBED_CHARS):
+                self._send(batch)
+                batch, batch_chars = [], 0
+            batch.append(item)
+            batch_chars += size
+            if deadline is None or len(batch) == 1:
+                deadline = time.monotonic() + self.linger_seconds
+
+    def _send(self, batch):
+        payload = {"embeds": [embed for _, embed, _ in batch]}
+        if self.header and not self.sent_tickers:
+            payload["content"] = self.header
+        try:
+            self.webhook.post(json_payload=payload, nbytes=len(json.dumps(payload).encode()))
+        except Exception as e:
+            self.failed_messages += 1
+            logger.error(f"Error enviando alertas a Discord: {e}")
+            print(f"Error enviando alertas a Discord: {e}")
+            return
+        for ticker, _, entries in batch:
+            self.sent_tickers.append(ticker)
+            self.sent_contracts += len(entries)
+            if self.seen_index is not None:
+                self.seen_index.mark(entries)
+        logger.info(f"Alertas enviadas a Discord: {', '.join(ticker for ticker, _, _ in batch)}")
+        print(f"Alertas enviadas a Discord: {', '.join(ticker for ticker, _, _ in batch)}")
+
+    def close(self):
+        """Envía lo pendiente, espera al hilo y guarda el índice de alertas enviadas."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.seen_index is not None:
+            self.seen_index.save()
+
+def send_discord_notification(tickers_identificados, webhook_url, group_config, group_description, report_path="Mejores_Contratos.txt",
+                              summary="Se encontraron contratos que cumplen los filtros de alerta para los siguientes tickers"):
+    """
+    Envía el reporte a Discord con un mensaje de cabecera y el archivo adjunto.
+    Retorna True si se envió, False si el envío falló y None si el webhook no es válido.
+    """
+    if not is_valid_webhook(webhook_url):
+        logger.error(f"Error: Webhook inválido: {webhook_url}")
+        print(f"Error: Webhook inválido: {webhook_url}")
+        return None
+    try:
+        ticker_list = ", ".join(tickers_identificados) if tickers_identificados else "Ninguno"
+        message = (
+            f"{discord_alert_header(group_config, group_description)}"
+            f"{summary}: {ticker_list}"
+        )
+        with open(report_path, "rb") as f:
+            # Leído en memoria para poder reenviarlo si Discord pide reintentar
+            content = f.read()
+        DiscordWebhook(webhook_url).post(
+            data={"content": message},
+            files={"file": (os.path.basename(report_path), content, "text/plain")},
+            nbytes=len(message.encode()) + len(content)
+        )
+        logger.info("Notificación enviada a Discord")
+        print("Notificación enviada a Discord")
+        return True
+    except Exception as e:
+        logger.error(f"Error enviando notificación a Discord: {e}")
+        print(f"Error enviando notificación a Discord: {e}")
+        return False
+
+def rank_contracts(df_ticker, config, group_by=("type",)):
+    """
+    Ordena los contratos de un ticker y selecciona los que se muestran en el reporte y los que
+    cumplen las reglas de alerta. Retorna (filtered_contracts, best_contracts).
+    group_by son las columnas dentro de las que se toman los TOP_CONTRATOS (el backtest añade
+    la ejecución y el ticker para seleccionar de una vez sobre todo el archivo).
+    """
+    group_by = list(group_by)
+    # Ordenar todas las opciones filtradas por rentabilidad anual (descendente), días al vencimiento (ascendente), diferencia porcentual (descendente)
+    df_ticker = df_ticker.sort_values(
+        by=["rentabilidad_anual", "days_to_expiration", "percent_diff"],
+        ascending=[False, True, False]
+    )
+
+    # Guardar todas las opciones que cumplen los filtros iniciales (para mostrarlas), por lado
+    by_type = df_ticker.groupby(group_by, observed=True, sort=False)
+    filtered_contracts = by_type.head(config["TOP_CONTRATOS"])
+
+    # Filtrar por reglas de alerta (solo para notificación a Discord)
+    alert = (
+        (df_ticker["rentabilidad_anual"] >= config["ALERTA_RENTABILIDAD_ANUAL"]) &
+        (df_ticker["implied_volatility"] >= config["ALERTA_VOLATILIDAD_MINIMA"])
+    )
+    if config_value(config, "ALERTA_MAX_DELTA") is not None:
+        alert &= df_ticker["delta"].abs() <= config_value(config, "ALERTA_MAX_DELTA")
+    if config_value(config, "ALERTA_MIN_PROB_OTM") is not None:
+        alert &= df_ticker["prob_otm"] >= config_value(config, "ALERTA_MIN_PROB_OTM")
+    best_contracts = df_ticker[alert].groupby(group_by, observed=True, sort=False).head(config["TOP_CONTRATOS"])
+    return filtered_contracts, best_contracts
+
+def render_ticker_report(ticker, options, filtered_contracts, config):
+    """Construye (y muestra por consola) la sección de resultados.txt de un ticker con opciones."""
+    info = market_data_cache.info(ticker)
+    current_price = info.get('regularMarketPrice', info.get('previousClose', 0))
+    min_52_week = info.get('fiftyTwoWeekLow', 0)
+    max_52_week = info.get('fiftyTwoWeekHigh', 0)
+
+    # Contar por fuente sobre las opciones ya combinadas en lugar de repetir la descarga
+    yahoo_count = int((options["source"] == "Yahoo").sum())
+    finnhub_count = int((options["source"] == "Finnhub").sum())
+
+    ticker_message = f"==================================================\n"
+    ticker_message += f"Analizando ticker: {ticker}\n"
+    ticker_message += f"==================================================\n\n"
+    ticker_message += f"Precio del subyacente ({ticker}): ${current_price:.2f}\n"
+    ticker_message += f"Mínimo de las últimas 52 semanas: ${min_52_week:.2f}\n"
+    ticker_message += f"Máximo de las últimas 52 semanas: ${max_52_week:.2f}\n"
+    ticker_message += f"{yahoo_count} opciones de Yahoo para {ticker}\n"
+    ticker_message += f"{finnhub_count} opciones de Finnhub para {ticker}\n"
+    ticker_message += f"Combinadas {len(options)} opciones para {ticker}\n"
+    sources_text = "Yahoo Finance, Finnhub" if finnhub_count else "Yahoo Finance"
+    ticker_message += f"Fuentes: {sources_text}\n"
+    ticker_message += f"Errores: Ninguno\n"
+
+    print(f"Precio del subyacente ({ticker}): ${current_price:.2f}")
+    print(f"Mínimo de las últimas 52 semanas: ${min_52_week:.2f}")
+    print(f"Máximo de las últimas 52 semanas: ${max_52_week:.2f}")
+    print(f"{yahoo_count} opciones de Yahoo para {ticker}")
+    print(f"{finnhub_count} opciones de Finnhub para {ticker}")
+    print(f"Combinadas {len(options)} opciones para {ticker}")
+    print(f"Fuentes: {sources_text}")
+    print(f"Errores: Ninguno")
+
+    if not filtered_contracts.empty:
+        tipo_opcion_texto = "Out of the Money" if config["FILTRO_TIPO_OPCION"] == "OTM" else "In the Money"
+        for option_type in ["put", "call"]:
+            contracts = filtered_contracts[filtered_contracts["type"] == option_type]
+            if contracts.empty:
+                continue
+            title = "PUT" if option_type == "put" else "CALL (cubiertas)"
+            header = f"\nOpciones {title} {tipo_opcion_texto} con rentabilidad anual > {config['MIN_RENTABILIDAD_ANUAL']}% y diferencia % > {config['MIN_DIFERENCIA_PORCENTUAL']}% (máximo {config['MAX_DIAS_VENCIMIENTO']} días, volumen > {config['MIN_VOLUMEN']}, volatilidad >= {config['MIN_VOLATILIDAD_IMPLICITA']}%, interés abierto > {config['MIN_OPEN_INTEREST']}, bid >= ${config['MIN_BID']}):"
+            ticker_message += header + "\n"
+            print(header)
+
+            columns = [
+                "strike", "last_price", "bid", "expiration", "days_to_expiration",
+                "rentabilidad_diaria", "rentabilidad_anual", "break_even", "percent_diff",
+                "implied_volatility", "delta", "prob_otm", "prob_touch", "volume", "open_interest", "source"
+            ]
+            headers = [
+                "Strike", "Last Closed", "Bid", "Vencimiento", "Días Venc.",
+                "Rent. Diaria", "Rent. Anual", "Break-even", "Dif. % (Suby.-Break.)",
+                "Volatilidad Implícita", "Delta", "Prob. OTM", "Prob. Toque", "Volumen", "Interés Abierto", "Fuente"
+            ]
+            if option_type == "call":
+                columns[9:9] = ["upside_cap"]
+                headers[8:10] = ["Rent. si se Ejerce %", "Tope Subida %", "Volatilidad Implícita"]
+            table_data = contracts[columns].copy()
+            table_data.columns = headers
+            table = tabulate(table_data, headers="keys", tablefmt="grid", showindex=False)
+            ticker_message += f"\n{table}\n"
+            print(table)
+    else:
+        ticker_message += f"No se encontraron contratos que cumplan los criterios para {ticker}.\n"
+        print(f"No se encontraron contratos que cumplan los criterios para {ticker}.")
+
+    return ticker_message + "\n"
+
+SPREAD_STRATEGY_NAMES = {"bull_put": "Bull Put", "bear_call": "Bear Call", "iron_condor": "Iron Condor"}
+
+def render_spreads_report(ticker, spreads, config):
+    """Construye (y muestra por consola) la sección de spreads de crédito de un ticker."""
+    header = (
+        f"\nSpreads de crédito (ancho máximo ${config_value(config, 'SPREAD_MAX_ANCHO')}, "
+        f"crédito >= ${config_value(config, 'SPREAD_MIN_CREDITO')}, "
+        f"retorno/riesgo >= {config_value(config, 'SPREAD_MIN_RETORNO_RIESGO')}%, "
+        f"diferencia % >= {config_value(config, 'SPREAD_MIN_DIFERENCIA_PORCENTUAL')}%):"
+    )
+    print(header)
+    if spreads.empty:
+        print(f"No se encontraron spreads de crédito para {ticker}.")
+        return f"{header}\nNo se encontraron spreads de crédito para {ticker}.\n\n"
+
+    table_data = spreads[[
+        "strategy", "expiration", "days_to_expiration", "put_long", "put_short", "call_short", "call_long",
+        "credit", "width", "max_loss", "return_on_risk", "break_even", "break_even_high", "percent_diff"
+    ]].copy()
+    table_data["strategy"] = table_data["strategy"].map(SPREAD_STRATEGY_NAMES)
+    # Las patas que no usa la estrategia se muestran como "-"
+    table_data = table_data.astype(object).where(table_data.notna(), None)
+    table_data.columns = [
+        "Estrategia", "Vencimiento", "Días Venc.", "Put Comprada", "Put Vendida", "Call Vendida", "Call Comprada",
+        "Crédito", "Ancho", "Pérdida Máx.", "Retorno/Riesgo %", "Break-even", "Break-even Sup.", "Dif. %"
+    ]
+    table = tabulate(table_data, headers="keys", tablefmt="grid", showindex=False, missingval="-")
+    print(table)
+    return f"{header}\n{table}\n\n"
+
+def contract_key(ticker, expiration, strike, option_type):
+    """Clave de un contrato en el estado incremental."""
+    return f"{ticker}|{expiration}|{float(strike):.2f}|{option_type}"
+
+def contract_state(contracts):
+    """Estado de un lote de contratos para el modo incremental: {clave: valores que se comparan o reportan}."""
+    if contracts is None or contracts.empty:
+        return {}
+    columns = ["ticker", "expiration", "strike", "type", "bid", "rentabilidad_anual", "implied_volatility", "days_to_expiration"]
+    state = {}
+    for ticker, expiration, strike, option_type, bid, annual, iv, days in zip(*(contracts[column].tolist() for column in columns)):
+        state[contract_key(ticker, expiration, strike, option_type)] = {
+            "expiration": expiration, "strike": float(strike), "type": option_type, "bid": float(bid),
+            "rentabilidad_anual": float(annual), "implied_volatility": float(iv), "days_to_expiration": int(days)
+        }
+    return state
+
+def diff_contract_states(previous, current, config):
+    """
+    Compara dos estados de contratos. Un contrato presente en ambos está modificado si su bid varía al menos
+    INCREMENTAL_CAMBIO_BID % o su rentabilidad anual al menos INCREMENTAL_CAMBIO_RENTABILIDAD puntos.
+    Retorna {"added": [claves], "changed": [claves], "removed": [claves]}.
+    """
+    bid_threshold = config_value(config, "INCREMENTAL_CAMBIO_BID")
+    annual_threshold = config_value(config, "INCREMENTAL_CAMBIO_RENTABILIDAD")
+    changed = []
+    for key in current.keys() & previous.keys():
+        old, new = previous[key], current[key]
+        bid_change = abs(new["bid"] - old["bid"]) / old["bid"] * 100 if old["bid"] else float("inf")
+        if bid_change >= bid_threshold or abs(new["rentabilidad_anual"] - old["rentabilidad_anual"]) >= annual_threshold:
+            changed.append(key)
+    return {
+        "added": [key for key in current if key not in previous],
+        "changed": sorted(changed, key=list(current).index),
+        "removed": [key for key in previous if key not in current],
+    }
+
+def build_ticker_report(ticker, config, previous=None):
+    """
+    Analiza un ticker y construye su sección del reporte.
+    Retorna un diccionario con el mensaje, las opciones encontradas y los contratos filtrados y de alerta.
+    En modo incremental, `previous` es el estado del ticker en la ejecución anterior: se añaden al
+    resultado el estado nuevo ("state") y los cambios en los contratos de alerta ("changes"), y si los
+    contratos mostrados no cambian de forma relevante se reutiliza la sección ya renderizada.
+    """
+    result = {
+        "ticker": ticker,
+        "message": "",
+        "options": empty_contract_batch(),
+        "filtered_contracts": None,
+        "best_contracts": None,
+        "spreads": None,
+        "error": None,
+        "state": None,
+        "changes": None,
+        "report_reused": False
+    }
+    incremental = config_value(config, "MODO_INCREMENTAL")
+    previous = previous or {}
+    unchanged = False
+    try:
+        options = analyze_ticker(ticker, config)
+        filtered_contracts = best_contracts = None
+        if options.empty:
+            logger.info(f"No se encontraron opciones para {ticker}")
+            print(f"No se encontraron opciones para {ticker}")
+            result["message"] += f"==================================================\n"
+            result["message"] += f"Analizando ticker: {ticker}\n"
+            result["message"] += f"==================================================\n\n"
+            result["message"] += f"No se encontraron opciones para {ticker}.\n\n"
+        else:
+            result["options"] = options
+
+            with run_metrics.stage("sorting", ticker):
+                filtered_contracts, best_contracts = rank_contracts(options, config)
+            result["filtered_contracts"] = filtered_contracts
+            result["best_contracts"] = best_contracts
+
+        if incremental:
+            shown = contract_state(filtered_contracts)
+            alert = contract_state(best_contracts)
+            previous_alert = previous.get("alert", {})
+            result["changes"] = diff_contract_states(previous_alert, alert, config)
+            # Los contratos sin cambios relevantes conservan los valores de referencia de la última alerta,
+            # para que una deriva lenta acabe superando los umbrales
+            for key in alert.keys() & previous_alert.keys():
+                if key not in result["changes"]["changed"]:
+                    alert[key] = previous_alert[key]
+            result["state"] = {
+                "shown": shown,
+                "alert": alert,
+                "message": result["message"],
+                "rendered_at": analysis_now().isoformat(timespec="minutes")
+            }
+            unchanged = shown and previous.get("message") and not any(diff_contract_states(previous.get("shown", {}), shown, config).values())
+            if unchanged:
+                # Mismos contratos y sin cambios relevantes: se conserva la sección (y el estado de referencia) anterior
+                logger.info(f"{ticker}: sin cambios relevantes desde {previous['rendered_at']}, se reutiliza su reporte")
+                print(f"{ticker}: sin cambios relevantes desde {previous['rendered_at']}, se reutiliza su reporte")
+                result["state"].update(shown=previous["shown"], message=previous["message"], rendered_at=previous["rendered_at"])
+                result["report_reused"] = True
+                result["message"] = previous["message"] + f"Sin cambios relevantes desde la ejecución de {previous['rendered_at']}.\n\n"
+
+        if filtered_contracts is not None and not unchanged:
+            with run_metrics.stage("rendering", ticker):
+                result["message"] += render_ticker_report(ticker, options, filtered_contracts, config)
+            if incremental:
+                result["state"]["message"] = result["message"]
+
+        if config_value(config, "SPREADS_ACTIVOS"):
+            with run_metrics.stage("spreads", ticker):
+                result["spreads"] = scan_credit_spreads(ticker, config)
+            with run_metrics.stage("rendering", ticker):
+                result["message"] += render_spreads_report(ticker, result["spreads"], config)
+
+    except RequestThrottledError:
+        # run_group vuelve a encolar el ticker en lugar de reportarlo sin datos
+        raise
+    except Exception as e:
+        return error_ticker_report(ticker, e)
+    return result
+
+def error_ticker_report(ticker, error):
+    """Resultado de build_ticker_report para un ticker cuyo análisis falló."""
+    logger.error(f"Error procesando {ticker}: {error}")
+    print(f"Error procesando {ticker}: {error}")
+    message = f"==================================================\n"
+    message += f"Analizando ticker: {ticker}\n"
+    message += f"==================================================\n\n"
+    message += f"Error procesando {ticker}: {str(error)}\n\n"
+    return {
+        "ticker": ticker,
+        "message": message,
+        "options": empty_contract_batch(),
+        "filtered_contracts": None,
+        "best_contracts": None,
+        "spreads": None,
+        "error": str(error),
+        "state": None,
+        "changes": None,
+        "report_reused": False
+    }
+
+def resolve_group_tickers(group_type):
+    """Devuelve la lista de tickers del grupo, generándola si el grupo es dinámico."""
+    group_config = GROUPS_CONFIG[group_type]
+    # Determinar si el grupo es dinámico o estático
+    if "dynamic_source" in group_config:
+        with run_metrics.stage("screening"):
+            return generate_dynamic_tickers(group_config["dynamic_source"], group_config["dynamic_criteria"])
+    return group_config["tickers"]
+
+def prefetch_market_data(tickers, max_days):
+    """
+    Descarga en paralelo info, vencimientos y cadenas (hasta max_days días) de cada símbolo
+    una sola vez, dejándolos en la caché para que todos los grupos los reutilicen.
+    """
+    def prefetch(ticker):
+        try:
+            market_data_cache.info(ticker)
+            for expiration in market_data_cache.options(ticker):
+                if not expiration:
+                    continue
+                days_to_expiration = (datetime.strptime(expiration, '%Y-%m-%d') - analysis_now()).days
+                if 0 < days_to_expiration <= max_days:
+                    market_data_cache.option_chain(ticker, expiration)
+        except Exception as e:
+            # El error se volverá a producir y se reportará al analizar el ticker en su grupo
+            logger.info(f"Error precargando datos de {ticker}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS)) as executor:
+        list(executor.map(prefetch, tickers))
+
+BEST_CONTRACTS_CSV_HEADERS = [
+    "Ticker", "Strike", "Last Closed", "Bid", "Vencimiento", "Días Venc.",
+    "Rent. Diaria", "Rent. Anual", "Break-even", "Dif. % (Suby.-Break.)",
+    "Volatilidad Implícita", "Delta", "Prob. OTM", "Prob. Toque", "Volumen", "Interés Abierto", "Fuente", "Tipo"
+]
+
+class StreamingCsvWriter:
+    """
+    Añade DataFrames por bloques a un CSV, escribiendo la cabecera con el primer bloque.
+    Los bloques deben tener los mismos tipos por columna (filter_option_contracts ya convierte a float
+    las columnas numéricas de la cadena), para que el resultado sea el mismo que al concatenarlos.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self.written = False
+
+    def append(self, df):
+        if self._file is None:
+            self._file = open(self.path, "w", newline="")
+            df.to_csv(self._file, index=False)
+        else:
+            df.to_csv(self._file, index=False, header=False)
+        self._file.flush()
+        self.written = True
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+
+class GroupReportWriter:
+    """
+    Escribe resultados.txt, todas_las_opciones.csv, Mejores_Contratos.txt y mejores_contratos.csv
+    (y spreads_de_credito.csv si el grupo busca spreads) de un grupo en streaming: cada ticker se
+    añade a los archivos en cuanto termina, de modo que la memoria no crece con el tamaño del
+    universo y una ejecución interrumpida deja los resultados parciales. El contenido final es el
+    mismo que generando los archivos al terminar.
+    """
+
+    def __init__(self, description, output_dir="."):
+        os.makedirs(output_dir, exist_ok=True)
+        self.mejores_txt_path = os.path.join(output_dir, "Mejores_Contratos.txt")
+        self._resultados = open(os.path.join(output_dir, "resultados.txt"), "w")
+        self._mejores_txt = open(self.mejores_txt_path, "w")
+        self._todas_csv = StreamingCsvWriter(os.path.join(output_dir, "todas_las_opciones.csv"))
+        self._mejores_csv = StreamingCsvWriter(os.path.join(output_dir, "mejores_contratos.csv"))
+        self._spreads_csv = StreamingCsvWriter(os.path.join(output_dir, "spreads_de_credito.csv"))
+        self.errors = []
+        self.tickers_identificados = []
+        self._has_options = False
+
+        self._resultados.write(f"==================================================\n")
+        self._resultados.write(f"Análisis de Opciones - {description}\n")
+        self._resultados.write(f"==================================================\n\n")
+        self._mejores_txt.write(f"Mejores Contratos por Ticker (Mayor Rentabilidad Anual, Menor Tiempo, Mayor Diferencia %):\n{'='*50}\n")
+        self._flush()
+
+    def _flush(self):
+        self._resultados.flush()
+        self._mejores_txt.flush()
+
+    def add(self, result):
+        """Añade a los archivos del grupo la sección de un ticker devuelta por build_ticker_report."""
+        with run_metrics.stage("writing", result["ticker"]):
+            self._add(result)
+
+    def _add(self, result):
+        ticker = result["ticker"]
+        self._resultados.write(result["message"])
+        if result["error"]:
+            self.errors.append(f"{ticker}: {result['error']}")
+        if not result["options"].empty:
+            self._has_options = True
+            self._todas_csv.append(with_integer_counts(result["options"]))
+        if result.get("spreads") is not None and not result["spreads"].empty:
+            self._spreads_csv.append(result["spreads"])
+
+        best_contracts = result["best_contracts"]
+        if result["filtered_contracts"] is not None and not best_contracts.empty:
+            self.tickers_identificados.append(ticker)
+            self._write_best_contracts(ticker, best_contracts)
+        self._flush()
+
+    def _write_best_contracts(self, ticker, best_contracts):
+        # Guardar los mejores contratos (que cumplen las reglas de alerta)
+        f = self._mejores_txt
+        f.write(f"\nTicker: {ticker}\n{'-'*30}\n")
+        best_contracts_data = []
+        for i, row in best_contracts.iterrows():
+            f.write(f"Contrato {i+1}:\n")
+            f.write(f"  Ticker: {ticker}\n")
+            f.write(f"  Strike: ${row['strike']:.2f}\n")
+            f.write(f"  Last Closed: ${row['last_price']:.2f}\n")
+            f.write(f"  Bid: ${row['bid']:.2f}\n")
+            f.write(f"  Vencimiento: {row['expiration']}\n")
+            f.write(f"  Días Venc.: {row['days_to_expiration']}\n")
+            f.write(f"  Rent. Diaria: {row['rentabilidad_diaria']:.2f}%\n")
+            f.write(f"  Rent. Anual: {row['rentabilidad_anual']:.2f}%\n")
+            f.write(f"  Break-even: ${row['break_even']:.2f}\n")
+            f.write(f"  Dif. % (Suby.-Break.): {row['percent_diff']:.2f}%\n")
+            f.write(f"  Volatilidad Implícita: {row['implied_volatility']:.2f}%\n")
+            f.write(f"  Delta: {row['delta']:.3f}\n")
+            f.write(f"  Prob. OTM: {row['prob_otm']:.2f}%\n")
+            f.write(f"  Prob. Toque: {row['prob_touch']:.2f}%\n")
+            f.write(f"  Volumen: {format_count(row['volume'])}\n")
+            f.write(f"  Interés Abierto: {format_count(row['open_interest'])}\n")
+            f.write(f"  Fuente: {row['source']}\n")
+            if row['type'] == "call":
+                f.write(f"  Tipo: Call cubierta\n")
+                f.write(f"  Tope de Subida: {row['upside_cap']:.2f}%\n")
+                f.write(f"  Rent. si se Ejerce: {row['percent_diff']:.2f}%\n")
+            f.write("\n")
+            best_contracts_data.append([
+                ticker,
+                f"${row['strike']:.2f}",
+                f"${row['last_price']:.2f}",
+                f"${row['bid']:.2f}",
+                row['expiration'],
+                row['days_to_expiration'],
+                f"{row['rentabilidad_diaria']:.2f}%",
+                f"{row['rentabilidad_anual']:.2f}%",
+                f"${row['break_even']:.2f}",
+                f"{row['percent_diff']:.2f}%",
+                f"{row['implied_volatility']:.2f}%",
+                f"{row['delta']:.3f}",
+                f"{row['prob_otm']:.2f}%",
+                f"{row['prob_touch']:.2f}%",
+                row['volume'],
+                row['open_interest'],
+                row['source'],
+                row['type']
+            ])
+        best_contracts_csv = pd.DataFrame(best_contracts_data, columns=BEST_CONTRACTS_CSV_HEADERS)
+        self._mejores_csv.append(best_contracts_csv.astype({"Volumen": "Int64", "Interés Abierto": "Int64"}))
+
+    def abort(self):
+        """Cierra los archivos conservando lo escrito hasta el momento."""
+        self._resultados.close()
+        self._mejores_txt.close()
+        self._todas_csv.close()
+        self._mejores_csv.close()
+        self._spreads_csv.close()
+
+    def close(self):
+        """Escribe el pie de resultados.txt, cierra los archivos y retorna los tickers identificados."""
+        if not self._has_options:
+            logger.info("No se encontraron opciones que cumplan con los criterios para ningún ticker.")
+            print("No se encontraron opciones que cumplan con los criterios para ningún ticker.")
+            self._resultados.write("No se encontraron opciones que cumplan con los criterios para ningún ticker.\n")
+        self._resultados.write(f"Errores: {', '.join(self.errors) if self.errors else 'Ninguno'}\n")
+        self._resultados.write("Resultados guardados.\n")
+        self._resultados.close()
+        self._mejores_txt.close()
+        self._todas_csv.close()
+        self._spreads_csv.close()
+        # mejores_contratos.csv se genera siempre, aunque solo tenga la cabecera
+        if not self._mejores_csv.written:
+            self._mejores_csv.append(pd.DataFrame([], columns=BEST_CONTRACTS_CSV_HEADERS))
+        self._mejores_csv.close()
+        return self.tickers_identificados
+
+class ContractStateStore:
+    """
+    Estado del modo incremental entre ejecuciones: por grupo, un JSON <dir>/<grupo>.json con los
+    contratos mostrados y de alerta de cada ticker y su sección ya renderizada de resultados.txt.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, group_type):
+        return os.path.join(self.root, f"{group_type}.json")
+
+    def load(self, group_type):
+        """Estado {ticker: estado} de la ejecución anterior del grupo ({} si no hay o no se puede leer)."""
+        try:
+            with open(self._path(group_type)) as f:
+                return json.load(f)["tickers"]
+        except FileNotFoundError:
+            return {}
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Estado incremental de {group_type} no válido, se parte de cero: {e}")
+            print(f"Estado incremental de {group_type} no válido, se parte de cero: {e}")
+            return {}
+
+    def save(self, group_type, tickers_state):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(group_type)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"saved_at": analysis_now().isoformat(timespec="seconds"), "tickers": tickers_state}, f)
+        os.replace(tmp_path, path)
+
+def create_state_store():
+    """Almacén del modo incremental en INCREMENTAL_STATE_DIR (por defecto .estado)."""
+    return ContractStateStore(os.getenv("INCREMENTAL_STATE_DIR", ".estado"))
+
+class ContractChangeWriter:
+    """
+    Escribe Cambios_Contratos.txt en modo incremental: por ticker, los contratos de alerta nuevos,
+    modificados y retirados respecto a la ejecución anterior, y acumula el estado que se guardará.
+    Un ticker con error conserva su estado anterior; uno que ya no está en el grupo retira sus contratos.
+    """
+
+    def __init__(self, previous_state, output_dir="."):
+        self.path = os.path.join(output_dir, "Cambios_Contratos.txt")
+        self.previous_state = previous_state
+        self.state = {}
+        self.changed_tickers = []
+        self.counts = {"added": 0, "changed": 0, "removed": 0}
+        self.unchanged_reports = 0
+        self._file = open(self.path, "w")
+        self._file.write(f"Cambios en los Contratos de Alerta desde la Ejecución Anterior:\n{'='*50}\n")
+
+    def add(self, result):
+        ticker = result["ticker"]
+        if result["state"] is None:
+            if ticker in self.previous_state:
+                self.state[ticker] = self.previous_state[ticker]
+            return
+        previous = self.previous_state.get(ticker, {})
+        self.state[ticker] = result["state"]
+        self.unchanged_reports += int(result["report_reused"])
+        self._write_changes(ticker, result["changes"], previous.get("alert", {}), result["state"]["alert"])
+
+    def _write_changes(self, ticker, changes, previous_alert, alert):
+        if not any(changes.values()):
+            return
+        self.changed_tickers.append(ticker)
+        f = self._file
+        f.write(f"\nTicker: {ticker}\n{'-'*30}\n")
+        for key in changes["added"]:
+            contract = alert[key]
+            f.write(
+                f"  Nuevo: {contract['type']} ${contract['strike']:.2f} {contract['expiration']} ({contract['days_to_expiration']} días), "
+                f"Bid: ${contract['bid']:.2f}, Rent. Anual: {contract['rentabilidad_anual']:.2f}%, "
+                f"Volatilidad Implícita: {contract['implied_volatility']:.2f}%\n"
+            )
+        for key in changes["changed"]:
+            old, new = previous_alert[key], alert[key]
+            f.write(
+                f"  Modificado: {new['type']} ${new['strike']:.2f} {new['expiration']} ({new['days_to_expiration']} días), "
+                f"Bid: ${old['bid']:.2f} -> ${new['bid']:.2f}, "
+                f"Rent. Anual: {old['rentabilidad_anual']:.2f}% -> {new['rentabilidad_anual']:.2f}%\n"
+            )
+        for key in changes["removed"]:
+            contract = previous_alert[key]
+            f.write(f"  Retirado: {contract['type']} ${contract['strike']:.2f} {contract['expiration']}\n")
+        for kind in self.counts:
+            self.counts[kind] += len(changes[kind])
+        f.flush()
+
+    def abort(self):
+        self._file.close()
+
+    def close(self):
+        """Retira los contratos de los tickers que ya no están en el grupo y cierra el archivo."""
+        for ticker, previous in self.previous_state.items():
+            if ticker not in self.state and previous.get("alert"):
+                self._write_changes(ticker, {"added": [], "changed": [], "removed": list(previous["alert"])}, previous["alert"], {})
+        if not self.changed_tickers:
+            self._file.write("\nSin cambios en los contratos de alerta.\n")
+        self._file.close()
+
+def write_group_outputs(results, description, output_dir=".", change_writer=None):
+    """
+    Escribe los archivos de resultados de un grupo (cuatro, o cinco con spreads_de_credito.csv si el
+    grupo busca spreads) a partir de los resultados de build_ticker_report (cualquier iterable,
+    consumido en orden y a medida que llega).
+    Con change_writer (modo incremental) se escriben además los cambios de los contratos de alerta.
+    Retorna los tickers con contratos que cumplen las reglas de alerta.
+    """
+    writer = GroupReportWriter(description, output_dir)
+    try:
+        for result in results:
+            writer.add(result)
+            if change_writer is not None:
+                change_writer.add(result)
+    except Exception:
+        # Los tickers ya escritos quedan en disco; se cierran los archivos sin el pie del resumen
+        writer.abort()
+        if change_writer is not None:
+            change_writer.abort()
+        raise
+    if change_writer is not None:
+        change_writer.close()
+    return writer.close()
+
+def changed_alert_contracts(result):
+    """Contratos de alerta de un resultado incremental que son nuevos o han cambiado desde la ejecución anterior."""
+    best_contracts, changes = result["best_contracts"], result["changes"]
+    if best_contracts is None or best_contracts.empty or not changes:
+        return None
+    keys = set(changes["added"]) | set(changes["changed"])
+    mask = [
+        contract_key(ticker, expiration, strike, option_type) in keys
+        for ticker, expiration, strike, option_type in zip(best_contracts["ticker"], best_contracts["expiration"], best_contracts["strike"], best_contracts["type"])
+    ]
+    return best_contracts[mask]
+
+def notify_results(results, notifier, incremental=False):
+    """
+    Deja pasar los resultados de build_ticker_report encolando las alertas de cada ticker en el notificador.
+    En modo incremental solo se encolan los contratos de alerta nuevos o modificados.
+    """
+    for result in results:
+        notifier.notify(result["ticker"], changed_alert_contracts(result) if incremental else result["best_contracts"])
+        yield result
+
+class ContractIndex:
+    """
+    Índice en memoria de los últimos contratos ordenados de cada grupo, que sirve el endpoint HTTP
+    del modo daemon. Un grupo se publica completo al terminar su ejecución (hasta entonces se sigue
+    sirviendo la anterior) y se guarda ya serializado en JSON por vista (grupo completo o un ticker,
+    con todos los contratos o solo las alertas), de modo que una consulta es una búsqueda en un dict.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    @staticmethod
+    def _records(contracts):
+        if contracts is None or contracts.empty:
+            return []
+        columns = [column for column in OPTION_COLUMNS if column in contracts]
+        return json.loads(contracts[columns].to_json(orient="records", date_format="iso"))
+
+    @classmethod
+    def entry(cls, result):
+        """Entrada del índice para un resultado de build_ticker_report."""
+        return {
+            "contratos": cls._records(result["filtered_contracts"]),
+            "alertas": cls._records(result["best_contracts"]),
+            "error": result["error"],
+        }
+
+    def publish(self, group_type, tickers):
+        """Sustituye los contratos del grupo por los de {ticker: entrada} de la ejecución que acaba de terminar."""
+        updated_at = analysis_now().isoformat(timespec="seconds")
+        views = {}
+        for alerts_only in (False, True):
+            selected = {
+                ticker: {"alertas": entry["alertas"], "error": entry["error"]} if alerts_only else entry
+                for ticker, entry in tickers.items()
+            }
+            views[(None, alerts_only)] = json.dumps(
+                {"grupo": group_type, "actualizado": updated_at, "tickers": selected}, default=str
+            ).encode()
+            for ticker, entry in selected.items():
+                views[(ticker, alerts_only)] = json.dumps(
+                    {"grupo": group_type, "actualizado": updated_at, "ticker": ticker, **entry}, default=str
+                ).encode()
+        summary = {
+            "actualizado": updated_at,
+            "tickers": len(tickers),
+            "tickers_con_alerta": sum(1 for entry in tickers.values() if entry["alertas"]),
+            "alertas": sum(len(entry["alertas"]) for entry in tickers.values()),
+            "errores": sum(1 for entry in tickers.values() if entry["error"]),
+        }
+        with self._lock:
+            self._groups[group_type] = (views, summary)
+
+    def response(self, group_type, ticker=None, alerts_only=False):
+        """JSON ya serializado de una vista, o None si el grupo (o el ticker) no se ha analizado."""
+        with self._lock:
+            entry = self._groups.get(group_type)
+        return entry[0].get((ticker, alerts_only)) if entry else None
+
+    def summary(self):
+        with self._lock:
+            return {group_type: dict(summary) for group_type, (_, summary) in self._groups.items()}
+
+def index_results(results, contract_index, group_type):
+    """Deja pasar los resultados de build_ticker_report y publica el grupo en el índice cuando termina."""
+    tickers = {}
+    for result in results:
+        tickers[result["ticker"]] = contract_index.entry(result)
+        yield result
+    contract_index.publish(group_type, tickers)
+
+def analyze_tickers(tickers, config, previous_state=None):
+    """
+    Genera los resultados de build_ticker_report de los tickers, procesados en paralelo y en el orden
+    de la lista (los limitados por la fuente vuelven al final de la cola), a medida que terminan.
+    """
+    previous_state = previous_state or {}
+    max_workers = max(1, min(MAX_WORKERS, len(tickers)))
+    logger.info(f"Procesando {len(tickers)} tickers con {max_workers} workers")
+    print(f"Procesando {len(tickers)} tickers con {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from map_requeuing_throttled(
+            executor, lambda ticker: build_ticker_report(ticker, config, previous_state.get(ticker)), tickers, error_ticker_report
+        )
+
+def run_group(group_type, tickers, output_dir=".", contract_index=None, results=None):
+    """
+    Analiza los tickers de un grupo con su configuración, genera sus archivos de resultados
+    en output_dir y envía la notificación a su webhook de Discord. En modo daemon publica además
+    sus contratos en contract_index. Con results (resultados ya calculados, como los de los shards
+    en merge_shards) no se analiza nada y solo se escriben los reportes y se notifica.
+    """
+    group_config = GROUPS_CONFIG[group_type]
+    mejores_txt_path = os.path.join(output_dir, "Mejores_Contratos.txt")
+
+    description = group_config["description"]
+    webhook_url = group_config["webhook"]
+    config = group_config["config"]
+    logger.info(f"Webhook URL para {description}: {webhook_url}")
+    print(f"Webhook URL para {description}: {webhook_url}")
+
+    # Modo incremental: estado de la ejecución anterior del grupo para comparar y reutilizar reportes
+    state_store = change_writer = None
+    previous_state = {}
+    if config_value(config, "MODO_INCREMENTAL"):
+        state_store = create_state_store()
+        previous_state = state_store.load(group_type)
+        change_writer = ContractChangeWriter(previous_state, output_dir)
+        logger.info(f"Modo incremental: {len(previous_state)} tickers en el estado anterior de {group_type}")
+        print(f"Modo incremental: {len(previous_state)} tickers en el estado anterior de {group_type}")
+
+    # Las alertas salen hacia Discord a medida que se analizan los tickers. En modo incremental el delta de
+    # cada ticker ya decide qué se alerta, así que no se consulta el índice de contratos enviados
+    notifier = None
+    if is_valid_webhook(webhook_url) and config_value(config, "DISCORD_ALERTAS_INMEDIATAS"):
+        notifier = DiscordNotifier(
+            DiscordWebhook(webhook_url), header=discord_alert_header(config, description),
+            seen_index=create_seen_contracts_index() if change_writer is None else None, group_key=group_type
+        )
+
+    # Cada ticker se escribe en cuanto termina
+    if results is None:
+        results = analyze_tickers(tickers, config, previous_state)
+    if notifier is not None:
+        results = notify_results(results, notifier, incremental=change_writer is not None)
+    if contract_index is not None:
+        results = index_results(results, contract_index, group_type)
+    try:
+        tickers_identificados = write_group_outputs(results, description, output_dir, change_writer)
+    finally:
+        if notifier is not None:
+            with run_metrics.stage("discord"):
+                notifier.close()
+
+    if notifier is not None:
+        logger.info(f"Discord: {notifier.sent_contracts} contratos alertados en {len(notifier.sent_tickers)} tickers, {notifier.suppressed_contracts} ya alertados antes omitidos")
+        print(f"Discord: {notifier.sent_contracts} contratos alertados en {len(notifier.sent_tickers)} tickers, {notifier.suppressed_contracts} ya alertados antes omitidos")
+
+    if change_writer is None:
+        if notifier is not None:
+            if config["FORCE_DISCORD_NOTIFICATION"]:
+                with run_metrics.stage("discord"):
+                    send_discord_notification(tickers_identificados, webhook_url, config, description, mejores_txt_path)
+            return
+        # Enviar notificación a Discord solo si hay contratos que cumplen las reglas de alerta
+        if config["FORCE_DISCORD_NOTIFICATION"] or tickers_identificados:
+            logger.debug(f"Enviando a {webhook_url} para {description}")
+            print(f"Enviando notificación a Discord para {description}")
+            with run_metrics.stage("discord"):
+                send_discord_notification(tickers_identificados, webhook_url, config, description, mejores_txt_path)
+        return
+
+    counts = change_writer.counts
+    summary = f"{counts['added']} nuevos, {counts['changed']} modificados, {counts['removed']} retirados"
+    logger.info(f"Modo incremental: {summary}; {change_writer.unchanged_reports} reportes de ticker reutilizados")
+    print(f"Modo incremental: {summary}; {change_writer.unchanged_reports} reportes de ticker reutilizados")
+    delivered = None
+    if notifier is not None:
+        # Los contratos nuevos y modificados ya se alertaron por ticker; los retirados no pasan por el notificador,
+        # así que si hay alguno (o se fuerza la notificación) se envía además Cambios_Contratos.txt
+        delivered = notifier.failed_messages == 0
+        if config["FORCE_DISCORD_NOTIFICATION"] or counts["removed"]:
+            with run_metrics.stage("discord"):
+                sent = send_discord_notification(
+                    change_writer.changed_tickers, webhook_url, config, description, change_writer.path,
+                    summary=f"Cambios en los contratos de alerta desde la ejecución anterior ({summary}) para los siguientes tickers"
+                )
+            delivered = delivered and sent is not False
+    # Sin alertas inmediatas se notifica el delta, y únicamente si hay cambios en los contratos de alerta
+    elif config["FORCE_DISCORD_NOTIFICATION"] or change_writer.changed_tickers:
+        print(f"Enviando cambios a Discord para {description}")
+        with run_metrics.stage("discord"):
+            delivered = send_discord_notification(
+                change_writer.changed_tickers, webhook_url, config, description, change_writer.path,
+                summary=f"Cambios en los contratos de alerta desde la ejecución anterior ({summary}) para los siguientes tickers"
+            )
+    # Si el envío falla se conserva el estado anterior, para volver a notificar el delta en la próxima ejecución
+    if delivered is not False:
+        state_store.save(group_type, change_writer.state)
+
+def configure_market_data():
+    """Configura la fuente de datos, el planificador de peticiones y los snapshots de la caché según el entorno."""
+    market_data_cache.provider = create_market_data_provider()
+    market_data_cache.scheduler = create_request_scheduler()
+    if market_data_cache.provider.name == "replay":
+        set_analysis_time(market_data_cache.provider.recorded_at())
+    logger.info(f"Fuente de datos de mercado: {market_data_cache.provider.name}")
+    print(f"Fuente de datos de mercado: {market_data_cache.provider.name}")
+    # En replay los datos salen solo de las fixtures: los snapshots (con TTL sobre la hora real) lo harían no determinista
+    market_data_cache.snapshot_store = create_snapshot_store() if market_data_cache.provider.name != "replay" else None
+    if market_data_cache.snapshot_store is not None:
+        max_age_hours = os.getenv("SNAPSHOT_MAX_AGE_HOURS")
+        max_size_mb = os.getenv("SNAPSHOT_MAX_SIZE_MB")
+        removed = market_data_cache.snapshot_store.prune(
+            max_age_hours=float(max_age_hours) if max_age_hours else None,
+            max_size_mb=float(max_size_mb) if max_size_mb else None
+        )
+        logger.info(f"Snapshots en {market_data_cache.snapshot_store.root}: {removed} archivos eliminados por antigüedad o tamaño")
+        print(f"Snapshots en {market_data_cache.snapshot_store.root}: {removed} archivos eliminados por antigüedad o tamaño")
+
+def scan_groups(group_types, resolve_tickers=resolve_group_tickers, separate_dirs=None, contract_index=None, run=run_group):
+    """
+    Resuelve los tickers de los grupos y los analiza con run (run_group, o el de un shard). Con varios
+    grupos (o separate_dirs) descarga una sola vez la unión de tickers y escribe los resultados de cada
+    grupo en su propio directorio. Retorna {grupo: tickers}.
+    """
+    tickers_by_group = {}
+    for group_type in group_types:
+        tickers = resolve_tickers(group_type)
+        if not tickers:
+            logger.error(f"No se encontraron tickers para el grupo {group_type}")
+            print(f"No se encontraron tickers para el grupo {group_type}")
+            continue
+        tickers_by_group[group_type] = tickers
+        # Los tickers de los grupos que alertan por Discord se descargan primero si la fuente limita
+        if GROUPS_CONFIG[group_type]["webhook"] not in (None, "", "URL_POR_DEFECTO"):
+            market_data_cache.scheduler.prioritize(tickers)
+
+    if separate_dirs is None:
+        separate_dirs = len(group_types) > 1
+    if not separate_dirs:
+        for group_type, tickers in tickers_by_group.items():
+            run(group_type, tickers, contract_index=contract_index)
+    else:
+        # Descargar una sola vez la unión de tickers y aplicar después la configuración de cada grupo
+        all_tickers = list(dict.fromkeys(ticker for tickers in tickers_by_group.values() for ticker in tickers))
+        max_days = max(GROUPS_CONFIG[group_type]["config"]["MAX_DIAS_VENCIMIENTO"] for group_type in tickers_by_group) if tickers_by_group else 0
+        logger.info(f"Precargando {len(all_tickers)} tickers únicos para {len(tickers_by_group)} grupos")
+        print(f"Precargando {len(all_tickers)} tickers únicos para {len(tickers_by_group)} grupos")
+        with run_metrics.stage("prefetch"):
+            prefetch_market_data(all_tickers, max_days)
+        for group_type, tickers in tickers_by_group.items():
+            run(group_type, tickers, output_dir=group_type, contract_index=contract_index)
+    return tickers_by_group
+
+def finish_run(tickers_by_group, metrics_path="metricas.json", **extra):
+    """Cierra el archivo histórico, informa de la caché, el planificador y las fuentes y guarda metricas.json."""
+    if market_data_cache.archive is not None:
+        market_data_cache.archive.close()
+        logger.info(f"Archivo histórico en {market_data_cache.archive.root}: {market_data_cache.archive.archived_contracts} contratos y {market_data_cache.archive.archived_prices} precios del subyacente añadidos")
+        print(f"Archivo histórico en {market_data_cache.archive.root}: {market_data_cache.archive.archived_contracts} contratos y {market_data_cache.archive.archived_prices} precios del subyacente añadidos")
+
+    cache_stats = market_data_cache.stats()
+    logger.info(f"Caché de datos de mercado: {cache_stats['hits']} aciertos, {cache_stats['misses']} descargas")
+    print(f"Caché de datos de mercado: {cache_stats['hits']} aciertos, {cache_stats['misses']} descargas")
+
+    scheduler_stats = market_data_cache.scheduler.stats()
+    logger.info(f"Planificador de peticiones: {scheduler_stats['requests']} peticiones, {scheduler_stats['retries']} reintentos, {scheduler_stats['throttled']} limitadas por la fuente")
+    print(f"Planificador de peticiones: {scheduler_stats['requests']} peticiones, {scheduler_stats['retries']} reintentos, {scheduler_stats['throttled']} limitadas por la fuente")
+    for source, throughput in run_metrics.source_throughput().items():
+        # Las fuentes sin tiempo medido (aciertos de snapshots, envíos a Discord) no tienen tasa
+        if throughput["requests_per_second"] is None:
+            logger.info(f"Fuente {source}: {run_metrics.sources[source]['requests']} peticiones sin tiempo medido")
+            print(f"Fuente {source}: {run_metrics.sources[source]['requests']} peticiones sin tiempo medido")
+            continue
+        logger.info(f"Fuente {source}: {throughput['requests_per_second']:.2f} peticiones/s, {throughput['bytes_per_second'] / 1024:.1f} KB/s")
+        print(f"Fuente {source}: {throughput['requests_per_second']:.2f} peticiones/s, {throughput['bytes_per_second'] / 1024:.1f} KB/s")
+
+    # Las métricas se guardan junto a resultados.txt (en el directorio de trabajo; las de un shard, en SHARD_DIR)
+    run_metrics.write(
+        metrics_path,
+        groups=list(tickers_by_group),
+        tickers_by_group=tickers_by_group,
+        cache=cache_stats,
+        provider=market_data_cache.provider.name,
+        scheduler=scheduler_stats,
+        max_workers=MAX_WORKERS,
+        **extra
+    )
+    logger.info(f"Métricas de la ejecución guardadas en {metrics_path}")
+    print(f"Métricas de la ejecución guardadas en {metrics_path}")
+
+class ShardResultStore:
+    """
+    Resultados del modo por shards: por grupo, un directorio <dir>/<grupo>/shard-<i>-de-<n>/ con la
+    cabecera (tickers del shard; las métricas de sus seleccionados dinámicos en Parquet) y los resultados
+    de build_ticker_report de cada ticker a medida que terminan, de modo que la memoria no crece con el
+    universo: una línea JSON por resultado y sus DataFrames en Parquet. Se escribe como .tmp y se
+    renombra al terminar: un shard interrumpido no se combina.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _group_dir(self, group_type):
+        return os.path.join(self.root, group_type)
+
+    @staticmethod
+    def _dump(directory, name, record):
+        """Guarda los DataFrames del registro como <name>-<campo>.parquet y devuelve el resto, serializable en JSON."""
+        data = {"_frames": {}}
+        for key, value in record.items():
+            if isinstance(value, pd.DataFrame):
+                data["_frames"][key] = f"{name}-{key}.parquet"
+                value.to_parquet(os.path.join(directory, data["_frames"][key]))
+            else:
+                data[key] = value
+        return data
+
+    @staticmethod
+    def _load(directory, data):
+        """Inverso de _dump: vuelve a leer los DataFrames del registro."""
+        for key, name in data.pop("_frames").items():
+            data[key] = pd.read_parquet(os.path.join(directory, name))
+        return data
+
+    @contextmanager
+    def writer(self, group_type, header):
+        """Abre el directorio del shard con su cabecera y entrega una función que guarda un resultado."""
+        path = os.path.join(self._group_dir(group_type), f"shard-{header['index']}-de-{header['count']}")
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        with open(os.path.join(tmp_path, "header.json"), "w") as f:
+            json.dump(self._dump(tmp_path, "header", header), f)
+        with open(os.path.join(tmp_path, "results.jsonl"), "w") as f:
+            def save(result):
+                f.write(json.dumps(self._dump(tmp_path, f"result-{save.count}", result)) + "\n")
+                save.count += 1
+            save.count = 0
+            yield save
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def shards(self, group_type):
+        """Lista de (cabecera, ruta) de los shards completos del grupo, por índice."""
+        directory = self._group_dir(group_type)
+        if not os.path.isdir(directory):
+            return []
+        shards = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith("shard-") and not name.endswith(".tmp") and os.path.isdir(path):
+                with open(os.path.join(path, "header.json")) as f:
+                    shards.append((self._load(path, json.load(f)), path))
+        return sorted(shards, key=lambda shard: shard[0]["index"])
+
+    def results(self, path, tickers):
+        """Genera los resultados guardados en un shard de los tickers indicados."""
+        with open(os.path.join(path, "results.jsonl")) as f:
+            for line in f:
+                data = json.loads(line)
+                if data["ticker"] in tickers:
+                    yield self._load(path, data)
+
+    def clear(self, group_types):
+        """Elimina los shards de una ejecución anterior de los grupos."""
+        for group_type in group_types:
+            directory = self._group_dir(group_type)
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if name.startswith("shard-"):
+                        path = os.path.join(directory, name)
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        else:
+                            os.remove(path)
+
+def create_shard_store():
+    """Almacén de resultados del modo por shards en SHARD_DIR (por defecto shards), o None si no hay soporte para Parquet."""
+    try:
+        import pyarrow  # noqa: F401  (motor de Parquet para pandas)
+    except ImportError:
+        logger.error("El modo por shards guarda los resultados en Parquet y pyarrow no está instalado")
+        print("El modo por shards guarda los resultados en Parquet y pyarrow no está instalado")
+        return None
+    return ShardResultStore(os.getenv("SHARD_DIR", "shards"))
+
+class ShardRun:
+    """
+    Ejecución de un shard (SHARD_INDEX de SHARD_COUNT): cada grupo analiza solo su parte del universo
+    (ver shard_tickers) y guarda los resultados en el almacén en lugar de escribir los reportes y
+    notificar, que quedan para merge_shards. En los grupos dinámicos la criba se hace sobre la parte
+    del universo del shard y se guardan las métricas de sus seleccionados para repetir la selección global.
+    """
+
+    def __init__(self, index, count, store):
+        self.index = index
+        self.count = count
+        self.store = store
+        self._screened = {}
+        self._saved = set()
+
+    def resolve_tickers(self, group_type):
+        group_config = GROUPS_CONFIG[group_type]
+        if "dynamic_source" not in group_config:
+            tickers = shard_tickers(group_config["tickers"], self.index, self.count)
+            logger.info(f"Shard {self.index} de {self.count}: {len(tickers)} de {len(group_config['tickers'])} tickers de {group_type}")
+            print(f"Shard {self.index} de {self.count}: {len(tickers)} de {len(group_config['tickers'])} tickers de {group_type}")
+            return tickers
+        criteria = group_config["dynamic_criteria"]
+        with run_metrics.stage("screening"):
+            try:
+                screened = screen_dynamic_universe(group_config["dynamic_source"], criteria, shard=(self.index, self.count))
+                tickers = select_dynamic_tickers(screened, criteria) if not screened.empty else []
+            except Exception as e:
+                logger.error(f"Error generando tickers dinámicos: {e}")
+                print(f"Error generando tickers dinámicos: {e}")
+                return []
+        if tickers:
+            self._screened[group_type] = screened[screened["ticker"].isin(tickers)]
+        return tickers
+
+    def _header(self, group_type, tickers):
+        return {
+            "group": group_type,
+            "index": self.index,
+            "count": self.count,
+            "tickers": tickers,
+            "screened": self._screened.get(group_type)
+        }
+
+    def run_group(self, group_type, tickers, output_dir=".", contract_index=None):
+        """Analiza los tickers del shard y guarda sus resultados (output_dir no se usa: no hay reportes)."""
+        config = GROUPS_CONFIG[group_type]["config"]
+        previous_state = create_state_store().load(group_type) if config_value(config, "MODO_INCREMENTAL") else {}
+        with self.store.writer(group_type, self._header(group_type, tickers)) as save:
+            for result in analyze_tickers(tickers, config, previous_state):
+                save(result)
+        self._saved.add(group_type)
+        logger.info(f"Shard {self.index} de {self.count}: resultados de {len(tickers)} tickers de {group_type} guardados en {self.store.root}")
+        print(f"Shard {self.index} de {self.count}: resultados de {len(tickers)} tickers de {group_type} guardados en {self.store.root}")
+
+    def close(self, group_types):
+        """Guarda vacío el shard de los grupos sin tickers en esta parte, para que cuente como completo."""
+        for group_type in group_types:
+            if group_type not in self._saved:
+                with self.store.writer(group_type, self._header(group_type, [])):
+                    pass
+
+def run_shard_processes(shard_count, store):
+    """
+    Lanza este script en shard_count procesos, uno por shard, con la salida de cada uno en
+    <SHARD_DIR>/shard-<i>.log, y espera a que terminen. Cada proceso tiene sus propios MAX_WORKERS
+    y planificador de peticiones. Retorna los índices de los shards que fallaron.
+    """
+    os.makedirs(store.root, exist_ok=True)
+    processes = []
+    for index in range(shard_count):
+        env = dict(os.environ, SHARD_INDEX=str(index), SHARD_COUNT=str(shard_count), SHARD_MERGE="false")
+        log_path = os.path.join(store.root, f"shard-{index}.log")
+        with open(log_path, "w") as log_file:
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        processes.append((index, log_path, process))
+    logger.info(f"Lanzados {shard_count} procesos de shard (salida en {store.root}/shard-<i>.log)")
+    print(f"Lanzados {shard_count} procesos de shard (salida en {store.root}/shard-<i>.log)")
+
+    failed = []
+    for index, log_path, process in processes:
+        if process.wait() != 0:
+            failed.append(index)
+            logger.error(f"El shard {index} terminó con código {process.returncode}, ver {log_path}")
+            print(f"El shard {index} terminó con código {process.returncode}, ver {log_path}")
+    return failed
+
+def merge_shards(group_types, store):
+    """
+    Combina los resultados de los shards de cada grupo en un único juego de reportes y notificaciones
+    (run_group con los resultados ya calculados) y guarda metricas.json. En los grupos dinámicos repite la
+    selección sobre las métricas de todos los shards, con lo que el top N es el mismo que sin shards salvo
+    con la terminación anticipada, que es una heurística y se decide por shard; los tickers
+    se escriben en el orden de la ejecución sin shards. Retorna {grupo: tickers}.
+    """
+    tickers_by_group = {}
+    shards_by_group = {}
+    separate_dirs = len(group_types) > 1
+    for group_type in group_types:
+        shards = store.shards(group_type)
+        if not shards:
+            logger.error(f"No hay resultados de shards del grupo {group_type} en {store.root}")
+            print(f"No hay resultados de shards del grupo {group_type} en {store.root}")
+            continue
+        count = shards[0][0]["count"]
+        if any(header["count"] != count for header, _ in shards):
+            logger.error(f"Los shards del grupo {group_type} en {store.root} son de ejecuciones con distinto número de shards")
+            print(f"Los shards del grupo {group_type} en {store.root} son de ejecuciones con distinto número de shards")
+            continue
+        missing = sorted(set(range(count)) - {header["index"] for header, _ in shards})
+        if missing:
+            logger.warning(f"Faltan los shards {missing} de {count} del grupo {group_type}: los resultados serán parciales")
+            print(f"Faltan los shards {missing} de {count} del grupo {group_type}: los resultados serán parciales")
+
+        group_config = GROUPS_CONFIG[group_type]
+        if "dynamic_source" in group_config:
+            screened = [header["screened"] for header, _ in shards if header["screened"] is not None]
+            tickers = select_dynamic_tickers(pd.concat(screened, ignore_index=True), group_config["dynamic_criteria"]) if screened else []
+        else:
+            analyzed = {ticker for header, _ in shards for ticker in header["tickers"]}
+            tickers = [ticker for ticker in dict.fromkeys(group_config["tickers"]) if ticker in analyzed]
+        if not tickers:
+            logger.error(f"No se encontraron tickers para el grupo {group_type}")
+            print(f"No se encontraron tickers para el grupo {group_type}")
+            continue
+
+        logger.info(f"Combinando {len(tickers)} tickers de {len(shards)} shards del grupo {group_type}")
+        print(f"Combinando {len(tickers)} tickers de {len(shards)} shards del grupo {group_type}")
+        position = {ticker: i for i, ticker in enumerate(tickers)}
+        results = heapq.merge(*(store.results(path, position) for _, path in shards), key=lambda result: position[result["ticker"]])
+        run_group(group_type, tickers, output_dir=group_type if separate_dirs else ".", results=results)
+        tickers_by_group[group_type] = tickers
+        shards_by_group[group_type] = len(shards)
+
+    run_metrics.write("metricas.json", groups=list(tickers_by_group), tickers_by_group=tickers_by_group, shards=shards_by_group)
+    logger.info("Métricas de la combinación de shards guardadas en metricas.json")
+    print("Métricas de la combinación de shards guardadas en metricas.json")
+    return tickers_by_group
+
+# Horario del modo daemon (DAEMON_SCHEDULE): "grupo=HH:MM,HH:MM;grupo=30m", con horas UTC o un
+# intervalo en minutos. Por defecto el mismo que los cron del workflow
+DAEMON_DEFAULT_SCHEDULE = (
+    "indices=11:00,13:00,15:00;7magnificas=13:00,15:00,17:00;shortlist=14:00,16:00;"
+    "european_companies=12:00,18:00;nasdaq_top_volatility=09:00,15:00"
+)
+
+def parse_daemon_schedule(text):
+    """Interpreta DAEMON_SCHEDULE como {grupo: [hora UTC (time) o intervalo (timedelta)]}."""
+    schedule = {}
+    for entry in text.split(";"):
+        if not entry.strip():
+            continue
+        group_type, _, slots = entry.partition("=")
+        group_type = group_type.strip()
+        if group_type not in GROUPS_CONFIG:
+            raise ValueError(f"Grupo {group_type} no encontrado")
+        parsed = []
+        for slot in slots.split(","):
+            slot = slot.strip()
+            if slot.endswith("m"):
+                parsed.append(timedelta(minutes=float(slot[:-1])))
+            else:
+                parsed.append(datetime.strptime(slot, "%H:%M").time())
+        schedule[group_type] = parsed
+    return schedule
+
+def next_scheduled_run(slots, now, last_run=None):
+    """Próxima ejecución (UTC) de un grupo: la primera hora del horario posterior a now o el fin de su intervalo."""
+    candidates = []
+    for slot in slots:
+        if isinstance(slot, timedelta):
+            candidates.append((last_run or now) + slot)
+            continue
+        at = datetime.combine(now.date(), slot, tzinfo=timezone.utc)
+        candidates.append(at if at > now else at + timedelta(days=1))
+    return min(candidates)
+
+class ScannerDaemon:
+    """
+    Modo daemon: el proceso queda residente y ejecuta cada grupo según su horario. Entre ciclos
+    conserva la caché de datos de mercado, donde cada tipo de dato caduca según su ttl, y los
+    tickers de los screeners dinámicos. Los grupos con la misma hora se analizan en un solo ciclo
+    con una descarga común, y los contratos de cada grupo se publican en contract_index. Con
+    skip_closed_market se omiten los ciclos de los días sin sesión.
+    """
+
+    def __init__(self, schedule, contract_index, screener_ttl_seconds, run_on_start=True, max_cycles=None, skip_closed_market=False):
+        self.schedule = schedule
+        self.skip_closed_market = skip_closed_market
+        self.contract_index = contract_index
+        self.screener_ttl_seconds = screener_ttl_seconds
+        self.max_cycles = max_cycles
+        self.stop_event = threading.Event()
+        self.cycles = 0
+        self.started_at = datetime.now(timezone.utc)
+        self.last_runs = {}
+        self._screened = {}
+        self.next_runs = {
+            group_type: self.started_at if run_on_start else next_scheduled_run(slots, self.started_at)
+            for group_type, slots in schedule.items()
+        }
+
+    def resolve_tickers(self, group_type):
+        """Tickers del grupo; los de un screener dinámico se reutilizan durante screener_ttl_seconds."""
+        if "dynamic_source" not in GROUPS_CONFIG[group_type]:
+            return resolve_group_tickers(group_type)
+        cached = self._screened.get(group_type)
+        if cached is not None and time.monotonic() - cached[1] < self.screener_ttl_seconds:
+            logger.info(f"Screener de {group_type}: se reutilizan {len(cached[0])} tickers de hace {(time.monotonic() - cached[1]) / 60:.0f} min")
+            print(f"Screener de {group_type}: se reutilizan {len(cached[0])} tickers de hace {(time.monotonic() - cached[1]) / 60:.0f} min")
+            return cached[0]
+        tickers = resolve_group_tickers(group_type)
+        if tickers:
+            self._screened[group_type] = (tickers, time.monotonic())
+        return tickers
+
+    def run_cycle(self, group_types):
+        started_at = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        logger.info(f"Ciclo {self.cycles + 1} del daemon: {', '.join(group_types)}")
+        print(f"Ciclo {self.cycles + 1} del daemon: {', '.join(group_types)}")
+        run_metrics.reset()
+        market_data_cache.reset_stats()
+        expired = market_data_cache.expire()
+        if finnhub_client is not None:
+            finnhub_client.clear()
+        # Un archivo por ciclo: su scanned_at identifica la ejecución
+        market_data_cache.archive = create_option_archive()
+        try:
+            finish_run(scan_groups(group_types, self.resolve_tickers, separate_dirs=True, contract_index=self.contract_index))
+        finally:
+            self.cycles += 1
+            for group_type in group_types:
+                self.last_runs[group_type] = started_at
+        logger.info(f"Ciclo {self.cycles} terminado en {time.perf_counter() - start:.1f}s ({expired} datos caducados descartados de la caché)")
+        print(f"Ciclo {self.cycles} terminado en {time.perf_counter() - start:.1f}s ({expired} datos caducados descartados de la caché)")
+
+    def run(self):
+        """Bucle principal hasta stop_event (o max_cycles ciclos)."""
+        while not self.stop_event.is_set():
+            now = datetime.now(timezone.utc)
+            due = [group_type for group_type, at in self.next_runs.items() if at <= now]
+            if not due:
+                wait = min(at for at in self.next_runs.values()) - now
+                # Se vuelve a mirar al menos cada minuto por si cambia el reloj del sistema
+                self.stop_event.wait(min(wait.total_seconds(), 60))
+                continue
+            closed = market_closed_reason(market_date()) if self.skip_closed_market else None
+            if closed:
+                logger.info(f"Mercado cerrado ({closed}): se omite el ciclo de {', '.join(due)}")
+                print(f"Mercado cerrado ({closed}): se omite el ciclo de {', '.join(due)}")
+            else:
+                try:
+                    self.run_cycle(due)
+                except Exception as e:
+                    logger.error(f"Error en el ciclo del daemon para {', '.join(due)}: {e}")
+                    print(f"Error en el ciclo del daemon para {', '.join(due)}: {e}")
+            now = datetime.now(timezone.utc)
+            for group_type in due:
+                self.next_runs[group_type] = next_scheduled_run(self.schedule[group_type], now, self.last_runs.get(group_type))
+            if self.max_cycles and self.cycles >= self.max_cycles:
+                break
+
+    def status(self):
+        return {
+            "iniciado": self.started_at.isoformat(timespec="seconds"),
+            "ciclos": self.cycles,
+            "grupos": {
+                group_type: {
+                    "ultima_ejecucion": self.last_runs[group_type].isoformat(timespec="seconds") if group_type in self.last_runs else None,
+                    "proxima_ejecucion": at.isoformat(timespec="seconds"),
+                }
+                for group_type, at in dict(self.next_runs).items()
+            },
+            "cache": market_data_cache.stats(),
+        }
+
+class ScannerRequestHandler(BaseHTTPRequestHandler):
+    """
+    Endpoint HTTP local del modo daemon (solo lectura, JSON):
+        GET /salud               estado del daemon y próxima ejecución de cada grupo
+        GET /grupos              resumen de la última ejecución publicada de cada grupo
+        GET /contratos/<grupo>   contratos ordenados de cada ticker; ?ticker=AAPL para uno, ?alertas=1 solo alertas
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = urllib.parse.parse_qs(url.query)
+        daemon = self.server.scanner_daemon
+        if parts == ["salud"]:
+            self._send(200, json.dumps(daemon.status()).encode())
+        elif parts == ["grupos"]:
+            self._send(200, json.dumps(daemon.contract_index.summary()).encode())
+        elif len(parts) == 2 and parts[0] == "contratos":
+            ticker = query.get("ticker", [None])[0]
+            alerts_only = query.get("alertas", ["0"])[0].lower() in ("1", "true", "si", "sí")
+            body = daemon.contract_index.response(parts[1], ticker.upper() if ticker else None, alerts_only)
+            if body is None:
+                self._send(404, json.dumps({"error": f"Sin resultados para {parts[1]}{f' ({ticker})' if ticker else ''}"}).encode())
+            else:
+                self._send(200, body)
+        else:
+            self._send(404, json.dumps({"error": f"Ruta no encontrada: {url.path}"}).encode())
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"HTTP {self.address_string()} {format % args}")
+
+def run_daemon():
+    """
+    Modo daemon (DAEMON_MODE=true): ejecuta los grupos de DAEMON_SCHEDULE en su horario y sirve sus
+    últimos contratos en http://DAEMON_HTTP_HOST:DAEMON_HTTP_PORT hasta recibir SIGINT o SIGTERM.
+    """
+    schedule = parse_daemon_schedule(os.getenv("DAEMON_SCHEDULE", DAEMON_DEFAULT_SCHEDULE))
+    quote_ttl = float(os.getenv("DAEMON_QUOTE_TTL_MINUTES", 10)) * 60
+    daily_ttl = float(os.getenv("DAEMON_DAILY_TTL_HOURS", 12)) * 3600
+    market_data_cache.clear()
+    # Precios y cadenas caducan pronto; vencimientos y barras diarias (screener, volatilidad histórica) duran horas
+    market_data_cache.ttls = {
+        "info": quote_ttl,
+        "option_chain": quote_ttl,
+        "options": float(os.getenv("DAEMON_EXPIRATIONS_TTL_HOURS", 12)) * 3600,
+        "history": daily_ttl,
+        "download": daily_ttl,
+    }
+    configure_market_data()
+    max_cycles = os.getenv("DAEMON_MAX_CYCLES")
+    daemon = ScannerDaemon(
+        schedule, ContractIndex(),
+        screener_ttl_seconds=float(os.getenv("DAEMON_SCREENER_TTL_HOURS", 12)) * 3600,
+        run_on_start=os.getenv("DAEMON_RUN_ON_START", "true").lower() == "true",
+        max_cycles=int(max_cycles) if max_cycles else None,
+        skip_closed_market=os.getenv("SKIP_WHEN_MARKET_CLOSED", "false").lower() == "true"
+    )
+    host = os.getenv("DAEMON_HTTP_HOST", "127.0.0.1")
+    port = int(os.getenv("DAEMON_HTTP_PORT", 8765))
+    server = ThreadingHTTPServer((host, port), ScannerRequestHandler)
+    server.daemon_threads = True
+    server.scanner_daemon = daemon
+    threading.Thread(target=server.serve_forever, name="daemon-http", daemon=True).start()
+    logger.info(f"Modo daemon: endpoint en http://{host}:{server.server_port}, grupos: {', '.join(schedule)}")
+    print(f"Modo daemon: endpoint en http://{host}:{server.server_port}, grupos: {', '.join(schedule)}")
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: daemon.stop_event.set())
+    try:
+        daemon.run()
+    finally:
+        server.shutdown()
+        server.server_close()
+        logger.info(f"Daemon detenido tras {daemon.cycles} ciclos")
+        print(f"Daemon detenido tras {daemon.cycles} ciclos")
+
+def main():
+    if os.getenv("DAEMON_MODE", "false").lower() == "true":
+        run_daemon()
+        return
+
+    # GROUP_TYPE admite un grupo, varios separados por comas o "all" para todos los grupos con universo disponible
+    group_type_env = os.getenv("GROUP_TYPE", "7magnificas")
+    if group_type_env.strip().lower() == "all":
+        group_types = [group_type for group_type in GROUPS_CONFIG if universe_available(group_type)]
+        skipped = [group_type for group_type in GROUPS_CONFIG if group_type not in group_types]
+        if skipped:
+            logger.info(f"Grupos omitidos por no encontrarse su archivo de constituyentes en {CONSTITUENTS_DIR}: {', '.join(skipped)}")
+            print(f"Grupos omitidos por no encontrarse su archivo de constituyentes en {CONSTITUENTS_DIR}: {', '.join(skipped)}")
+    else:
+        group_types = [group.strip() for group in group_type_env.split(",") if group.strip()]
+    for group_type in group_types:
+        if group_type not in GROUPS_CONFIG:
+            logger.error(f"Grupo {group_type} no encontrado")
+            print(f"Grupo {group_type} no encontrado")
+            return
+
+    # Comprobación previa, antes de importar pandas o yfinance: en fin de semana o festivo no hay sesión
+    if os.getenv("SKIP_WHEN_MARKET_CLOSED", "false").lower() == "true":
+        day = market_date()
+        reason = market_closed_reason(day)
+        if reason:
+            logger.info(f"Mercado cerrado el {day.isoformat()} ({reason}): no se ejecuta el análisis")
+            print(f"Mercado cerrado el {day.isoformat()} ({reason}): no se ejecuta el análisis")
+            return
+
+    # Solo se resuelve (y valida) la configuración de los grupos seleccionados
+    for group_type in group_types:
+        try:
+            group_config = GROUPS_CONFIG[group_type]
+        except ValueError as e:
+            logger.error(f"Configuración no válida para el grupo {group_type}: {e}")
+            print(f"Configuración no válida para el grupo {group_type}: {e}")
+            return
+        if "dynamic_source" not in group_config and not group_config["tickers"]:
+            logger.error(f"No se encontraron tickers para el grupo {group_type}")
+            print(f"No se encontraron tickers para el grupo {group_type}")
+    if all("dynamic_source" not in GROUPS_CONFIG[group_type] and not GROUPS_CONFIG[group_type]["tickers"] for group_type in group_types):
+        return
+
+    run_metrics.reset()
+    # Modo por shards: SHARD_COUNT con SHARD_INDEX ejecuta un shard (por ejemplo, uno por runner), SHARD_COUNT
+    # sin SHARD_INDEX lanza un proceso por shard y los combina, y SHARD_MERGE combina los shards ya ejecutados
+    shard_merge = os.getenv("SHARD_MERGE", "false").lower() == "true"
+    shard_count = int(os.getenv("SHARD_COUNT", 1))
+    shard_index = os.getenv("SHARD_INDEX", "")
+    if shard_merge or shard_count > 1:
+        shard_store = create_shard_store()
+        if shard_store is None:
+            return
+    if shard_merge:
+        merge_shards(group_types, shard_store)
+        return
+    if shard_count > 1 and not shard_index:
+        shard_store.clear(group_types)
+        run_shard_processes(shard_count, shard_store)
+        merge_shards(group_types, shard_store)
+        return
+    shard = None
+    if shard_count > 1:
+        if not 0 <= int(shard_index) < shard_count:
+            logger.error(f"SHARD_INDEX debe estar entre 0 y {shard_count - 1}: {shard_index}")
+            print(f"SHARD_INDEX debe estar entre 0 y {shard_count - 1}: {shard_index}")
+            return
+        shard = ShardRun(int(shard_index), shard_count, shard_store)
+
+    market_data_cache.clear()
+    if finnhub_client is not None:
+        finnhub_client.clear()
+    configure_market_data()
+    market_data_cache.archive = create_option_archive()
+
+    if shard is None:
+        finish_run(scan_groups(group_types))
+        return
+    tickers_by_group = scan_groups(group_types, shard.resolve_tickers, run=shard.run_group)
+    shard.close(group_types)
+    finish_run(
+        tickers_by_group, metrics_path=os.path.join(shard_store.root, f"metricas-shard-{shard.index}.json"),
+        shard={"index": shard.index, "count": shard.count}
+    )
 
 if __name__ == "__main__":
     main()
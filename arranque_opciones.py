@@ -0,0 +1,173 @@
+"""
+Benchmark del tiempo de importación y de arranque del analizador de opciones.
+
+Cada escenario se ejecuta en un intérprete nuevo (varias repeticiones, se toma la mediana) y mide el
+tiempo total del proceso, el de `import analizar_opciones_experimental` y el de la ejecución, además de
+qué módulos pesados (yfinance, pandas, numpy, requests, tabulate) quedan cargados. Los caminos rápidos
+(grupo no válido, mercado cerrado) no deben cargar ninguno: si alguno aparece, o un tiempo empeora por
+encima de la tolerancia respecto a la línea base, se informa como regresión y se sale con código 1.
+
+Uso:
+    python arranque_opciones.py
+    python arranque_opciones.py --repeticiones 10 --save-baseline
+    python arranque_opciones.py --importtime 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ["yfinance", "pandas", "numpy", "requests", "tabulate"]
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Código de cada proceso: importa el analizador, ejecuta la acción y escribe las medidas en la última línea
+SCENARIO_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import analizar_opciones_experimental as analizador
+imported = time.perf_counter()
+{action}
+end = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "run_ms": (end - imported) * 1000,
+    "heavy": [name for name in {heavy!r} if name in sys.modules]
+}}))
+"""
+
+# Escenario: (acción tras importar, variables de entorno, si debe evitar los módulos pesados)
+SCENARIOS = {
+    "importacion": ("pass", {}, True),
+    "grupo_no_valido": ("analizador.main()", {"GROUP_TYPE": "grupo_inexistente"}, True),
+    "mercado_cerrado": (
+        "from datetime import datetime, timezone\n"
+        "analizador.set_analysis_time(datetime(2026, 12, 25, 17, tzinfo=timezone.utc))\n"
+        "analizador.main()",
+        {"GROUP_TYPE": "7magnificas", "SKIP_WHEN_MARKET_CLOSED": "true"},
+        True
+    ),
+    # Referencia: lo que cuesta cargar las dependencias pesadas que los caminos rápidos evitan
+    "dependencias": (f"import {', '.join(HEAVY_MODULES)}", {}, False),
+}
+
+def child_env(extra):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SCRIPT_DIR, os.environ.get("PYTHONPATH")])))
+    for name in ("DAEMON_MODE", "SHARD_COUNT", "SHARD_INDEX", "SHARD_MERGE", "SKIP_WHEN_MARKET_CLOSED"):
+        env.pop(name, None)
+    env.update(extra)
+    return env
+
+def run_scenario(action, extra_env, repetitions, workdir):
+    """Ejecuta el escenario en procesos nuevos y retorna las medianas (ms) y los módulos pesados cargados."""
+    code = SCENARIO_CODE.format(action=action, heavy=HEAVY_MODULES)
+    process_ms, import_ms, run_ms, heavy = [], [], [], set()
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-c", code], env=child_env(extra_env), cwd=workdir,
+            capture_output=True, text=True, check=True
+        )
+        process_ms.append((time.perf_counter() - start) * 1000)
+        measures = json.loads(completed.stdout.strip().splitlines()[-1])
+        import_ms.append(measures["import_ms"])
+        run_ms.append(measures["run_ms"])
+        heavy.update(measures["heavy"])
+    return {
+        "proceso_ms": statistics.median(process_ms),
+        "importacion_ms": statistics.median(import_ms),
+        "ejecucion_ms": statistics.median(run_ms),
+        "modulos_pesados": sorted(heavy),
+    }
+
+def interpreter_ms(repetitions, workdir):
+    """Mediana del arranque de un intérprete vacío, para separarlo del coste del analizador."""
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], cwd=workdir, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def slowest_imports(top, workdir):
+    """Módulos con mayor tiempo acumulado de importación según `python -X importtime`."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import analizar_opciones_experimental"],
+        env=child_env({}), cwd=workdir, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative) / 1000, name))
+    return sorted(rows, reverse=True)[:top]
+
+def run_benchmark(repetitions):
+    with tempfile.TemporaryDirectory(prefix="arranque_") as workdir:
+        report = {"interprete_ms": interpreter_ms(repetitions, workdir), "repeticiones": repetitions, "escenarios": {}}
+        for name, (action, extra_env, _) in SCENARIOS.items():
+            report["escenarios"][name] = run_scenario(action, extra_env, repetitions, workdir)
+    return report
+
+def print_report(report, baseline=None, tolerance=0.3, slack_ms=10.0):
+    """Muestra el resultado y retorna las regresiones (módulos pesados cargados o tiempos peores que la línea base)."""
+    print(f"Intérprete vacío: {report['interprete_ms']:.0f} ms (mediana de {report['repeticiones']} procesos)")
+    header = f"{'Escenario':<17}{'Proceso (ms)':>14}{'Import (ms)':>13}{'Ejecución (ms)':>16}  Módulos pesados"
+    print(header)
+    print("-" * len(header))
+    regressions = []
+    for name, result in report["escenarios"].items():
+        line = f"{name:<17}{result['proceso_ms']:>14.0f}{result['importacion_ms']:>13.1f}{result['ejecucion_ms']:>16.1f}  {', '.join(result['modulos_pesados']) or '-'}"
+        if SCENARIOS[name][2] and result["modulos_pesados"]:
+            regressions.append(f"{name} (carga {', '.join(result['modulos_pesados'])})")
+        previous = (baseline or {}).get("escenarios", {}).get(name)
+        if previous and SCENARIOS[name][2]:
+            change = result["proceso_ms"] - previous["proceso_ms"]
+            line += f"  ({change / previous['proceso_ms']:+.0%} vs línea base)"
+            if change > previous["proceso_ms"] * tolerance and change > slack_ms:
+                regressions.append(f"{name} ({previous['proceso_ms']:.0f} -> {result['proceso_ms']:.0f} ms)")
+        print(line)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de importación y arranque del analizador de opciones")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Procesos por escenario (se toma la mediana)")
+    parser.add_argument("--importtime", type=int, metavar="N", help="Mostrar los N módulos más lentos de importar (-X importtime)")
+    parser.add_argument("--baseline", default="arranque_baseline.json", help="Archivo de línea base para comparar")
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar este resultado como nueva línea base")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Aumento relativo del tiempo de proceso que se considera regresión")
+    parser.add_argument("--slack-ms", type=float, default=10.0, help="Aumento absoluto mínimo (ms) para considerarlo regresión")
+    parser.add_argument("--output", help="Guardar el resultado completo en este archivo JSON")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(max(1, args.repeticiones))
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, args.tolerance, args.slack_ms)
+
+    if args.importtime:
+        with tempfile.TemporaryDirectory(prefix="arranque_") as workdir:
+            print("\nMódulos más lentos de importar (acumulado, ms):")
+            for milliseconds, name in slowest_imports(args.importtime, workdir):
+                print(f"  {milliseconds:8.1f}  {name}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Línea base guardada en {args.baseline}")
+    if regressions:
+        print(f"Regresiones: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Backtest de las reglas de filtrado y alerta sobre el archivo histórico de cadenas (ARCHIVE_DIR).
+
+Lee las cadenas archivadas por analizar_opciones_experimental.py en un rango de fechas, aplica con la
+configuración de un grupo los mismos filtros de contratos que get_option_data_yahoo
+(filter_option_contracts) y la misma selección de alertas que el análisis (rank_contracts), toma cada
+contrato la primera vez que habría alertado y lo liquida al vencimiento contra el último precio del
+subyacente archivado ese día o en los anteriores (como put vendido con garantía en efectivo al bid).
+
+La lectura usa Arrow con memoria mapeada, solo las particiones de fecha y las columnas necesarias y
+los filtros simples de la configuración (bid, IV, volumen...) evaluados al leer, de modo que un año de
+cadenas del NASDAQ-100 se procesa en segundos en una sola máquina.
+
+Uso:
+    python backtest_opciones.py --archive .archivo --group nasdaq_top_volatility
+    python backtest_opciones.py --archive .archivo --desde 2026-01-01 --hasta 2026-06-30 --set ALERTA_RENTABILIDAD_ANUAL=55
+    python backtest_opciones.py --archive .archivo --set MIN_DIFERENCIA_PORCENTUAL=5 --output operaciones.csv
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import analizar_opciones_experimental as analizador
+
+# Columnas de las cadenas que lee el backtest
+CHAIN_COLUMNS = ["ticker", "expiration", "strike", "bid", "lastPrice", "volume", "openInterest", "impliedVolatility", "scanned_at"]
+# Tablas del archivo histórico que necesita el backtest
+ARCHIVE_TABLES = ["chains", "underlying"]
+# Columnas principales de las operaciones, para el resultado vacío cuando no hay fechas archivadas en el rango
+TRADE_COLUMNS = [
+    "ticker", "scanned_at", "expiration", "strike", "bid", "days_to_expiration", "settle_price", "settled_at",
+    "assigned", "pnl", "return_pct", "annualized_pct"
+]
+
+def check_archive(parser, root):
+    """Termina con un error del parser si falta pyarrow o alguna tabla del archivo histórico en root."""
+    try:
+        import pyarrow  # noqa: F401  (lectura del archivo histórico)
+    except ImportError:
+        parser.error("leer el archivo histórico requiere pyarrow, que no está instalado")
+    missing = [name for name in ARCHIVE_TABLES if not os.path.isdir(os.path.join(root, name))]
+    if missing:
+        parser.error(f"no se encontró el archivo histórico en {root} (faltan {', '.join(missing)})")
+
+def open_dataset(root, name):
+    """Dataset Arrow de una de las tablas del archivo (chains o underlying), con memoria mapeada."""
+    # pyarrow se importa al leer el archivo, para que barrido_opciones.py funcione sin él cuando no lo usa
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+    return ds.dataset(
+        os.path.join(root, name),
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive"),
+        filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+
+def _at_least(column, minimum):
+    # Igual que en filter_option_contracts, un valor ausente no descarta el contrato
+    import pyarrow.dataset as ds
+    field = ds.field(column)
+    return (field >= minimum) | field.is_null(nan_is_null=True)
+
+def archived_dates(root, start=None, end=None):
+    """Fechas de escaneo archivadas (particiones date=YYYY-MM-DD) entre start y end, inclusivas."""
+    dates = sorted(
+        name[len("date="):] for name in os.listdir(os.path.join(root, "chains")) if name.startswith("date=")
+    )
+    return [date for date in dates if (not start or date >= start) and (not end or date <= end)]
+
+def load_chains(root, config, dates):
+    """
+    Puts archivados en las fechas de escaneo `dates`, leyendo solo esas particiones y las columnas de
+    CHAIN_COLUMNS, y descartando al leer los que no superan los filtros simples del grupo.
+    """
+    import pyarrow.dataset as ds
+    condition = ds.field("date").isin(dates) & (ds.field("type") == "put") & _at_least("bid", config["MIN_BID"])
+    condition &= _at_least("impliedVolatility", config["MIN_VOLATILIDAD_IMPLICITA"] / 100)
+    condition &= (ds.field("lastPrice") > 0) | ds.field("lastPrice").is_null(nan_is_null=True)
+    condition &= _at_least("volume", config["MIN_VOLUMEN"])
+    condition &= _at_least("openInterest", config["MIN_OPEN_INTEREST"])
+    return open_dataset(root, "chains").to_table(columns=CHAIN_COLUMNS, filter=condition).to_pandas()
+
+def load_underlying(root):
+    """Precios archivados del subyacente: ticker, price y scanned_at."""
+    return open_dataset(root, "underlying").to_table(columns=["ticker", "price", "scanned_at"]).to_pandas()
+
+def _expiration_dates(expiration):
+    """Convierte la columna de vencimientos ('YYYY-MM-DD', categórica) a fechas, una vez por categoría."""
+    expiration = expiration.astype("category")
+    categories = pd.to_datetime(expiration.cat.categories)
+    return pd.Series(categories.take(expiration.cat.codes.to_numpy()), index=expiration.index)
+
+def archived_contracts(chains, underlying, config):
+    """
+    Aplica los filtros de contratos del grupo a las cadenas archivadas, con el precio del subyacente de
+    su propia ejecución. Retorna (contratos filtrados con ticker, scanned_at, price y type, descartes por filtro).
+    """
+    prices = underlying.drop_duplicates(["ticker", "scanned_at"], keep="last")
+    chains = chains.astype({"ticker": str}).merge(prices, on=["ticker", "scanned_at"], how="inner")
+    # Mismo cálculo que en el análisis: días completos desde el instante del escaneo
+    chains["days_to_expiration"] = (_expiration_dates(chains["expiration"]) - chains["scanned_at"]).dt.days
+    chains = chains[(chains["days_to_expiration"] > 0) & (chains["days_to_expiration"] <= config["MAX_DIAS_VENCIMIENTO"])]
+    chains = chains.reset_index(drop=True)
+
+    filtered, rejections = analizador.filter_option_contracts(
+        chains, chains["price"], config, is_call=False, keep_columns=["ticker", "scanned_at", "price"]
+    )
+    filtered["type"] = "put"
+    return filtered, rejections
+
+def replay_alerts(chains, underlying, config):
+    """
+    Aplica los filtros y la selección de alertas del grupo a cada ejecución archivada.
+    Retorna (contratos que habrían alertado, descartes por filtro).
+    """
+    filtered, rejections = archived_contracts(chains, underlying, config)
+    _, alerts = analizador.rank_contracts(filtered, config, group_by=["scanned_at", "ticker", "type"])
+    return alerts, rejections
+
+def settle_trades(alerts, underlying, tolerance_days=3):
+    """
+    Toma cada contrato en su primera alerta y lo liquida con el último precio archivado del subyacente
+    en el día de vencimiento o hasta tolerance_days días antes. Los contratos sin ese precio (aún no
+    vencidos o sin escaneos cerca del vencimiento) quedan sin liquidar (settle_price NaN).
+    """
+    trades = alerts.sort_values("scanned_at", kind="stable").drop_duplicates(["ticker", "expiration", "strike"])
+    trades = trades.assign(settle_at=_expiration_dates(trades["expiration"]) + pd.Timedelta(days=1))
+    settlements = underlying.rename(columns={"price": "settle_price", "scanned_at": "settled_at"})
+    trades = pd.merge_asof(
+        trades.sort_values("settle_at"),
+        settlements.sort_values("settled_at"),
+        left_on="settle_at", right_on="settled_at", by="ticker",
+        direction="backward", allow_exact_matches=False, tolerance=pd.Timedelta(days=tolerance_days + 1)
+    )
+    # El precio de liquidación debe ser posterior a la entrada
+    trades.loc[trades["settled_at"] <= trades["scanned_at"], "settle_price"] = np.nan
+
+    premium = trades["bid"]
+    payoff = np.maximum(trades["strike"] - trades["settle_price"], 0)
+    trades["assigned"] = trades["settle_price"] < trades["strike"]
+    trades["pnl"] = premium - payoff
+    trades["return_pct"] = trades["pnl"] / trades["strike"] * 100
+    trades["annualized_pct"] = trades["return_pct"] * 365 / trades["days_to_expiration"]
+    return trades.sort_values(["scanned_at", "ticker", "expiration", "strike"]).reset_index(drop=True)
+
+def summarize(trades):
+    """Resumen de las operaciones liquidadas (resultado por acción; x100 por contrato)."""
+    settled = trades[trades["settle_price"].notna()]
+    summary = {
+        "alerts": int(len(trades)),
+        "settled": int(len(settled)),
+        "open_or_unpriced": int(len(trades) - len(settled)),
+    }
+    if settled.empty:
+        return summary
+    summary.update({
+        "win_rate_pct": float((settled["pnl"] > 0).mean() * 100),
+        "assigned_pct": float(settled["assigned"].mean() * 100),
+        "total_pnl_per_contract": float(settled["pnl"].sum() * 100),
+        "mean_return_pct": float(settled["return_pct"].mean()),
+        "mean_annualized_pct": float(settled["annualized_pct"].mean()),
+        "worst_return_pct": float(settled["return_pct"].min()),
+    })
+    return summary
+
+def run_backtest(root, config, start=None, end=None, tolerance_days=3, chunk_days=20):
+    """
+    Ejecuta el backtest completo; retorna (operaciones, resumen con los tiempos de cada etapa).
+    Las alertas de una ejecución solo dependen de sus propias cadenas, así que el archivo se procesa por
+    bloques de chunk_days fechas de escaneo y de cada bloque solo se conservan las alertas: la memoria
+    no crece con la longitud del periodo.
+    """
+    timings = {"lectura": 0.0, "filtros_y_alertas": 0.0}
+    underlying = load_underlying(root)
+    dates = archived_dates(root, start, end)
+    alerts, rejections = [], {}
+    contracts_read = 0
+    scans = set()
+    for first in range(0, len(dates), chunk_days):
+        begin = time.perf_counter()
+        chains = load_chains(root, config, dates[first:first + chunk_days])
+        timings["lectura"] += time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        contracts_read += len(chains)
+        scans.update(chains["scanned_at"].unique())
+        chunk_alerts, chunk_rejections = replay_alerts(chains, underlying, config)
+        alerts.append(chunk_alerts)
+        for name, count in chunk_rejections.items():
+            rejections[name] = rejections.get(name, 0) + count
+        timings["filtros_y_alertas"] += time.perf_counter() - begin
+        del chains
+
+    begin = time.perf_counter()
+    if alerts:
+        trades = settle_trades(pd.concat(alerts, ignore_index=True), underlying, tolerance_days)
+    else:
+        # Ninguna fecha de escaneo archivada en el rango: sin operaciones
+        trades = pd.DataFrame(columns=TRADE_COLUMNS)
+    timings["liquidacion"] = time.perf_counter() - begin
+
+    summary = summarize(trades)
+    summary["contracts_read"] = int(contracts_read)
+    summary["scans"] = len(scans)
+    summary["rejections"] = rejections
+    summary["seconds"] = timings
+    return trades, summary
+
+def parse_override(text):
+    """KEY=VALUE de --set; el valor se interpreta como JSON (números, true/false, null) o como texto."""
+    key, _, value = text.partition("=")
+    key = key.strip()
+    if key not in analizador.BASE_CONFIG:
+        raise argparse.ArgumentTypeError(f"Parámetro desconocido: {key}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+def print_summary(summary):
+    print(f"Contratos leídos: {summary['contracts_read']:,} en {summary['scans']} ejecuciones archivadas")
+    print(f"Alertas (primera por contrato): {summary['alerts']}, liquidadas: {summary['settled']}, "
+          f"sin liquidar: {summary['open_or_unpriced']}")
+    if summary["settled"]:
+        print(f"Operaciones ganadoras: {summary['win_rate_pct']:.1f}%, asignadas: {summary['assigned_pct']:.1f}%")
+        print(f"Resultado total: ${summary['total_pnl_per_contract']:,.2f} por contrato")
+        print(f"Rentabilidad media: {summary['mean_return_pct']:.2f}% ({summary['mean_annualized_pct']:.1f}% anualizada), "
+              f"peor operación: {summary['worst_return_pct']:.2f}%")
+    print("Tiempos: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in summary["seconds"].items()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest de las reglas de alerta sobre el archivo histórico de cadenas")
+    parser.add_argument("--archive", default=os.getenv("ARCHIVE_DIR", ".archivo"), help="Directorio del archivo histórico")
+    parser.add_argument("--group", default="nasdaq_top_volatility", choices=sorted(analizador.GROUPS_CONFIG), help="Grupo cuya configuración se aplica")
+    parser.add_argument("--desde", help="Primera fecha de escaneo (YYYY-MM-DD)")
+    parser.add_argument("--hasta", help="Última fecha de escaneo (YYYY-MM-DD)")
+    parser.add_argument("--set", dest="overrides", action="append", type=parse_override, default=[],
+                        metavar="CLAVE=VALOR", help="Sustituye un parámetro de la configuración del grupo")
+    parser.add_argument("--tolerancia-dias", type=int, default=3, help="Días antes del vencimiento en que aún vale el último precio archivado")
+    parser.add_argument("--output", help="Guardar las operaciones en este CSV")
+    parser.add_argument("--json", help="Guardar el resumen en este archivo JSON")
+    args = parser.parse_args(argv)
+    check_archive(parser, args.archive)
+
+    logging.getLogger(analizador.__name__).setLevel(logging.WARNING)
+    config = dict(analizador.GROUPS_CONFIG[args.group]["config"])
+    config.update(dict(args.overrides))
+    if analizador.config_value(config, "FUENTE_VOLATILIDAD") != "yahoo":
+        print("Aviso: el backtest usa la IV archivada de Yahoo; FUENTE_VOLATILIDAD se ignora")
+
+    trades, summary = run_backtest(args.archive, config, args.desde, args.hasta, args.tolerancia_dias)
+    if not summary["scans"]:
+        print(f"Aviso: no hay cadenas archivadas entre {args.desde or 'el inicio'} y {args.hasta or 'el final'}")
+    print_summary(summary)
+    if args.output:
+        trades.to_csv(args.output, index=False)
+        print(f"Operaciones guardadas en {args.output}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+Barrido de parámetros de un grupo: evalúa miles de configuraciones de filtros y alertas de una vez.
+
+Las cadenas se obtienen una sola vez, descargadas como en el análisis (o de una grabación en modo
+replay) o leídas del archivo histórico (ARCHIVE_DIR), y se filtran con la configuración más permisiva
+de la rejilla. Después cada valor de cada parámetro barrido se evalúa una única vez como máscara
+booleana sobre esos contratos. La máscara de una configuración es el AND de las máscaras de sus
+valores. La selección de alertas de rank_contracts (los TOP_CONTRATOS mejores por ticker) se resuelve
+con sumas acumuladas por ticker sobre bloques de configuraciones, sin volver a filtrar ni a ordenar.
+Cada bloque solo recorre los contratos que pueden alertar en alguna de sus configuraciones. Con una
+sola ejecución (un grupo descargado), miles de configuraciones tardan menos de un segundo. El coste
+crece con contratos x configuraciones: un año de archivo tarda minutos, así que conviene acotarlo
+con --desde/--hasta.
+
+Para cada configuración informa:
+- los contratos que superan los filtros;
+- las alertas y los tickers con alerta;
+- la rentabilidad de las alertas;
+- la estabilidad de las alertas frente a las de la configuración actual del grupo.
+
+Uso:
+    python barrido_opciones.py --group 7magnificas --grid MIN_BID=0.5:1.5:0.25 --grid ALERTA_RENTABILIDAD_ANUAL=40:80:5
+    python barrido_opciones.py --archive .archivo --desde 2026-06-01 --grid MIN_DIFERENCIA_PORCENTUAL=3,5,8 --output barrido.csv
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import analizar_opciones_experimental as analizador
+import backtest_opciones as backtest
+
+# Parámetros que admite la rejilla: (columna del contrato, "min" o "max", es regla de alerta)
+SWEEP_PARAMETERS = {
+    "MIN_BID": ("bid", "min", False),
+    "MIN_VOLATILIDAD_IMPLICITA": ("implied_volatility", "min", False),
+    "MIN_VOLUMEN": ("volume", "min", False),
+    "MIN_OPEN_INTEREST": ("open_interest", "min", False),
+    "MIN_DIFERENCIA_PORCENTUAL": ("percent_diff", "min", False),
+    "MIN_RENTABILIDAD_ANUAL": ("rentabilidad_anual", "min", False),
+    "MAX_DIAS_VENCIMIENTO": ("days_to_expiration", "max", False),
+    "MAX_DELTA": ("abs_delta", "max", False),
+    "MIN_PROB_OTM": ("prob_otm", "min", False),
+    "ALERTA_RENTABILIDAD_ANUAL": ("rentabilidad_anual", "min", True),
+    "ALERTA_VOLATILIDAD_MINIMA": ("implied_volatility", "min", True),
+    "ALERTA_MAX_DELTA": ("abs_delta", "max", True),
+    "ALERTA_MIN_PROB_OTM": ("prob_otm", "min", True),
+}
+# TOP_CONTRATOS también se puede barrer: no es una máscara sino el límite de alertas por ticker
+GRID_PARAMETERS = list(SWEEP_PARAMETERS) + ["TOP_CONTRATOS"]
+
+# Columnas de los contratos que usa el barrido (además de las que identifican el ticker)
+SWEEP_COLUMNS = [
+    "bid", "implied_volatility", "volume", "open_interest", "percent_diff", "rentabilidad_anual",
+    "days_to_expiration", "delta", "prob_otm",
+]
+
+# Columnas de estadísticas de la tabla del barrido
+STAT_COLUMNS = [
+    "candidatos", "alertas", "tickers_con_alerta", "rentabilidad_media", "diferencia_media", "estabilidad_alertas", "estabilidad_top1",
+]
+
+# Configuraciones consecutivas de la rejilla que comparten la poda de contratos y celdas
+# (configuraciones x contratos) de cada sub-bloque, que acotan la memoria de las máscaras
+CONFIGS_PER_BLOCK = 64
+MAX_BLOCK_CELLS = 20_000_000
+
+def parameter_mask(values, bound, is_alert, threshold):
+    """Contratos que cumplen un umbral (None: el filtro o la regla no se aplica)."""
+    if threshold is None:
+        return np.ones(len(values), dtype=bool)
+    if is_alert:
+        return values >= threshold if bound == "min" else values <= threshold
+    # Como en filter_option_contracts, una comparación con NaN no descarta el contrato
+    return ~(values < threshold) if bound == "min" else ~(values > threshold)
+
+def loosest_config(config, grid):
+    """
+    Configuración con el valor más permisivo de cada filtro entre la rejilla y la configuración actual:
+    todo contrato que supere los filtros de alguna configuración de la rejilla la supera.
+    """
+    loosest = dict(config)
+    for name, values in grid.items():
+        if name not in SWEEP_PARAMETERS or SWEEP_PARAMETERS[name][2]:
+            continue
+        bound = SWEEP_PARAMETERS[name][1]
+        candidates = list(values) + [analizador.config_value(config, name)]
+        if None in candidates:
+            loosest[name] = None
+        else:
+            loosest[name] = min(candidates) if bound == "min" else max(candidates)
+    return loosest
+
+class ParameterSweep:
+    """
+    Evalúa una rejilla de configuraciones sobre un conjunto fijo de contratos, filtrados con
+    loosest_config. group_keys identifican un ticker en una ejecución: dentro de cada grupo se toman
+    los TOP_CONTRATOS alertas, en el mismo orden que rank_contracts.
+    Las máscaras se guardan por configuración (configuraciones x contratos), de modo que cada
+    configuración de un bloque es una fila contigua.
+    """
+
+    def __init__(self, contracts, config, group_keys=("ticker", "type")):
+        self.config = config
+        group_id = contracts.groupby(list(group_keys), observed=True, sort=False).ngroup().to_numpy()
+        # Orden de rank_contracts dentro de cada ticker: rentabilidad anual (desc), días (asc), diferencia % (desc)
+        order = np.lexsort((
+            -contracts["percent_diff"].to_numpy(dtype=float),
+            contracts["days_to_expiration"].to_numpy(dtype=float),
+            -contracts["rentabilidad_anual"].to_numpy(dtype=float),
+            group_id,
+        ))
+        self.columns = {column: contracts[column].to_numpy(dtype=float)[order] for column in SWEEP_COLUMNS}
+        self.columns["abs_delta"] = np.abs(self.columns["delta"])
+        self.group_id = group_id[order]
+        self.contracts = len(order)
+
+    def _mask(self, name, threshold):
+        column, bound, is_alert = SWEEP_PARAMETERS[name]
+        return parameter_mask(self.columns[column], bound, is_alert, threshold)
+
+    def _fixed_masks(self, swept):
+        """Máscaras (filtros, alertas) de los parámetros que no se barren, con su valor en la configuración."""
+        passing = np.ones(self.contracts, dtype=bool)
+        alert = np.ones(self.contracts, dtype=bool)
+        for name, (_, _, is_alert) in SWEEP_PARAMETERS.items():
+            if name in swept:
+                continue
+            mask = self._mask(name, analizador.config_value(self.config, name))
+            if is_alert:
+                alert &= mask
+            else:
+                passing &= mask
+        return passing, alert
+
+    @staticmethod
+    def _group_starts(group_id):
+        """Primera fila de cada ticker (las filas de un ticker son consecutivas)."""
+        return np.flatnonzero(np.concatenate([[True], group_id[1:] != group_id[:-1]])) if len(group_id) else np.array([], dtype=np.intp)
+
+    @staticmethod
+    def _rank(alerts, starts):
+        """
+        Posición de cada contrato entre las alertas de su ticker (configuraciones x contratos), contándolo
+        a él mismo, y alertas por ticker.
+        """
+        if not alerts.shape[1]:
+            return np.zeros(alerts.shape, dtype=np.uint16), np.zeros((alerts.shape[0], 0), dtype=np.int32)
+        per_group = np.add.reduceat(alerts, starts, axis=1, dtype=np.int32)
+        # Al empezar cada ticker se restan las alertas del anterior, así la suma acumulada cuenta las del
+        # propio ticker; en uint16 los desbordamientos se cancelan mientras un ticker tenga < 65536 contratos
+        steps = alerts.astype(np.uint16)
+        steps[:, starts[1:]] -= per_group[:, :-1].astype(np.uint16)
+        return np.cumsum(steps, axis=1, dtype=np.uint16), per_group
+
+    @classmethod
+    def _select(cls, alerts, starts, top_n):
+        """
+        Alertas (configuraciones x contratos) que están entre las top_n primeras de su ticker.
+        Retorna (alertas seleccionadas, primera alerta de cada ticker, alertas por ticker).
+        """
+        rank, per_group = cls._rank(alerts, starts)
+        return alerts & (rank <= np.reshape(top_n, (-1, 1))), alerts & (rank == 1), per_group
+
+    def _block_rows(self, chunk, swept, alert_masks, group_id, top_n):
+        """
+        Contratos que pueden alertar en alguna configuración del bloque: los que alertan con sus valores
+        más permisivos y, en cada ticker, solo hasta que acumula max(top_n) contratos que cumplen sus
+        valores más estrictos (esos alertan en todas las configuraciones del bloque, así que los
+        siguientes ya no pueden entrar entre las alertas de ninguna).
+        """
+        loosest = np.ones(len(group_id), dtype=bool)
+        strictest = np.ones(len(group_id), dtype=bool)
+        for position, name in swept:
+            used = alert_masks[name][np.unique(chunk[:, position])]
+            loosest &= used.any(axis=0)
+            strictest &= used.all(axis=0)
+        strictest_rank, _ = self._rank(strictest[None, :], self._group_starts(group_id))
+        return np.flatnonzero(loosest & ((strictest_rank[0] - strictest) < np.max(top_n)))
+
+    def evaluate(self, grid, max_cells=MAX_BLOCK_CELLS):
+        """
+        Evalúa el producto cartesiano de la rejilla ({parámetro: [valores]}). Retorna un DataFrame
+        con una fila por configuración: los valores barridos y sus estadísticas.
+        """
+        names = list(grid)
+        values = [list(grid[name]) for name in names]
+        indices = np.array(list(itertools.product(*[range(len(v)) for v in values])), dtype=np.intp).reshape(-1, len(names))
+        swept = [(position, name) for position, name in enumerate(names) if name in SWEEP_PARAMETERS]
+        masks = {name: np.vstack([self._mask(name, value) for value in grid[name]]) for _, name in swept}
+        fixed_passing, fixed_alert = self._fixed_masks(names)
+        top_values = np.array(grid.get("TOP_CONTRATOS", [self.config["TOP_CONTRATOS"]]))
+        if "TOP_CONTRATOS" in grid:
+            top_n = top_values[indices[:, names.index("TOP_CONTRATOS")]]
+        else:
+            top_n = np.repeat(top_values, len(indices))
+
+        # Alertas con la configuración actual, para la estabilidad
+        current_passing, current_alert = self._fixed_masks(())
+        current = (current_passing & current_alert)[None, :]
+        current_top, current_first, _ = self._select(current, self._group_starts(self.group_id), self.config["TOP_CONTRATOS"])
+        current_top, current_first = current_top[0], current_first[0]
+
+        # Los umbrales de un parámetro son anidados, así que sus máscaras en un contrato dependen solo de
+        # cuántos valores supera. Los contratos con los mismos niveles en todos los filtros son equivalentes
+        # para contar candidatos: se cuentan una vez por combinación de niveles
+        levels = fixed_passing.astype(np.int64)
+        for _, name in swept:
+            if not SWEEP_PARAMETERS[name][2]:
+                levels = levels * (len(grid[name]) + 1) + masks[name].sum(axis=0)
+        _, representatives, repeats = np.unique(levels, return_index=True, return_counts=True)
+        candidate_masks = {name: mask[:, representatives] for name, mask in masks.items() if not SWEEP_PARAMETERS[name][2]}
+
+        # Las alertas se calculan solo sobre los contratos que alertan en alguna configuración
+        eligible = fixed_passing & fixed_alert
+        for _, name in swept:
+            eligible &= masks[name].any(axis=0)
+        eligible = np.flatnonzero(eligible)
+        alert_masks = {name: mask[:, eligible] for name, mask in masks.items()}
+        group_id = self.group_id[eligible]
+        weights = np.nan_to_num(np.column_stack([
+            self.columns["rentabilidad_anual"][eligible], self.columns["percent_diff"][eligible]
+        ])).astype(np.float32)
+
+        stats = []
+        for first in range(0, len(indices), CONFIGS_PER_BLOCK):
+            block = indices[first:first + CONFIGS_PER_BLOCK]
+            block_top_n = top_n[first:first + CONFIGS_PER_BLOCK]
+            rows = self._block_rows(block, swept, alert_masks, group_id, block_top_n)
+            starts = self._group_starts(group_id[rows])
+            row_masks = {name: mask[:, rows] for name, mask in alert_masks.items()}
+            block_current_top = current_top[eligible[rows]]
+            block_current_first = current_first[eligible[rows]]
+            # Sub-bloques para acotar la memoria de las máscaras (configuraciones x contratos)
+            step = max(1, int(max_cells // max(len(rows), 1)))
+            for offset in range(0, len(block), step):
+                chunk = block[offset:offset + step]
+                candidates = np.repeat(fixed_passing[representatives][None, :], len(chunk), axis=0)
+                alerts = np.ones((len(chunk), len(rows)), dtype=bool)
+                for position, name in swept:
+                    alerts &= row_masks[name][chunk[:, position]]
+                    if name in candidate_masks:
+                        candidates &= candidate_masks[name][chunk[:, position]]
+                top, first_alerts, per_group = self._select(alerts, starts, block_top_n[offset:offset + step])
+
+                alert_count = top.sum(axis=1)
+                yield_sum, diff_sum = (top.astype(np.float32) @ weights[rows]).T
+                # Estabilidad: índice de Jaccard entre las alertas (o la primera alerta de cada ticker) y las actuales
+                overlap = (top & block_current_top).sum(axis=1)
+                first_overlap = (first_alerts & block_current_first).sum(axis=1)
+                first_count = first_alerts.sum(axis=1)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    stats.append(pd.DataFrame({
+                        "candidatos": candidates.astype(np.int64) @ repeats,
+                        "alertas": alert_count,
+                        "tickers_con_alerta": (per_group > 0).sum(axis=1),
+                        "rentabilidad_media": yield_sum / alert_count,
+                        "diferencia_media": diff_sum / alert_count,
+                        "estabilidad_alertas": overlap / (alert_count + current_top.sum() - overlap),
+                        "estabilidad_top1": first_overlap / (first_count + current_first.sum() - first_overlap),
+                    }))
+        table = pd.concat(stats, ignore_index=True)
+        for position, name in enumerate(names):
+            table.insert(position, name, [values[position][i] for i in indices[:, position]])
+        return table
+
+def fetched_contracts(group_type, config):
+    """
+    Descarga una sola vez las cadenas de los tickers del grupo, como el análisis (con la misma fuente:
+    Yahoo y Finnhub, replay y snapshots), y retorna sus contratos filtrados con config.
+    """
+    cache = analizador.market_data_cache
+    cache.clear()
+    cache.provider = analizador.create_market_data_provider()
+    cache.scheduler = analizador.create_request_scheduler()
+    # Como en configure_market_data, en replay no se usan snapshots para que el resultado sea determinista
+    cache.snapshot_store = analizador.create_snapshot_store() if cache.provider.name != "replay" else None
+    if cache.provider.name == "replay":
+        analizador.set_analysis_time(cache.provider.recorded_at())
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        tickers = analizador.resolve_group_tickers(group_type)
+        with ThreadPoolExecutor(max_workers=max(1, analizador.MAX_WORKERS)) as executor:
+            batches = list(analizador.map_requeuing_throttled(
+                executor, lambda ticker: analizador.analyze_ticker(ticker, config), tickers,
+                lambda ticker, error: analizador.empty_contract_batch()
+            ))
+    return analizador.concat_contract_batches(batches), len(tickers)
+
+def archived_sweep_contracts(root, config, start=None, end=None, chunk_days=20):
+    """Contratos archivados entre start y end filtrados con config, con la ejecución (scanned_at) de cada uno."""
+    underlying = backtest.load_underlying(root)
+    dates = backtest.archived_dates(root, start, end)
+    contracts = []
+    scans = set()
+    for first in range(0, len(dates), chunk_days):
+        chains = backtest.load_chains(root, config, dates[first:first + chunk_days])
+        scans.update(chains["scanned_at"].unique())
+        filtered, _ = backtest.archived_contracts(chains, underlying, config)
+        contracts.append(filtered[["scanned_at", "ticker", "type"] + SWEEP_COLUMNS])
+    if not contracts:
+        return pd.DataFrame(columns=["scanned_at", "ticker", "type"] + SWEEP_COLUMNS), 0
+    return pd.concat(contracts, ignore_index=True), len(scans)
+
+def parse_grid(text):
+    """
+    CLAVE=valores de --grid: una lista separada por comas (0.5,0.75,1) o un rango inicio:fin:paso con
+    el fin incluido (0.5:1.5:0.25). Los valores se interpretan como JSON; null desactiva un filtro opcional.
+    """
+    key, _, spec = text.partition("=")
+    key = key.strip()
+    if key not in GRID_PARAMETERS:
+        raise argparse.ArgumentTypeError(f"Parámetro no barrible: {key} (admitidos: {', '.join(GRID_PARAMETERS)})")
+    try:
+        if ":" in spec:
+            start, stop, step = (float(part) for part in spec.split(":"))
+            values = [round(value, 10) for value in np.arange(start, stop + step / 2, step)]
+        else:
+            values = [json.loads(part) for part in spec.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Valores no válidos para {key}: {spec}")
+    if not values or (None in values and analizador.BASE_CONFIG[key] is not None):
+        raise argparse.ArgumentTypeError(f"Valores no válidos para {key}: {spec}")
+    return key, values
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Barrido vectorizado de los parámetros de filtros y alertas de un grupo")
+    parser.add_argument("--group", default="nasdaq_top_volatility", choices=sorted(analizador.GROUPS_CONFIG), help="Grupo cuya configuración y tickers se usan")
+    parser.add_argument("--archive", help="Leer las cadenas del archivo histórico en lugar de descargarlas")
+    parser.add_argument("--desde", help="Primera fecha de escaneo del archivo (YYYY-MM-DD)")
+    parser.add_argument("--hasta", help="Última fecha de escaneo del archivo (YYYY-MM-DD)")
+    parser.add_argument("--grid", action="append", type=parse_grid, default=[], metavar="CLAVE=VALORES",
+                        help="Valores a barrer de un parámetro: lista (a,b,c) o rango (inicio:fin:paso)")
+    parser.add_argument("--set", dest="overrides", action="append", type=backtest.parse_override, default=[],
+                        metavar="CLAVE=VALOR", help="Sustituye un parámetro fijo de la configuración del grupo")
+    parser.add_argument("--ordenar", default="rentabilidad_media", help="Columna por la que ordenar la tabla (descendente)")
+    parser.add_argument("--mostrar", type=int, default=15, help="Configuraciones a mostrar")
+    parser.add_argument("--output", help="Guardar la tabla completa en este CSV")
+    args = parser.parse_args(argv)
+    if not args.grid:
+        parser.error("indica al menos un --grid")
+    if args.ordenar not in GRID_PARAMETERS + STAT_COLUMNS:
+        parser.error(f"--ordenar debe ser un parámetro o una de: {', '.join(STAT_COLUMNS)}")
+
+    logging.getLogger(analizador.__name__).setLevel(logging.WARNING)
+    config = dict(analizador.GROUPS_CONFIG[args.group]["config"])
+    config.update(dict(args.overrides))
+    grid = dict(args.grid)
+    loosest = loosest_config(config, grid)
+
+    begin = time.perf_counter()
+    if args.archive:
+        backtest.check_archive(parser, args.archive)
+        if analizador.config_value(config, "FUENTE_VOLATILIDAD") != "yahoo":
+            print("Aviso: el archivo contiene la IV de Yahoo; FUENTE_VOLATILIDAD se ignora")
+        contracts, scans = archived_sweep_contracts(args.archive, loosest, args.desde, args.hasta)
+        sweep = ParameterSweep(contracts, config, group_keys=("scanned_at", "ticker", "type"))
+        source = f"{scans} ejecuciones archivadas"
+    else:
+        contracts, tickers = fetched_contracts(args.group, loosest)
+        sweep = ParameterSweep(contracts, config)
+        source = f"{tickers} tickers descargados"
+    loading = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    table = sweep.evaluate(grid)
+    current = sweep.evaluate({name: [analizador.config_value(config, name)] for name in grid})
+    evaluation = time.perf_counter() - begin
+
+    print(f"Contratos candidatos: {sweep.contracts:,} de {source} (carga {loading:.2f}s)")
+    print(f"{len(table):,} configuraciones evaluadas en {evaluation:.2f}s")
+    print("\nConfiguración actual:")
+    print(current.to_string(index=False))
+    table = table.sort_values(args.ordenar, ascending=False, kind="stable")
+    print(f"\nMejores {min(args.mostrar, len(table))} configuraciones por {args.ordenar}:")
+    print(table.head(args.mostrar).to_string(index=False))
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f"\nTabla guardada en {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
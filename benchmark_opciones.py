@@ -0,0 +1,317 @@
+"""
+Benchmark de extremo a extremo del analizador de opciones con cadenas sintéticas.
+
+Genera un universo sintético de tamaño configurable (tickers x vencimientos x strikes), lo sirve a
+través de la interfaz MarketDataProvider sin red y mide por separado cada etapa del pipeline:
+screener (generate_dynamic_tickers), filtrado de contratos (get_option_data_yahoo), ranking y
+selección de alertas (rank_contracts) y generación de reportes y CSV. Para cada etapa informa el
+tiempo, el throughput (contratos por segundo) y el pico de memoria, y compara con una línea base.
+
+Uso:
+    python benchmark_opciones.py --preset mediano
+    python benchmark_opciones.py --tickers 150 --expirations 12 --strikes 300 --save-baseline
+    python benchmark_opciones.py --preset grande --baseline benchmark_baseline.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import analizar_opciones_experimental as analizador
+
+# Tamaños predefinidos: (tickers, vencimientos, strikes por lado)
+PRESETS = {
+    "pequeno": (5, 2, 10),
+    "mediano": (30, 6, 100),
+    "grande": (120, 12, 250),
+}
+
+class SyntheticProvider(analizador.MarketDataProvider):
+    """
+    Fuente de datos sintética y determinista con la misma forma que Yahoo. Cada ticker tiene un
+    precio, una volatilidad base y una sonrisa de volatilidad; las primas se aproximan a partir
+    de la IV para que los filtros de rentabilidad y diferencia porcentual se comporten como con
+    datos reales. Las cadenas se generan una sola vez y se memorizan.
+    """
+    name = "synthetic"
+
+    def __init__(self, n_tickers, n_expirations, n_strikes, seed=42):
+        self.symbols = [f"SYN{i:03d}" for i in range(n_tickers)]
+        self.n_expirations = n_expirations
+        self.n_strikes = n_strikes
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.prices = dict(zip(self.symbols, rng.uniform(10, 800, n_tickers)))
+        self.base_ivs = dict(zip(self.symbols, rng.uniform(0.15, 1.1, n_tickers)))
+        self.volumes = dict(zip(self.symbols, rng.integers(2e5, 5e7, n_tickers)))
+        self._lock = threading.Lock()
+        self._chains = {}
+
+    def _rng(self, *key):
+        # crc32 en lugar de hash(): los hashes de str cambian entre procesos y el benchmark sería no determinista
+        return np.random.default_rng([self.seed] + [zlib.crc32(str(k).encode()) for k in key])
+
+    def info(self, symbol):
+        price = self.prices[symbol]
+        return {
+            "regularMarketPrice": price,
+            "previousClose": price,
+            "averageVolume": int(self.volumes[symbol]),
+            "fiftyTwoWeekLow": price * 0.7,
+            "fiftyTwoWeekHigh": price * 1.3,
+        }
+
+    def options(self, symbol):
+        today = analizador.analysis_now().date()
+        return tuple((today + timedelta(days=3 + 7 * i)).strftime('%Y-%m-%d') for i in range(self.n_expirations))
+
+    def _side(self, symbol, expiration, kind, rng):
+        price = self.prices[symbol]
+        days = max((pd.Timestamp(expiration) - pd.Timestamp(analizador.analysis_now().date())).days, 1)
+        t = days / 365
+        strikes = np.round(np.linspace(price * 0.5, price * 1.5, self.n_strikes), 2)
+        moneyness = np.log(strikes / price)
+        iv = self.base_ivs[symbol] * (1 + 0.8 * moneyness ** 2) * rng.uniform(0.9, 1.1, self.n_strikes)
+        sd = np.maximum(iv * np.sqrt(t), 1e-6)
+        time_value = 0.4 * price * sd * np.exp(-0.5 * (moneyness / sd) ** 2)
+        intrinsic = np.maximum(strikes - price, 0) if kind == "P" else np.maximum(price - strikes, 0)
+        last_price = np.round(intrinsic + time_value, 2)
+        volume = rng.integers(0, 2000, self.n_strikes).astype(float)
+        volume[rng.random(self.n_strikes) < 0.1] = np.nan
+        return pd.DataFrame({
+            "contractSymbol": [f"{symbol}{expiration.replace('-', '')}{kind}{int(k * 1000):08d}" for k in strikes],
+            "strike": strikes,
+            "lastPrice": last_price,
+            "bid": np.round(last_price * rng.uniform(0.9, 1.0, self.n_strikes), 2),
+            "ask": np.round(last_price * rng.uniform(1.0, 1.1, self.n_strikes), 2),
+            "volume": volume,
+            "openInterest": rng.integers(0, 5000, self.n_strikes).astype(float),
+            "impliedVolatility": iv,
+            "inTheMoney": intrinsic > 0,
+        })
+
+    def option_chain(self, symbol, expiration):
+        key = (symbol, expiration)
+        with self._lock:
+            if key in self._chains:
+                return self._chains[key]
+        rng = self._rng(symbol, expiration)
+        chain = analizador.OptionChain(
+            calls=self._side(symbol, expiration, "C", rng),
+            puts=self._side(symbol, expiration, "P", rng)
+        )
+        with self._lock:
+            self._chains[key] = chain
+        return chain
+
+    def _closes(self, symbol, index):
+        rng = self._rng(symbol, "history")
+        daily_vol = self.base_ivs[symbol] * rng.uniform(0.6, 1.2) / np.sqrt(252)
+        return self.prices[symbol] * np.exp(np.cumsum(rng.normal(0, daily_vol, len(index))))
+
+    def history(self, symbol, start, end):
+        index = pd.bdate_range(start=start.date(), end=end.date(), inclusive="left")
+        return pd.DataFrame({"Close": self._closes(symbol, index)}, index=index)
+
+    def download(self, symbols, period):
+        days = {"3mo": 90, "6mo": 180, "1y": 365, "2y": 730}[period]
+        end = analizador.analysis_now().date()
+        index = pd.bdate_range(end=end, periods=int(days * 5 / 7))
+        closes = pd.DataFrame({symbol: self._closes(symbol, index) for symbol in symbols}, index=index)
+        volumes = pd.DataFrame({symbol: float(self.volumes[symbol]) for symbol in symbols}, index=index)
+        return pd.concat({"Close": closes, "Volume": volumes}, axis=1)
+
+    def contracts_within(self, max_days):
+        """Número de puts con vencimiento dentro de max_days días (los que examina el filtrado)."""
+        today = analizador.analysis_now()
+        in_range = sum(
+            1 for expiration in self.options(self.symbols[0])
+            if 0 < (pd.Timestamp(expiration) - pd.Timestamp(today)).days <= max_days
+        )
+        return in_range * self.n_strikes * len(self.symbols)
+
+def run_stage(function, contracts, measure_memory):
+    """
+    Ejecuta una etapa cronometrada y, si se pide, una segunda vez bajo tracemalloc para medir su
+    pico de memoria sin contaminar el tiempo. Retorna (resultado, métricas de la etapa).
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+
+        peak_mb = None
+        if measure_memory:
+            tracemalloc.start()
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak_mb = peak / (1024 * 1024)
+
+    metrics = {
+        "seconds": seconds,
+        "contracts": contracts,
+        "contracts_per_second": contracts / seconds if seconds > 0 else None,
+        "peak_mb": peak_mb,
+    }
+    return result, metrics
+
+def run_benchmark(n_tickers, n_expirations, n_strikes, group_type, measure_memory=True, seed=42):
+    """Ejecuta todas las etapas sobre un universo sintético y retorna las métricas por etapa."""
+    provider = SyntheticProvider(n_tickers, n_expirations, n_strikes, seed=seed)
+    analizador.set_analysis_time(None)
+    analizador.market_data_cache.provider = provider
+    analizador.market_data_cache.snapshot_store = None
+    config = analizador.GROUPS_CONFIG[group_type]["config"]
+    criteria = dict(analizador.GROUPS_CONFIG["nasdaq_top_volatility"]["dynamic_criteria"])
+    criteria["top"] = max(1, n_tickers // 4)
+
+    # Generar los datos sintéticos antes de cronometrar, para medir el pipeline y no el generador
+    for symbol in provider.symbols:
+        for expiration in provider.options(symbol):
+            provider.option_chain(symbol, expiration)
+
+    stages = {}
+
+    def screener():
+        analizador.market_data_cache.clear()
+        return analizador.generate_dynamic_tickers({"tickers": provider.symbols}, criteria)
+    _, stages["screener"] = run_stage(screener, provider.contracts_within(45), measure_memory)
+
+    # El resto de etapas trabajan con la caché ya caliente, como tras el screener en una ejecución real
+    analizador.prefetch_market_data(provider.symbols, config["MAX_DIAS_VENCIMIENTO"])
+
+    def filtering():
+        return [analizador.get_option_data_yahoo(symbol, config) for symbol in provider.symbols]
+    options_by_ticker, stages["filtrado"] = run_stage(
+        filtering, provider.contracts_within(config["MAX_DIAS_VENCIMIENTO"]), measure_memory
+    )
+    kept = sum(len(options) for options in options_by_ticker)
+
+    def ranking():
+        return [
+            analizador.rank_contracts(options, config) if not options.empty else (None, None)
+            for options in options_by_ticker
+        ]
+    ranked, stages["ranking"] = run_stage(ranking, kept, measure_memory)
+
+    output_dir = tempfile.mkdtemp(prefix="benchmark_opciones_")
+    try:
+        def reporting():
+            results = []
+            for symbol, options, (filtered_contracts, best_contracts) in zip(provider.symbols, options_by_ticker, ranked):
+                message = ""
+                if filtered_contracts is not None:
+                    message = analizador.render_ticker_report(symbol, options, filtered_contracts, config)
+                results.append({
+                    "ticker": symbol,
+                    "message": message,
+                    "options": options,
+                    "filtered_contracts": filtered_contracts,
+                    "best_contracts": best_contracts,
+                    "error": None
+                })
+            return analizador.write_group_outputs(results, "Benchmark sintético", output_dir)
+        _, stages["reporte"] = run_stage(reporting, kept, measure_memory)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return {
+        "params": {
+            "tickers": n_tickers,
+            "expirations": n_expirations,
+            "strikes": n_strikes,
+            "group": group_type,
+            "seed": seed,
+        },
+        "contracts_generated": n_tickers * n_expirations * n_strikes * 2,
+        "contracts_kept": kept,
+        "stages": stages,
+    }
+
+def print_report(report, baseline=None, tolerance=0.2):
+    """Muestra las métricas por etapa y, si hay línea base, la variación. Retorna las etapas con regresión."""
+    params = report["params"]
+    print(f"Universo sintético: {params['tickers']} tickers x {params['expirations']} vencimientos x "
+          f"{params['strikes']} strikes ({report['contracts_generated']} contratos, {report['contracts_kept']} tras filtros)")
+    if baseline is not None and baseline.get("params") != params:
+        print("Aviso: la línea base se generó con otros parámetros; la comparación es orientativa")
+
+    regressions = []
+    header = f"{'Etapa':<10} {'Tiempo (s)':>11} {'Contratos/s':>14} {'Pico (MB)':>10}"
+    if baseline is not None:
+        header += f" {'Base (s)':>10} {'Cambio':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, stage in report["stages"].items():
+        throughput = f"{stage['contracts_per_second']:,.0f}" if stage["contracts_per_second"] else "-"
+        peak = f"{stage['peak_mb']:.1f}" if stage["peak_mb"] is not None else "-"
+        line = f"{name:<10} {stage['seconds']:>11.4f} {throughput:>14} {peak:>10}"
+        base_stage = (baseline or {}).get("stages", {}).get(name)
+        if base_stage:
+            change = (stage["seconds"] - base_stage["seconds"]) / base_stage["seconds"] if base_stage["seconds"] else 0.0
+            line += f" {base_stage['seconds']:>10.4f} {change:>+8.1%}"
+            if change > tolerance:
+                line += "  REGRESIÓN"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del analizador de opciones con cadenas sintéticas")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="mediano", help="Tamaño predefinido del universo")
+    parser.add_argument("--tickers", type=int, help="Número de tickers (sustituye al preset)")
+    parser.add_argument("--expirations", type=int, help="Vencimientos por ticker (sustituye al preset)")
+    parser.add_argument("--strikes", type=int, help="Strikes por lado y vencimiento (sustituye al preset)")
+    parser.add_argument("--group", default="7magnificas", choices=sorted(analizador.GROUPS_CONFIG), help="Grupo cuya configuración se aplica")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-memory", action="store_true", help="No medir el pico de memoria (evita repetir cada etapa)")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="Archivo de línea base para comparar")
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar este resultado como nueva línea base")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Aumento relativo de tiempo que se considera regresión")
+    parser.add_argument("--output", help="Guardar el resultado completo en este archivo JSON")
+    args = parser.parse_args(argv)
+
+    logging.getLogger(analizador.__name__).setLevel(logging.WARNING)
+    n_tickers, n_expirations, n_strikes = PRESETS[args.preset]
+    report = run_benchmark(
+        args.tickers or n_tickers,
+        args.expirations or n_expirations,
+        args.strikes or n_strikes,
+        args.group,
+        measure_memory=not args.no_memory,
+        seed=args.seed
+    )
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, args.tolerance)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Línea base guardada en {args.baseline}")
+    if regressions:
+        print(f"Regresiones por encima del {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())